@@ -0,0 +1,265 @@
+#! /usr/bin/python3
+
+
+# STIG benchmark - Time each stage of STIG against a synthetic reference
+#
+# Copyright (C) 2018 The University of North Carolina at Chapel Hill
+# See LICENSE.txt
+
+import sys
+import time
+import json
+import random
+import argparse
+import logging
+import tempfile
+import shutil
+import platform
+
+import numpy
+
+import stigtools
+
+# Configure our logging
+log = logging.getLogger('benchmark')
+log.setLevel(logging.WARNING)
+
+sh = logging.StreamHandler()
+sh.setFormatter(logging.Formatter(fmt='%(asctime)s.%(msecs)03d [%(levelname)s] %(name)s %(message)s',
+                                  datefmt='%Y%m%d%H%M%S'))
+log.addHandler(sh);
+
+
+parser = argparse.ArgumentParser(description = "Benchmark STIG against a synthetic reference",
+																 epilog = "Please see manual or README for further details" )
+
+parser.add_argument('working_dir', metavar='WORKING_DIR', type=str, nargs='?', default='data',
+										help="Directory with tcell_receptor.tsv, tcell_recombination.yaml & allele subdir.  Reference chromosomes are not needed, a synthetic reference is generated from these.  Default is 'data'")
+parser.add_argument("--output", metavar='FILE', default='-',
+										help="Write benchmark results as JSON to FILE.  Default is to write to standard output")
+parser.add_argument("--baseline", metavar='FILE', type=str,
+										help="Compare results to a JSON results FILE from an earlier run, e.g. of an earlier version of STIG")
+parser.add_argument("--max-slowdown", metavar='RATIO', type=float, default=None,
+										help="With --baseline, exit with status 1 if any stage is slower than RATIO times its baseline time")
+parser.add_argument("--reference-dir", metavar='DIR', type=str,
+										help="Directory in which to write the synthetic reference, which is kept.  Default is a temporary directory, which is removed")
+parser.add_argument("--full-reference", action = 'store_true',
+										help="Keep the hg38 coordinates in the synthetic reference, rather than compacting each locus to the start of its chromosome.  This gives full-sized chromosome files")
+parser.add_argument("--repeat", metavar='N', type=int, default=3,
+										help="Number of times each stage is run.  The fastest run is reported.  Default is 3")
+parser.add_argument("--seed", metavar='N', type=int, default=1,
+										help="Random seed, set before each run of each stage.  Default is 1")
+parser.add_argument("--iterations", metavar='N', type=int, default=1000,
+										help="Number of segment choices and recombinations to time.  Default is 1000")
+parser.add_argument('--repertoire-size', metavar='N', type=int, default=100,
+										help='Size of the TCR repertoires generated.  Default is 100')
+parser.add_argument('--population-size', metavar='N', type=int, default=1000000,
+										help='Number of cells in the populations generated.  Default is 1000000')
+parser.add_argument('--sequence-count', metavar='N', type=int, default=10000,
+										help='Number of reads generated for each read type.  Default is 10000')
+parser.add_argument('--log-level', choices=['debug', 'info', 'warning', 'error', 'critical'], default='warning',
+										help='Logging level.  Default is warning and above')
+
+args = parser.parse_args()
+log.setLevel(getattr(logging, args.log_level.upper()))
+
+if args.repeat < 1:
+		parser.error("--repeat must be at least 1")
+
+
+# timeStage - Time a stage of STIG, storing the results in stages
+#
+# Arguments:
+# name     - Name of the stage
+# function - Function to time.  It is called with no arguments, and its
+#            return value from the last run is returned
+# count    - Number of items (e.g. reads) processed by each call to function
+# setup    - Optional.  Function called, untimed, before each run
+#
+# Returns:
+# Return value of the last call to function
+#
+stages = {}
+config = None
+def timeStage( name, function, count=1, setup=None ):
+		log.info("Timing %s", name)
+		runs = []
+		for i in range(0, args.repeat):
+				random.seed(args.seed)
+				if config is not None:
+						config.random.seed(args.seed)
+				if setup is not None:
+						setup()
+				start = time.perf_counter()
+				retval = function()
+				runs.append(time.perf_counter() - start)
+
+		stages[name] = {
+				'count': count,
+				'seconds': min(runs),
+				'median_seconds': float(numpy.median(runs)),
+				'per_item_seconds': min(runs) / count if count > 0 else None,
+				'runs': runs
+				}
+		log.info("%s: %0.6fs", name, min(runs))
+		return retval
+
+
+
+# Build the synthetic reference
+referenceDir = args.reference_dir
+if referenceDir is None:
+		referenceDir = tempfile.mkdtemp(prefix='stig-benchmark-')
+
+start = time.perf_counter()
+chromosomeLengths = stigtools.makeSyntheticReference(args.working_dir, referenceDir, compact = not args.full_reference, seed=args.seed)
+referenceSeconds = time.perf_counter() - start
+
+outputDir = tempfile.mkdtemp(prefix='stig-benchmark-output-')
+
+try:
+		# Configuration
+		def setWorkingDir():
+				config = stigtools.tcrConfig(log=log.getChild('tcrConfig'))
+				config.setWorkingDir(referenceDir)
+				return config
+		config = timeStage('setWorkingDir', setWorkingDir)
+
+
+		# Segment selection
+		def chooseSegments():
+				segments = []
+				for i in range(0, args.iterations):
+						receptorType = random.choice('ABGD')
+						V = config.chooseRandomSegment(receptorType, componentName='V')
+						D = None
+						if receptorType in ('B', 'D'):
+								D = config.chooseRandomSegment(receptorType, componentName='D', V=V)
+						J = config.chooseRandomSegment(receptorType, componentName='J', V=V, D=D)
+						C = config.chooseRandomSegment(receptorType, componentName='C', V=V, D=D, J=J)
+						segments.append((V, D, J, C))
+				return segments
+		segments = timeStage('chooseRandomSegment', chooseSegments, count=args.iterations)
+
+
+		# Recombination, without the benefit of previously cached sequences
+		timeStage('recombinate', lambda: [ config.recombinate(*x) for x in segments ],
+							count=args.iterations, setup=config.sequenceCache.clear)
+
+
+		# Repertoire construction with each of the uniqueness constraints
+		repertoire = None
+		for name, flags in (('none', {}),
+												('tcr', {'uniqueTCR': True}),
+												('chain', {'uniqueChain': True}),
+												('cdr3', {'uniqueCDR3': True})):
+				repertoire = timeStage('tcrRepertoire:unique=%s' % name,
+															 lambda: stigtools.tcrRepertoire(config, args.repertoire_size, log=log.getChild('tcrRepertoire'), **flags),
+															 count=args.repertoire_size, setup=config.sequenceCache.clear)
+
+
+		# Population distributions
+		for distribution in repertoire.distribution_options:
+				timeStage('populate:%s' % distribution, lambda: repertoire.populate(args.population_size, distribution),
+									count=args.population_size)
+		repertoire.populate(args.population_size, 'logisticcdf')
+
+
+		# Read generation
+		reads = {}
+		for readType in ('single', 'paired', 'amplicon'):
+				for space in ('dna', 'rna'):
+						reads[(readType, space)] = timeStage('simulateRead:%s:%s' % (readType, space),
+																								 lambda: repertoire.simulateRead(args.sequence_count, space, read_type=readType,
+																																								 read_length_mean=48, insert_length_mean=100),
+																								 count=args.sequence_count)
+
+
+		# Degradation
+		singleReads = reads[('single', 'rna')]
+		timeStage('getDegradedFastq:logistic',
+							lambda: [ config.getDegradedFastq(read, 'logistic', comment, baseError=0.005, L=0.2, k=0.25, midpoint=15) for read, comment in singleReads ],
+							count=len(singleReads))
+		timeStage('getDegradedFastq:phred',
+							lambda: [ config.getDegradedFastq(read, 'phred', comment, phred='IIIIIIIIIIIIIIIIIIII4444433333') for read, comment in singleReads ],
+							count=len(singleReads))
+
+
+		# Output
+		def writeFastq():
+				with open('%s/benchmark.fastq' % outputDir, 'wb') as fp:
+						fp.write(stigtools.pipeline.getFastq(singleReads, 'single')[0])
+		timeStage('output:fastq', writeFastq, count=len(singleReads))
+
+		timeStage('output:statistics', lambda: stigtools.writeStatistics(repertoire, '%s/benchmark.statistics.csv' % outputDir),
+							count=args.repertoire_size, setup=config.sequenceCache.clear)
+		timeStage('output:statistics-no-sequences', lambda: stigtools.writeStatistics(repertoire, '%s/benchmark.statistics.csv' % outputDir, sequences=False),
+							count=args.repertoire_size)
+
+		populationFilename = '%s/benchmark.population.bin' % outputDir
+		timeStage('output:savePopulation', lambda: stigtools.savePopulation(repertoire, populationFilename), count=args.repertoire_size)
+		timeStage('output:loadPopulation', lambda: stigtools.loadPopulation(populationFilename, config), count=args.repertoire_size)
+
+finally:
+		shutil.rmtree(outputDir)
+		if args.reference_dir is None:
+				shutil.rmtree(referenceDir)
+
+
+results = {
+		'benchmark_format': 1,
+		'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+		'platform': {
+				'python': platform.python_version(),
+				'numpy': numpy.__version__,
+				'system': platform.platform(),
+				'processor': platform.processor()
+				},
+		'parameters': {
+				'repeat': args.repeat,
+				'seed': args.seed,
+				'iterations': args.iterations,
+				'repertoire_size': args.repertoire_size,
+				'population_size': args.population_size,
+				'sequence_count': args.sequence_count,
+				'full_reference': args.full_reference
+				},
+		'reference': {
+				'seconds': referenceSeconds,
+				'chromosome_length': chromosomeLengths
+				},
+		'stages': stages
+		}
+
+if args.output == '-':
+		json.dump(results, sys.stdout, indent=2, sort_keys=True)
+		sys.stdout.write("\n")
+else:
+		with open(args.output, 'w') as fp:
+				json.dump(results, fp, indent=2, sort_keys=True)
+				fp.write("\n")
+
+
+# Compare against an earlier run, if requested
+exitStatus = 0
+if args.baseline is not None:
+		with open(args.baseline) as fp:
+				baseline = json.load(fp)
+		if baseline['parameters'] != results['parameters']:
+				log.warning("Baseline %s was run with different parameters, times may not be comparable", args.baseline)
+
+		# Stages are compared by their time per item, which allows for some differences in parameters
+		sys.stderr.write("%-32s %17s %17s %8s\n" % ('stage', 'baseline (s/item)', 'current (s/item)', 'ratio'))
+		for name in sorted(stages.keys()):
+				current = stages[name]['per_item_seconds']
+				if name not in baseline['stages']:
+						sys.stderr.write("%-32s %17s %17.8f %8s\n" % (name, '-', current, '-'))
+						continue
+				previous = baseline['stages'][name]['per_item_seconds']
+				ratio = current / max(previous, 1e-12)
+				sys.stderr.write("%-32s %17.8f %17.8f %8.2f\n" % (name, previous, current, ratio))
+				if args.max_slowdown is not None and ratio > args.max_slowdown:
+						log.error("Stage %s is %0.2f times slower than its baseline", name, ratio)
+						exitStatus = 1
+
+exit(exitStatus)
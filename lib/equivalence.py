@@ -0,0 +1,391 @@
+#! /usr/bin/python3
+
+
+# STIG equivalence - Compare the output distributions and speed of two
+#                    versions of STIG against a synthetic reference
+#
+# Copyright (C) 2018 The University of North Carolina at Chapel Hill
+# See LICENSE.txt
+
+import sys
+import os
+import re
+import time
+import json
+import random
+import argparse
+import logging
+import tempfile
+import shutil
+import platform
+import collections
+
+import numpy
+
+import stigtools
+from stigtools.equivalence import loadEngine
+from stigtools.equivalence import chiSquareTest
+from stigtools.equivalence import ksTest
+
+# Configure our logging
+log = logging.getLogger('equivalence')
+log.setLevel(logging.WARNING)
+
+sh = logging.StreamHandler()
+sh.setFormatter(logging.Formatter(fmt='%(asctime)s.%(msecs)03d [%(levelname)s] %(name)s %(message)s',
+                                  datefmt='%Y%m%d%H%M%S'))
+log.addHandler(sh);
+
+
+parser = argparse.ArgumentParser(description = "Compare the output distributions and speed of two versions of STIG against a synthetic reference",
+																 epilog = "Please see manual or README for further details" )
+
+parser.add_argument('working_dir', metavar='WORKING_DIR', type=str, nargs='?', default='data',
+										help="Directory with tcell_receptor.tsv, tcell_recombination.yaml & allele subdir.  Reference chromosomes are not needed, a synthetic reference is generated from these.  Default is 'data'")
+parser.add_argument("--legacy", metavar='DIR', type=str, required=True,
+										help="lib directory of the version of STIG compared against (the legacy engine), e.g. of a git worktree of an earlier release")
+parser.add_argument("--fast", metavar='DIR', type=str, default=os.path.dirname(os.path.abspath(__file__)),
+										help="lib directory of the version of STIG tested (the fast engine).  Default is the directory of this script")
+parser.add_argument("--output", metavar='FILE', default='-',
+										help="Write the results as JSON to FILE.  Default is to write to standard output")
+parser.add_argument("--alpha", metavar='P', type=float, default=0.01,
+										help="Significance level of the comparison as a whole.  Each test is made at P divided by the number of tests (Bonferroni), and the exit status is 1 if any test fails.  Default is 0.01")
+parser.add_argument("--expect-difference", metavar='TEST', type=str, action='append', default=[],
+										help="Expect the engines to differ in TEST, a test name or the start of test names up to a ':', for an intentional change in behaviour.  Such tests are still made and reported, but do not set the exit status.  May be given more than once.  E.g. getDegradedFastq:logistic against STIG 0.6 and earlier, whose logistic degradation truncated reads")
+parser.add_argument("--reference-dir", metavar='DIR', type=str,
+										help="Directory in which to write the synthetic reference, which is kept.  Default is a temporary directory, which is removed")
+parser.add_argument("--repeat", metavar='N', type=int, default=1,
+										help="Number of times each stage is timed in each engine.  The fastest run is reported.  Default is 1")
+parser.add_argument("--seed", metavar='N', type=int, default=1,
+										help="Random seed.  The legacy engine is seeded with N and the fast engine with N + 1 before each stage, so that their samples are independent.  Default is 1")
+parser.add_argument("--iterations", metavar='N', type=int, default=5000,
+										help="Number of segment choices and recombinations sampled.  Default is 5000")
+parser.add_argument('--repertoire-size', metavar='N', type=int, default=500,
+										help='Size of the TCR repertoires generated.  Default is 500')
+parser.add_argument('--population-size', metavar='N', type=int, default=100000,
+										help='Number of cells in the populations generated.  Default is 100000')
+parser.add_argument('--sequence-count', metavar='N', type=int, default=20000,
+										help='Number of reads generated for each read type.  Default is 20000')
+parser.add_argument('--log-level', choices=['debug', 'info', 'warning', 'error', 'critical'], default='warning',
+										help='Logging level.  Default is warning and above')
+
+args = parser.parse_args()
+log.setLevel(getattr(logging, args.log_level.upper()))
+
+if args.repeat < 1:
+		parser.error("--repeat must be at least 1")
+
+engineNames = ('legacy', 'fast')
+engines = { 'legacy': loadEngine(args.legacy, 'stigtools_legacy'),
+						'fast':   loadEngine(args.fast, 'stigtools_fast') }
+
+
+# seedEngine - Seed the random sources of an engine.  Earlier versions of
+#              STIG draw from the random and numpy.random modules, later
+#              versions from their configuration's tcrRandom
+#
+def seedEngine( name, config=None ):
+		seed = args.seed + engineNames.index(name)
+		random.seed(seed)
+		numpy.random.seed(seed)
+		if config is not None and hasattr(config, 'random'):
+				config.random.seed(seed)
+
+
+# timeStage - Time a stage of STIG in an engine, storing the results in
+#             stages
+#
+# Arguments:
+# stage    - Name of the stage
+# name     - Name of the engine, 'legacy' or 'fast'
+# function - Function to time.  It is called with no arguments, and its
+#            return value from the last run is returned
+# config   - Optional.  tcrConfig of the engine, seeded before each run
+# setup    - Optional.  Function called, untimed, before each run
+#
+# Returns:
+# Return value of the last call to function
+#
+stages = collections.defaultdict(dict)
+def timeStage( stage, name, function, config=None, setup=None ):
+		log.info("Timing %s (%s)", stage, name)
+		runs = []
+		for i in range(0, args.repeat):
+				seedEngine(name, config)
+				if setup is not None:
+						setup()
+				start = time.perf_counter()
+				retval = function()
+				runs.append(time.perf_counter() - start)
+		stages[stage][name] = min(runs)
+		return retval
+
+
+# addSample - Store a sample of an engine's output, compared with the other engine's below
+#
+# Arguments:
+# test   - Name of the test
+# name   - Name of the engine
+# method - 'chi-square', for a dict of category -> count, or 'ks', for a
+#          list of values
+# sample - The sample
+#
+samples = collections.defaultdict(dict)
+def addSample( test, name, method, sample ):
+		samples[test]['method'] = method
+		samples[test][name] = sample
+
+
+# getSegmentName - Return the gene and allele of a segment chosen by
+#                  tcrConfig.chooseRandomSegment(), e.g. 'TRBV7-3*05'
+#
+def getSegmentName( config, segment ):
+		index, allele = segment
+		return '%s*%s' % (config.receptorSegment[index]['gene'], allele)
+
+
+# getComment - Return the fields of a read comment as a dict, e.g.
+#              {'readnum': '0', 'clone': '3', 'chain': 'B', 'randpos': '25'}
+#
+def getComment( comment ):
+		return dict(re.findall(r'(\w+)=(-?\w+)', comment))
+
+
+
+# Build the synthetic reference
+referenceDir = args.reference_dir
+if referenceDir is None:
+		referenceDir = tempfile.mkdtemp(prefix='stig-equivalence-')
+stigtools.makeSyntheticReference(args.working_dir, referenceDir, seed=args.seed)
+
+try:
+		configs = {}
+		repertoires = {}
+		for name in engineNames:
+				engine = engines[name]
+				log.info("Sampling the %s engine, %s", name, os.path.dirname(engine.__file__))
+
+				# Configuration
+				def setWorkingDir():
+						config = engine.tcrConfig(log=log.getChild(name))
+						config.setWorkingDir(referenceDir)
+						return config
+				config = configs[name] = timeStage('setWorkingDir', name, setWorkingDir)
+				clearCache = getattr(config, 'sequenceCache', {}).clear
+
+
+				# Segment selection, for each receptor type in turn
+				def chooseSegments():
+						segments = []
+						for i in range(0, args.iterations):
+								receptorType = 'ABGD'[i % 4]
+								V = config.chooseRandomSegment(receptorType, componentName='V')
+								D = None
+								if receptorType in ('B', 'D'):
+										D = config.chooseRandomSegment(receptorType, componentName='D', V=V)
+								J = config.chooseRandomSegment(receptorType, componentName='J', V=V, D=D)
+								C = config.chooseRandomSegment(receptorType, componentName='C', V=V, D=D, J=J)
+								segments.append((V, D, J, C))
+						return segments
+				segments = timeStage('chooseRandomSegment', name, chooseSegments, config)
+				for i, component in enumerate('VDJC'):
+						addSample('chooseRandomSegment:%s' % component, name, 'chi-square',
+											collections.Counter(getSegmentName(config, x[i]) for x in segments if x[i] is not None))
+
+
+				# Recombination.  Each roll of a chewback or addition length is
+				# recorded, by the junction probability table it is rolled from
+				rolls = collections.defaultdict(collections.Counter)
+				tables = dict((id(table), key) for key, table in config.junctionProbability.items())
+				roll = config.roll
+				def recordRoll( probability ):
+						value = roll(probability)
+						if id(probability) in tables:
+								rolls[tables[id(probability)]][value] += 1
+						return value
+				config.roll = recordRoll
+				def setup():
+						rolls.clear()
+						clearCache()
+				sequences = timeStage('recombinate', name, lambda: [ config.recombinate(*x) for x in segments ], config, setup)
+				del config.roll
+				for key in rolls:
+						addSample('recombinate:roll:%s' % key, name, 'chi-square', rolls[key])
+				addSample('recombinate:accepted', name, 'chi-square', collections.Counter(x is not None for x in sequences))
+				addSample('recombinate:cdr3_length', name, 'chi-square',
+									collections.Counter(len(config.getCDR3Sequence(x[1][3])) for x in sequences if x is not None))
+
+
+				# Repertoire construction
+				repertoire = repertoires[name] = timeStage('tcrRepertoire', name, lambda: engine.tcrRepertoire(config, args.repertoire_size, log=log.getChild(name)),
+																									 config, clearCache)
+				addSample('tcrRepertoire:receptor_type', name, 'chi-square', collections.Counter(x.type1 + x.type2 for x in repertoire.repertoire))
+				addSample('tcrRepertoire:V', name, 'chi-square', collections.Counter(getSegmentName(config, y) for x in repertoire.repertoire for y in (x.V1, x.V2)))
+				addSample('tcrRepertoire:cdr3_length', name, 'chi-square', collections.Counter(len(y) for x in repertoire.repertoire for y in x.getCDR3Sequences()))
+
+
+				# Population distributions, compared by their clone sizes.  Earlier
+				# versions of STIG add to the population, so it is emptied first
+				def emptyPopulation():
+						repertoire.population = [ 0 ] * len(repertoire.repertoire)
+				for distribution in repertoire.distribution_options:
+						timeStage('populate:%s' % distribution, name, lambda: repertoire.populate(args.population_size, distribution), config, emptyPopulation)
+						addSample('populate:%s' % distribution, name, 'ks', [ int(x) for x in repertoire.population ])
+
+
+		# Reads are sampled by both engines from the same repertoire, generated by
+		# the fast engine, as reads depend heavily on the clones they are read
+		# from.  Clones are copied into each engine by their sequences
+		shared = repertoires['fast']
+		seedEngine('fast', configs['fast'])
+		shared.populate(args.population_size, 'logisticcdf')
+		clones = [ (x.type1, x.type2, x.DNA1, x.RNA1, x.DNA2, x.RNA2) for x in shared.repertoire ]
+		population = [ int(x) for x in shared.population ]
+
+		degradeReads = None
+		for name in engineNames:
+				engine = engines[name]
+				config = configs[name]
+				repertoire = engine.tcrRepertoire(config, 0, log=log.getChild(name))
+				repertoire.repertoire = []
+				for type1, type2, DNA1, RNA1, DNA2, RNA2 in clones:
+						clone = engine.tcr(0.9, config)
+						clone.type1, clone.type2 = type1, type2
+						clone.DNA1, clone.RNA1, clone.DNA2, clone.RNA2 = DNA1, RNA1, DNA2, RNA2
+						repertoire.repertoire.append(clone)
+				repertoire.population = list(population)
+				repertoire.population_size = sum(population)
+
+
+				# Read generation
+				for readType, space in (('single', 'rna'), ('single', 'dna'), ('paired', 'rna'), ('amplicon', 'rna')):
+						stage = 'simulateRead:%s:%s' % (readType, space)
+						reads = timeStage(stage, name, lambda: repertoire.simulateRead(args.sequence_count, space, read_type=readType,
+																																					 read_length_mean=48, insert_length_mean=100), config)
+						comments = [ getComment(comment) for read, comment in reads ]
+						addSample(stage + ':clone', name, 'chi-square', collections.Counter(x['clone'] for x in comments))
+						addSample(stage + ':chain', name, 'chi-square', collections.Counter(x['chain'] for x in comments))
+						if readType == 'single':
+								addSample(stage + ':start', name, 'ks', [ int(x['randpos']) for x in comments ])
+								addSample(stage + ':length', name, 'ks', [ len(read) for read, comment in reads ])
+						elif readType == 'paired':
+								addSample(stage + ':start', name, 'ks', [ int(x['randpos']) for x in comments ])
+								addSample(stage + ':read1_length', name, 'ks', [ len(pair[0]) for pair, comment in reads ])
+								addSample(stage + ':read2_length', name, 'ks', [ len(pair[1]) for pair, comment in reads ])
+						else:
+								addSample(stage + ':start', name, 'ks', [ int(x['ampliconStartPos']) for x in comments ])
+								addSample(stage + ':length', name, 'ks', [ len(pair[0]) for pair, comment in reads ])
+						if name == 'fast' and readType == 'single' and space == 'rna':
+								degradeReads = reads
+
+
+		# Degradation of the same reads by both engines.  The error profile counts
+		# the bases changed at each position, with those unchanged, so that it
+		# compares both the error rate and where errors fall
+		for name in engineNames:
+				config = configs[name]
+				for method, options in (('logistic', { 'baseError': 0.005, 'L': 0.2, 'k': 0.25, 'midpoint': 15, 'variability': 0.1 }),
+																('phred', { 'phred': 'IIIIIIIIIIIIIIIIIIII4444433333' })):
+						stage = 'getDegradedFastq:%s' % method
+						output = timeStage(stage, name, lambda: [ config.getDegradedFastq(read, method, comment, **options) for read, comment in degradeReads ], config)
+						lengths = collections.Counter()
+						errors = collections.Counter()
+						qualities = collections.Counter()
+						for (read, comment), fastq in zip(degradeReads, output):
+								lines = fastq.split("\n")
+								lengths[len(lines[1]) - len(read)] += 1
+								qualities.update(lines[3])
+								for i, (base, degraded) in enumerate(zip(read, lines[1])):
+										errors[i if base != degraded else 'unchanged'] += 1
+						addSample(stage + ':length', name, 'chi-square', lengths)
+						addSample(stage + ':errors', name, 'chi-square', errors)
+						addSample(stage + ':quality', name, 'chi-square', qualities)
+
+finally:
+		if args.reference_dir is None:
+				shutil.rmtree(referenceDir)
+
+
+# Compare the samples of the two engines
+tests = {}
+for test in sorted(samples.keys()):
+		sample = samples[test]
+		if any(x not in sample for x in engineNames):
+				tests[test] = { 'method': sample['method'], 'skipped': "Not sampled by the %s engine" % ' or '.join(x for x in engineNames if x not in sample) }
+				continue
+		try:
+				if sample['method'] == 'chi-square':
+						statistic, p, freedom = chiSquareTest(sample['legacy'], sample['fast'])
+						sizes = [ sum(sample[x].values()) for x in engineNames ]
+				else:
+						statistic, p = ksTest(sample['legacy'], sample['fast'])
+						freedom = None
+						sizes = [ len(sample[x]) for x in engineNames ]
+		except ValueError as error:
+				tests[test] = { 'method': sample['method'], 'skipped': str(error) }
+				continue
+		tests[test] = { 'method': sample['method'], 'statistic': statistic, 'p_value': p, 'degrees_of_freedom': freedom, 'samples': sizes }
+
+compared = [ x for x in tests.values() if 'skipped' not in x ]
+threshold = args.alpha / max(1, len(compared))
+for test in compared:
+		test['passed'] = test['p_value'] >= threshold
+for name in tests:
+		tests[name]['expected_difference'] = any(name == x or name.startswith(x + ':') for x in args.expect_difference)
+
+results = {
+		'equivalence_format': 1,
+		'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+		'platform': {
+				'python': platform.python_version(),
+				'numpy': numpy.__version__,
+				'system': platform.platform(),
+				'processor': platform.processor()
+				},
+		'engines': dict((x, os.path.dirname(os.path.abspath(engines[x].__file__))) for x in engineNames),
+		'parameters': {
+				'alpha': args.alpha,
+				'repeat': args.repeat,
+				'seed': args.seed,
+				'iterations': args.iterations,
+				'repertoire_size': args.repertoire_size,
+				'population_size': args.population_size,
+				'sequence_count': args.sequence_count,
+				'expect_difference': args.expect_difference
+				},
+		'threshold': threshold,
+		'tests': tests,
+		'stages': dict((x, { 'legacy_seconds': stages[x]['legacy'], 'fast_seconds': stages[x]['fast'],
+												 'speedup': stages[x]['legacy'] / max(stages[x]['fast'], 1e-12) }) for x in stages)
+		}
+
+if args.output == '-':
+		json.dump(results, sys.stdout, indent=2, sort_keys=True)
+		sys.stdout.write("\n")
+else:
+		with open(args.output, 'w') as fp:
+				json.dump(results, fp, indent=2, sort_keys=True)
+				fp.write("\n")
+
+
+# Report the tests and the speedup of each stage
+sys.stderr.write("%-44s %10s %12s %8s\n" % ('test', 'method', 'p-value', 'result'))
+for name in sorted(tests.keys()):
+		test = tests[name]
+		if 'skipped' in test:
+				sys.stderr.write("%-44s %10s %12s %8s\n" % (name, test['method'], '-', 'skipped'))
+		else:
+				result = 'pass' if test['passed'] else 'FAIL'
+				if test['expected_difference']:
+						result = 'differs' if not test['passed'] else 'same'
+				sys.stderr.write("%-44s %10s %12.3g %8s\n" % (name, test['method'], test['p_value'], result))
+sys.stderr.write("\n%-32s %12s %12s %8s\n" % ('stage', 'legacy (s)', 'fast (s)', 'speedup'))
+for name in sorted(stages.keys()):
+		stage = results['stages'][name]
+		sys.stderr.write("%-32s %12.4f %12.4f %8.2f\n" % (name, stage['legacy_seconds'], stage['fast_seconds'], stage['speedup']))
+
+failed = [ x for x in sorted(tests.keys()) if not tests[x].get('passed', True) and not tests[x]['expected_difference'] ]
+if len(failed) > 0:
+		log.error("%d of %d tests found the engines' distributions to differ at p < %0.3g: %s", len(failed), len(compared), threshold, ', '.join(failed))
+		exit(1)
+exit(0)
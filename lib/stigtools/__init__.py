@@ -1,3 +1,32 @@
 from .stigtools import tcrConfig
 from .stigtools import tcr
+from .stigtools import tcrChain
 from .stigtools import tcrRepertoire
+from .population import tcrPopulationFile
+from .population import savePopulation
+from .population import appendPopulation
+from .population import buildRepertoire
+from .population import loadPopulation
+from .population import convertPopulation
+from .population import isPopulationFile
+from .library import tcrChainLibrary
+from .library import buildChainLibrary
+from .statsfile import writeStatistics
+from .summary import tcrSummary
+from .summary import readSummary
+from .summary import mergeSummaries
+from .synthetic import makeSyntheticReference
+from .profiling import tcrProfile
+from .profiling import tcrProgress
+from .rng import tcrRandom
+from .pipeline import tcrReadPipeline
+from .truth import tcrTruthWriter
+from .sampling import subsamplePopulation
+from .sampling import subsampleRepertoire
+from .sampling import mixPopulations
+from .coverage import tcrCoverage
+from .coverage import readCoverage
+from .coverage import mergeCoverage
+from .checkpoint import tcrCheckpoint
+from .singlecell import tcrCells
+from .server import tcrServer
@@ -0,0 +1,244 @@
+import os
+import sys
+import time
+import yaml
+import logging
+import argparse
+import multiprocessing
+
+from . import cli
+
+# Batch runs
+#
+# A batch manifest (YAML) lists the samples of a study, each described by the
+# same options as a run of stig.  The manifest may also list repertoires,
+# which are generated once and shared by any number of samples:
+#
+#   processes: 4                     # Optional, see --processes
+#   defaults:                        # Optional, options common to every job
+#     working_dir: data
+#     sequence-type: rna
+#   repertoires:                     # Optional
+#     study1:
+#       repertoire-size: 1000
+#       population-size: 100000
+#   samples:
+#     - output: sample1
+#       repertoire: study1           # Reads from repertoire study1
+#       sequence-count: 10000
+#     - output: sample2
+#       repertoire: study1
+#       read-type: paired
+#       degrade-phred: IIIIIIIIII4444433333
+#
+# Options are given by their long name, with or without the leading '--'.
+# Flags (e.g. reference-free) are given as true, and working_dir is the
+# working directory.  Filenames are relative to the manifest's directory.
+# Repertoire jobs generate no reads, and write <name>.population.bin (unless
+# given an output) which their samples load with --load-population.
+#
+# Repertoires are generated first, then the samples are run across a pool of
+# processes.  Working directories and repertoires are loaded once, before the
+# pool is started, so that (where processes are forked) each process shares
+# them rather than loading its own.  Processes of the pool cannot start
+# processes of their own, so samples run in the pool generate their reads in
+# a single process, whatever their processes option.
+#
+
+# Working directories and populations loaded for this process, see cli.run()
+configCache = {}
+populationCache = {}
+
+
+# getArguments - Convert a dict of stig options to command line arguments
+#
+# Arguments:
+# options - Dict of option name -> value, see above
+#
+# Returns:
+# List of strings
+#
+def getArguments(options):
+		argv = []
+		workingDir = None
+		for name, value in options.items():
+				name = str(name).lstrip('-')
+				if name in ('working_dir', 'working-dir'):
+						workingDir = str(value)
+				elif value is True:
+						argv.append('--' + name)
+				elif value is False or value is None:
+						continue
+				else:
+						argv.append('--%s=%s' % (name, value))
+		if workingDir is not None:
+				argv.append(workingDir)
+		return argv
+
+
+# readManifest - Read a batch manifest
+#
+# Arguments:
+# filename - Manifest filename
+#
+# Returns:
+# A dict with the number of processes requested (or None), and lists of
+# repertoire and sample jobs.  Each job is a 2-tuple of a name and its
+# command line arguments
+#
+def readManifest(filename):
+		with open(filename) as fp:
+				manifest = yaml.safe_load(fp)
+		if not isinstance(manifest, dict) or not isinstance(manifest.get('samples'), list):
+				raise ValueError("Batch manifest must have a list of samples", filename)
+
+		defaults = manifest.get('defaults') or {}
+		repertoires = manifest.get('repertoires') or {}
+
+		repertoireJobs = []
+		populationFiles = {}
+		for name, options in repertoires.items():
+				options = dict(defaults, **(options or {}))
+				options.setdefault('output', name)
+				options['sequence-count'] = 0
+				populationFiles[name] = "%s.population.bin" % options['output']
+				repertoireJobs.append((str(name), getArguments(options)))
+
+		sampleJobs = []
+		for i, options in enumerate(manifest['samples']):
+				options = dict(defaults, **options)
+				repertoire = options.pop('repertoire', None)
+				if repertoire is not None:
+						if repertoire not in populationFiles:
+								raise ValueError("Sample %d uses repertoire %s, which is not in the manifest" % (i + 1, repertoire))
+						options['load-population'] = populationFiles[repertoire]
+				sampleJobs.append((str(options.get('output', 'sample%d' % (i + 1))), getArguments(options)))
+
+		return { 'processes': manifest.get('processes'), 'repertoires': repertoireJobs, 'samples': sampleJobs }
+
+
+# runJob - Run a single job of a batch, using this process's caches
+#
+# Arguments:
+# job - 2-tuple of a name and command line arguments
+#
+# Returns:
+# Dict with the job name, exit status, seconds taken and an error message
+# (or None)
+#
+def runJob(job):
+		name, argv = job
+		start = time.perf_counter()
+		error = None
+		try:
+				status = cli.run(cli.getParser().parse_args(argv), configs=configCache, populations=populationCache)
+		except SystemExit as e:
+				status = e.code if isinstance(e.code, int) else 1
+				error = "Exited with status %s" % e.code
+		except Exception as e:
+				logging.getLogger('main').exception("Job %s failed", name)
+				status = 1
+				error = "%s: %s" % (type(e).__name__, e)
+		return { 'name': name, 'status': status, 'seconds': time.perf_counter() - start, 'error': error }
+
+
+# runJobs - Run jobs, in a pool of processes if more than one is requested
+#
+# Arguments:
+# jobs      - List of jobs, see runJob()
+# processes - Number of processes
+#
+# Returns:
+# List of job results, see runJob(), in the order of jobs
+#
+def runJobs(jobs, processes):
+		if processes <= 1 or len(jobs) <= 1:
+				return [ runJob(x) for x in jobs ]
+		with multiprocessing.Pool(min(processes, len(jobs))) as pool:
+				return pool.map(runJob, jobs, chunksize=1)
+
+
+# preloadJobs - Load the working directories and populations used by jobs
+#               into this process's caches
+#
+# Arguments:
+# jobs - List of jobs, see runJob()
+# log  - Logging object
+#
+# Returns: nothing
+#
+def preloadJobs(jobs, log):
+		parser = cli.getParser()
+		for name, argv in jobs:
+				args = parser.parse_args(argv)
+				if args.extract_utr is not None or args.convert_population is not None or args.build_library is not None:
+						continue
+				config = cli.getConfiguration(args.working_dir, reference = not args.reference_free, utrFasta = args.utr_fasta,
+																			log = log.getChild('tcrConfig'), cache = configCache)
+				if args.load_population is not None and os.path.isfile(args.load_population):
+						cli.getPopulation(args.load_population, config, log=log.getChild('tcrRepertoire'), cache=populationCache)
+
+
+# runBatch - Run the jobs of a batch manifest
+#
+# Arguments:
+# filename  - Manifest filename
+# processes - Optional.  Number of processes to use.  Default is the number
+#             given in the manifest, or else the number of CPUs
+# log       - Optional.  Logging object
+#
+# Returns:
+# List of job results, see runJob(), for the repertoires then the samples
+#
+def runBatch(filename, processes=None, log=None):
+		if log is None:
+				log = logging.getLogger('main')
+		manifest = readManifest(filename)
+		if processes is None:
+				processes = manifest['processes'] or os.cpu_count() or 1
+
+		previousDir = os.getcwd()
+		os.chdir(os.path.dirname(os.path.abspath(filename)))
+		try:
+				log.info("Generating %d repertoire(s)", len(manifest['repertoires']))
+				results = runJobs(manifest['repertoires'], processes)
+				failed = [ x['name'] for x in results if x['status'] != 0 ]
+				if len(failed) > 0:
+						log.critical("Repertoire(s) %s failed, no samples were run", ', '.join(failed))
+						return results
+
+				preloadJobs(manifest['samples'], log)
+				log.info("Running %d sample(s) with %d process(es)", len(manifest['samples']), processes)
+				return results + runJobs(manifest['samples'], processes)
+		finally:
+				os.chdir(previousDir)
+
+
+# batch - Run a batch with command line arguments (see 'stig batch --help')
+#
+# Arguments:
+# argv - Optional.  Command line arguments following 'batch'
+#
+# Returns:
+# Exit status, 0 if every job succeeded
+#
+def batch(argv=None):
+		parser = argparse.ArgumentParser(prog = "stig batch",
+																		 description = "Run the samples listed in a manifest, loading each working directory and repertoire once",
+																		 epilog = "Please see manual or README for further details" )
+		parser.add_argument('manifest', metavar='MANIFEST', type=str,
+												help='YAML manifest of repertoires and samples')
+		parser.add_argument("--processes", metavar='N', type=int, default=None,
+												help='Number of samples to run at once.  Default is the number given in the manifest, or else the number of CPUs')
+		parser.add_argument('--log-level', choices=['debug', 'info', 'warning', 'error', 'critical'], default='warning',
+												help='Logging level of the batch.  Default is warning and above.  Jobs use their own --log-level')
+		args = parser.parse_args(argv)
+
+		log = cli.getLog()
+		batchLog = log.getChild('batch')
+		batchLog.setLevel(getattr(logging, args.log_level.upper()))
+
+		results = runBatch(args.manifest, processes=args.processes, log=batchLog)
+		for result in results:
+				sys.stderr.write("%-32s %6s %10.3fs %s\n" % (result['name'], result['status'], result['seconds'], result['error'] or ''))
+		return 0 if all(x['status'] == 0 for x in results) else 1
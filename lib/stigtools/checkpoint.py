@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import numpy
+
+from .population import tcrPopulationWriter
+from .population import tcrPopulationFile
+from .population import readFooter
+
+# Checkpoints
+#
+# A long run (e.g. a batch job that may be preempted) can save its progress
+# to a checkpoint file from time to time, and a run with the same options can
+# resume from the checkpoint, giving the output a run that was not stopped
+# would have.  Progress is saved at two stages:
+#
+#   tcrRepertoire - While a new repertoire is generated, see buildRepertoire():
+#                   the clones written to its population file, the clones
+#                   generated since, and the state of the random source
+#   simulateRead  - While reads are generated, see tcrReadPipeline.run(): the
+#                   chunks of reads written, the length of each output file,
+#                   the coverage counted, and the state of the random source
+#                   when reads were started
+#
+# A checkpointed run writes its repertoire (its statistics, summary and
+# population files) before generating reads, so that a run resumed while
+# generating reads loads the repertoire from its population file rather than
+# generating it again.
+#
+# The checkpoint file uses the population file layout (see population.py),
+# with the magic 'STIGCKP\0'.  Clones generated but not yet written to the
+# population file are stored as a block of clones, arrays (e.g. of coverage)
+# are stored zlib-compressed, and the footer records the stage, its state and the
+# options of the run, which a resumed run must match.  Each checkpoint is
+# written to a temporary file which then replaces the last, so a run stopped
+# while saving a checkpoint leaves the previous one.
+#
+
+checkpointMagic = b'STIGCKP\x00'
+checkpointVersion = 1
+
+
+class tcrCheckpoint:
+
+		# Arguments:
+		# filename  - Checkpoint file name, e.g. BASENAME.checkpoint
+		# interval  - Optional.  Number of seconds between checkpoints, see due().
+		#             If None, checkpoints are never due
+		# arguments - Optional.  Dict of the options of the run, saved with each
+		#             checkpoint, see load()
+		#
+		def __init__( self, filename, interval=None, arguments=None ):
+				self.filename = filename
+				self.interval = interval
+				self.arguments = json.loads(json.dumps(arguments)) # As read back from a checkpoint
+				self.saved = time.monotonic()
+
+
+		# due - Return True if interval seconds have passed since the last
+		#       checkpoint was saved (or since we were created)
+		#
+		def due( self ):
+				return self.interval is not None and time.monotonic() - self.saved >= self.interval
+
+
+		# save - Save a checkpoint, replacing the last
+		#
+		# Arguments:
+		# stage    - Name of the stage of the run, e.g. 'tcrRepertoire'
+		# state    - Dict of JSON-serializable values the stage resumes from
+		# clones   - Optional.  List of tcr objects to save
+		# metadata - Optional.  Repertoire metadata of the clones, see
+		#            getPopulationMetadata()
+		# arrays   - Optional.  Dict of name -> numpy array to save
+		#
+		# Returns: nothing
+		#
+		def save( self, stage, state, clones=(), metadata=None, arrays=None ):
+				temporary = self.filename + '.tmp'
+				writer = tcrPopulationWriter(temporary, magic=checkpointMagic, version=checkpointVersion)
+				if len(clones) > 0:
+						writer.writeBlock(list(clones))
+				descriptors = {}
+				if arrays is not None:
+						for name in sorted(arrays.keys()):
+								descriptors[name] = writer.writeArray(arrays[name], compress=True)
+				writer.writeFooter({
+						'version': checkpointVersion,
+						'metadata': metadata if metadata is not None else {},
+						'population': writer.writeArray(numpy.zeros(len(clones), dtype=numpy.int64)),
+						'blocks': writer.blocks,
+						'arrays': descriptors,
+						'stage': stage,
+						'state': state,
+						'arguments': self.arguments,
+						})
+				with open(temporary, 'rb') as fp:
+						os.fsync(fp.fileno())
+				os.replace(temporary, self.filename)
+				self.saved = time.monotonic()
+
+
+		# load - Read the last checkpoint saved
+		#
+		# Arguments:
+		# config - tcrConfig object, attached to the clones of the checkpoint
+		#
+		# Returns:
+		# None if there is no checkpoint, or a dict of the 'stage', its 'state'
+		# and the 'arguments' of the run that saved it, the 'clones' saved (a
+		# list of tcr objects) and the 'arrays' saved (a dict of numpy arrays)
+		#
+		def load( self, config ):
+				if not os.path.exists(self.filename):
+						return None
+				footer = readFooter(self.filename, checkpointMagic, checkpointVersion, 'checkpoint')
+				checkpointFile = tcrPopulationFile(self.filename, footer=footer)
+				if checkpointFile.chainRecords and footer['metadata']['segment_fingerprint'] != config.getSegmentFingerprint():
+						raise ValueError("Checkpoint was saved with different receptor segment or allele data than the working directory", self.filename)
+				return {
+						'stage': footer['stage'],
+						'state': footer['state'],
+						'arguments': footer['arguments'],
+						'clones': [ checkpointFile.getClone(i, config) for i in range(0, len(checkpointFile)) ],
+						'arrays': dict((name, numpy.array(checkpointFile.getArray(x))) for name, x in footer['arrays'].items()),
+						}
+
+
+		# remove - Remove the checkpoint, e.g. once the run is complete
+		#
+		def remove( self ):
+				for filename in (self.filename, self.filename + '.tmp'):
+						if os.path.exists(filename):
+								os.remove(filename)
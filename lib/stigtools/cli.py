@@ -0,0 +1,945 @@
+import os
+import sys
+import re
+import contextlib
+import argparse
+import logging
+
+from .stigtools import tcrConfig
+from .stigtools import tcrRepertoire
+from .population import savePopulation
+from .population import appendPopulation
+from .population import buildRepertoire
+from .population import loadPopulation
+from .population import convertPopulation
+from .population import isPopulationFile
+from .library import buildChainLibrary
+from .library import tcrChainLibrary
+from .profiling import tcrProfile
+from .profiling import tcrProgress
+from .rng import tcrRandom
+from .pipeline import tcrReadPipeline
+from .pipeline import getFastq
+from .truth import tcrTruthWriter
+from .sampling import subsampleRepertoire
+from .sampling import mixPopulations
+from .coverage import tcrCoverage
+from .singlecell import tcrCells
+from .checkpoint import tcrCheckpoint
+from .statsfile import statisticsFormats
+from .statsfile import getStatisticsFilename
+from .statsfile import writeStatistics
+
+# STIG command line
+#
+# The stig script is a thin wrapper around main() here, so that the same runs
+# can be made from within Python, e.g. by the resident server (see server.py)
+# which keeps working directories and population files loaded between runs.
+# run() takes parsed arguments, so a run is described by exactly the same
+# options as on the command line.
+#
+
+
+# getParser - Return the argument parser for stig
+#
+# Arguments: none
+#
+# Returns:
+# argparse.ArgumentParser
+#
+def getParser():
+		parser = argparse.ArgumentParser(prog = "stig", description = "Generate synthetic TCR read data",
+																		 epilog = "Please see manual or README for further details" )
+
+		parser.add_argument('working_dir', metavar='WORKING_DIR', type=str,
+												help="Directory with tcell_receptor.tsv, tcell_recombination.yaml, reference chromosome(s), & allele subdir.  Try STIG's H. sapiens directory named 'data'.  A directory named 'serve' or 'batch' given as the first argument must be given with a path, e.g. ./serve, as these names start the server and batch modes")
+
+		parser.add_argument("--output", metavar='BASENAME', default='stig.out',
+												help='Basename for output files, e.g. \'--output=foo\' will write to \'foo.fastq\', \'foo.statistics.csv\', etc.  Default is \'stig.out\'')
+
+		parser.add_argument("--statistics-format", choices=statisticsFormats, default='csv',
+												help='Format of the statistics file written for a new repertoire: \'csv\' (BASENAME.statistics.csv), \'csv.gz\' (gzip-compressed, BASENAME.statistics.csv.gz) or \'npz\' (numpy arrays of each column, BASENAME.statistics.npz).  Default is csv')
+		parser.add_argument("--statistics-no-sequences", action = 'store_true',
+												help='Leave the RNA and DNA sequence of each chain out of the statistics file, keeping the clone, cell count, alleles and CDR3s')
+
+		parserGroup3 = parser.add_mutually_exclusive_group()
+		parserGroup3.add_argument("--load-population", metavar='FILE', type=str,
+															help='Load TCR population and repertoire data from FILE, rather than generating from scratch')
+		parserGroup3.add_argument("--extend-population", metavar='FILE', type=str,
+															help='Load the population FILE, generate --repertoire-size further clones, unique against those in FILE under the uniqueness constraints FILE was generated with and any --repertoire-...-unique options given, give them --population-size further cells by --population-distribution, and append them to FILE in place, without rewriting its clones.  Reads, statistics and the summary are of the whole extended repertoire.  See --repopulate')
+		parser.add_argument("--repopulate", action = 'store_true',
+												help='With --extend-population, distribute --population-size cells across every clone of the extended repertoire, rather than adding them to the new clones only')
+		parser.add_argument("--subsample-cells", metavar='N', type=int,
+												help='Draw N cells, without replacement, from the population of the repertoire (e.g. from --load-population) before generating reads, as in a blood draw, and write the subsampled population to BASENAME.population.bin.  With --mix-population, the number of cells of the mixture')
+		parser.add_argument("--mix-population", metavar='FILE[:WEIGHT]', type=str, action='append',
+												help='Mix the repertoires of population files, each given by a --mix-population option, into BASENAME.population.bin and exit.  The cells of each file are subsampled to a share of the mixture given by its WEIGHT (default is 1).  The mixture has --subsample-cells cells, or by default as many as the files allow')
+		parser.add_argument("--convert-population", metavar='FILE', type=str,
+												help='Convert a population FILE saved by an earlier version of STIG to the current population file format, write it to BASENAME.population.bin and exit')
+
+		parser.add_argument("--reference-free", action = 'store_true',
+												help='Do not use the reference chromosome(s) in WORKING_DIR, building RNA from the allele files alone.  Only RNA sequences can be generated.  Reads are restricted to within each TCR chain unless UTR sequence is given with --utr-fasta')
+		parser.add_argument("--utr-fasta", metavar='FILE', type=str,
+												help='Read 5\' and 3\' UTR sequence from FILE, as written by --extract-utr, rather than from the reference chromosome(s)')
+		parser.add_argument("--extract-utr", metavar='FILE', type=str,
+												help='Write the reference sequence flanking each TCR chain to FILE for use with --utr-fasta, and exit')
+
+		parser.add_argument("--build-library", metavar='FILE', type=str,
+												help='Generate valid alpha, beta, gamma and delta chains, write them to the chain library FILE for use with --chain-library, and exit.  See --library-size')
+		parser.add_argument("--library-size", metavar='N', type=int, default=100000,
+												help='Number of chains of each receptor type written by --build-library.  Default is 100000')
+		parser.add_argument("--chain-library", metavar='FILE', type=str,
+												help='Draw the chains of the repertoire from the chain library FILE, written by --build-library from the same WORKING_DIR, rather than recombining them')
+
+		parser.add_argument('--repertoire-size', metavar='N', type=int, default=10,
+												help='Size of the TCR repertoire (i.e. the number of unique TCR clonotypes that are generated).  Default is 10')
+		parser.add_argument('--repertoire-unique', action = 'store_true',
+												help = "Force each TCR to be unique on the RNA level.  Default is to allow collisions")
+		parser.add_argument('--repertoire-chain-unique', action = 'store_true',
+												help = "Force each TCR chain (e.g. alpha) to be unique on the RNA level.  Implies unique TCRs as per --repertoire-unique.  Default is to allow collisons")
+		parser.add_argument('--repertoire-cdr3-unique', action = 'store_true',
+												help = "Force each CDR3 of each chain to be unique on the nucleotide level.  Implies unique TCRs as per --repertoire-unique and unique chains as per --repertoire-chain-unique.  Note this may cause performance issues as repertoire size increases.  Default is to allow collisons")
+		parser.add_argument('--out-of-core', action = 'store_true',
+												help = "Write the clones of a new repertoire to BASENAME.population.bin in blocks as they are generated, rather than keeping them in memory, and read them back through a bounded cache (see --clone-cache) to populate the repertoire, generate reads and write statistics.  For repertoires too large for memory")
+		parser.add_argument('--clone-cache', metavar='N', type=int, default=4096,
+												help = "Number of decoded clones kept in memory with --out-of-core.  Default is 4096")
+		parser.add_argument('--population-size', metavar='N', type=int, default=100,
+												help='The approximate number of T-cells in the repertoire (e.g. if repertoire-size=5 and population-size=15, then there are, on average, 3 clones of each unique TCR clonotype).  Note that some population distribution options may choose slightly fewer or more "cells" depending on the particulars of the distribution. Default is 100')
+		parser.add_argument('--population-distribution', choices = ['unimodal', 'chisquare', 'stripe', 'equal', 'logisticcdf'], default='logisticcdf',
+												help = 'Population distribution function.  This defines the function used to distribute the population among the repertoire.  Default is the logistic CDF, approximating a normalized distribution of TCR subclone population sizes.  \'stripe\' will assign the Nth cell in the population to the (N %% repertoire-size) clonotype.  \'equal\' assigns cells in the population to each clonotype with equal probability. \'unimodal\' produces a small set of clones with high population sizes relative to the others.  See --population-unimodal-parameters, --population-chisquare-parameters, --population-logisticcdf-parameters')
+
+		parserGroup1 = parser.add_mutually_exclusive_group()
+		parserGroup1.add_argument('--population-unimodal-parameters', metavar='N', type=float, default=3.0,
+															help='Parameter for the unimodal population.  The width of the peak is defined by number of standard deviations to include in our population distribution.  Decimal value.  Default is 3')
+		parserGroup1.add_argument('--population-chisquare-parameters', metavar='k:cutoff', default='2:8',
+															help='Parameters for the chi-square distribution.  Takes an argument formatted as \'k:cutoff\', where k - degrees of freedom.  Default is 3. cutoff - X-axis +/- maximum.  Default is 8')
+		parserGroup1.add_argument('--population-logisticcdf-parameters', metavar='s:cutoff', default='1:3',
+															help='Parameter for the logistic cumulative distribution function.  Takes an argument formatted as \'s:cutoff\', where s - logistic scale.  Default is 1.  cutoff - X-axis +/- maximum.  Default is 3')
+
+		parser.add_argument('--read-type', choices = ['paired', 'single', 'amplicon'], default = 'single',
+												help='Generate either single, paired-end, or amplicon reads.  Default is single')
+		parser.add_argument('--sequence-type', choices = ['dna', 'rna'], default = 'dna',
+												help='Generate sequences from simulated DNA or RNA. Default is DNA')
+		parser.add_argument("--sequence-count", metavar="N", type=int, default=1000,
+												help='Number of sequences (reads) to generate.  Default is 1000')
+		parser.add_argument("--read-length-mean", type=int, default=48,
+												help='The average length of reads in nucleotides. Default is 48')
+		parser.add_argument("--read-length-sd", type=int, default=4,
+												help='The SD of read length variation in nucleotides. Set to zero for fixed-length reads.  Default is 4')
+		parser.add_argument("--read-length-sd-cutoff", type=int, default=4, metavar='N',
+												help='Read lengths are restricted to less than N standard deviations from the mean.  Default is 4')
+		parser.add_argument("--insert-length-mean", type=int, default=48,
+												help='The average length of the insert for paired end reads.  Default is 48')
+		parser.add_argument("--insert-length-sd", type=int, default=4,
+												help='The standard deviation of insert length variation in nucleotides. Set to zero for fixed-length inserts.  Default is 4')
+		parser.add_argument("--insert-length-sd-cutoff", type=int, default=4, metavar='N',
+												help='Insert lengths are restricted to less than N standard deviations from the mean.  Default is 4')
+		parser.add_argument("--truth", action = 'store_true',
+												help='Write the origin of each read (its clone, chain, position along the chain, UTR bases and the V, N, D, J and C regions it covers) to BASENAME.truth.tsv, so reads can be scored without aligning them')
+		parser.add_argument("--coverage", action = 'store_true',
+												help='Count the read coverage of each base of each chain read from, and the number of reads spanning each chain\'s CDR3, as reads are generated, and write them to BASENAME.coverage.npz')
+		parser.add_argument("--single-cell", metavar='CELLS', type=int,
+												help='Generate barcoded single-cell reads, as from a droplet V(D)J library, from CELLS cells drawn from the population.  Each cell is given a random barcode, and each chain of each cell a number of molecules with random UMIs (see --umis-per-chain).  Reads are taken from the molecules of the cells, and read 1 begins with the cell barcode and UMI.  The cell, barcode, clone and molecules of each cell are written to BASENAME.cells.tsv.  Reads are generated in chunks (see --chunk-size) as with --processes, even by one process')
+		parser.add_argument("--cell-barcode-length", metavar='N', type=int, default=16,
+												help='Number of bases of each cell barcode (at most 31), see --single-cell.  Default is 16')
+		parser.add_argument("--umi-length", metavar='N', type=int, default=10,
+												help='Number of bases of each UMI (at most 31), see --single-cell.  Default is 10')
+		parser.add_argument("--umis-per-chain", metavar='MEAN', type=float, default=5,
+												help='Mean number of molecules captured of each chain of each cell (one more than a Poisson draw, so at least 1), see --single-cell.  Default is 5')
+		parser.add_argument("--amplicon-probe", type=str, default='GATCTCTGCTTCTGATGGCTCAAACAC', metavar='STR',
+												help="Anchoring/priming sequence for generating amplicon reads.  This should align with some RNA or DNA sequence, either sense or anti-sense.  Read 1 will have length given by --read-length-* options.  Read 2 will be complementary to read 1 and of an identical length.  The default value is a 27-mer that anchors on the reverse strand in EX1 of the beta chain C-region")
+
+		parserGroup2 = parser.add_mutually_exclusive_group()
+		parserGroup2.add_argument("--degrade-logistic", default=None, metavar="B:L:k:mid",
+															help='Simulate non-optimal quality using the logistic (sigmoid) function.  Takes an argument formatted as \'B:L:k:mid\'.  B - Base error rate probability.  L - Maximum error rate. k - Steepness factor. mid - Midpoint, this is the base position where error rate is equal to 1/2 of L. Default is off.  This option is mutually exclusive to --degrade-phred, --degrade-fastq, and --degrade-fastq-random.  See: --degrade-variability')
+		parserGroup2.add_argument("--degrade-phred", metavar="PHRED_STRING", default=None,
+															help='Simulate non-optimal quality using a Phred+33 (Illumina 1.8+) string to specify quality on a per-nucleotide basis.  If a generated read is longer than the given phred string, then the last character in the phred string is used.  Default is off.  This option is mutually exclusive to --degrade-logistic, --degrade-fastq and --degrade-fastq-random.  See: --degrade-variability')
+		parserGroup2.add_argument("--degrade-fastq", metavar="FILE[,FILE2]", default=None,
+															help='Simulate non-optimal quality by degrading reads based on Phred+33 quality strings from the given fastq FILE, or files FILE1,FILE2. Two files required when generating paired or amplicon reads.  Output quality strings are assigned from FILE in a stepwise fashion')
+		parserGroup2.add_argument("--degrade-fastq-random", metavar='FILE[,FILE2]', default=None,
+															help='Simulate non-optimal quality by degrading reads based on Phred+33 quality strings from the given fastq FILE, or files FILE1,FILE2.  Two files required when generating paired or amplicon reads.  Output quality strings are assigned from FILE randomly')
+
+		parser.add_argument("--degrade-variability", default=0, metavar='FLOAT', type=float,
+												help='Applies a relative variability in the per-nucleotide error applied by the --degrade option.  If a given base were to have an error rate of 0.1 (10%%), then a degrade-variability of 0.5 (50%%) would result in an error rate in the range of 0.1 +/- 0.1 * 0.5.  Default is 0')
+
+		parser.add_argument("--display-degradation", action = 'store_true',
+												help='Display the error rate per base pair for a given B:L:k:mid value and exit.  The number of positions displayed is adjustable through the --read-length-mean option.  This is mostly useful in adjusting these parameters to be passed to the --degrade option.  Note that no reads or repertoire will be generated when this option is given')
+
+		parser.add_argument("--receptor-ratio", metavar="RATIO", type=float, default=0.9,
+												help='Ratio of alpha/beta vs gamma/delta sequences.  Default is 0.9 (9 alpha/beta per 1 gamma/delta TCR)')
+		parser.add_argument("--seed", metavar='N', type=int, default=None,
+												help='Seed for the random number generator, so that the same options and seed generate the same repertoire and reads.  Default is to seed from system entropy')
+		parser.add_argument("--processes", metavar='N', type=int, default=1,
+												help='Number of processes generating, degrading and formatting reads.  Default is 1.  With more than one, reads are generated in chunks (see --chunk-size) by a pool of N processes and written in order')
+		parser.add_argument("--chunk-size", metavar='READS', type=int, default=10000,
+												help='Number of reads in each chunk generated when --processes is greater than 1.  The reads generated for a given --seed depend on the chunk size, but not on the number of processes.  Default is 10000')
+		parser.add_argument("--checkpoint-interval", metavar='SECONDS', type=float, default=None,
+												help='Save the progress of the run to BASENAME.checkpoint every SECONDS seconds, so that a run that is stopped (e.g. a preempted job) can be continued with --resume.  The statistics, summary and population files are written before reads are generated, and reads are generated in chunks (see --chunk-size) as with --processes, even by one process.  So the reads differ from those of a run with the same --seed without checkpoints, though not between runs that were and were not stopped')
+		parser.add_argument("--resume", action = 'store_true',
+												help='Continue a run from its last checkpoint in BASENAME.checkpoint (see --checkpoint-interval), giving the output it would have given had it not been stopped.  The options must be those of the run that saved the checkpoint, except for --processes, --clone-cache and the logging, progress and profiling options.  If there is no checkpoint, the run starts from the beginning')
+		parser.add_argument('--log-level', choices=['debug', 'info', 'warning', 'error', 'critical'], default='warning',
+												help='Logging level.  Default is warning and above')
+		parser.add_argument("--trace", metavar='FILE', type=str,
+												help='Write a JSON line describing each clone generated (alleles, chewback lengths, added nucleotides, CDR3 and the recombinations attempted for each chain) to FILE')
+		parser.add_argument("--progress", action = 'store_true',
+												help='Report the progress of each stage (clones generated, cells populated, reads generated and written), with throughput and estimated time remaining, to standard error')
+		parser.add_argument("--progress-file", metavar='FILE', type=str,
+												help='Append progress reports to FILE as JSON lines, e.g. for a job scheduler.  See --progress')
+		parser.add_argument("--progress-interval", metavar='SECONDS', type=float, default=10,
+												help='Minimum number of seconds between progress reports.  Default is 10')
+		parser.add_argument("--profile", metavar='FILE', type=str,
+												help='Write the wall and CPU time of each stage of the run, with counters (e.g. recombination attempts and rejections, reference reads, reads per second) and peak memory use, to FILE as JSON')
+		parser.add_argument("--cprofile", metavar='FILE', type=str,
+												help='Write cProfile statistics for repertoire generation, population and read simulation to FILE, for use with the pstats module')
+
+		return parser
+
+
+# Options that do not change the output of a run, so may differ when a run is
+# resumed from a checkpoint, see getCheckpointArguments()
+checkpointIgnoredArguments = ('checkpoint_interval', 'resume', 'processes', 'clone_cache', 'log_level', 'progress', 'progress_file', 'progress_interval', 'profile', 'cprofile')
+
+
+# getCheckpointArguments - Return the options of a run that a run resumed
+#                          from its checkpoint must match
+#
+# Arguments:
+# args - Parsed command line arguments
+#
+# Returns:
+# Dict of option name -> value
+#
+def getCheckpointArguments(args):
+		return dict((name, value) for name, value in vars(args).items() if name not in checkpointIgnoredArguments)
+
+
+# getConfiguration - Return a tcrConfig for a working directory, reusing one
+#                    previously loaded with the same settings if available
+#
+# Arguments:
+# workingDir - Working directory, see tcrConfig.setWorkingDir()
+# reference  - Boolean.  False for reference-free mode
+# utrFasta   - Optional.  UTR FASTA filename, see tcrConfig.setUTRPolicy()
+# log        - Optional.  Logging object for the tcrConfig
+# cache      - Optional.  Dict of configurations already loaded, to which the
+#              new configuration is added.  Cached configurations are not
+#              reloaded if the working directory changes
+#
+# Returns:
+# tcrConfig object
+#
+def getConfiguration(workingDir, reference=True, utrFasta=None, log=None, cache=None):
+		key = (os.path.realpath(workingDir), reference, os.path.realpath(utrFasta) if utrFasta is not None else None)
+		if cache is not None and key in cache:
+				config = cache[key]
+				config.setLog(log) # The log level may differ from the run that loaded it
+				return config
+
+		config = tcrConfig(log=log)
+		config.setWorkingDir(workingDir, reference = reference)
+		if utrFasta is not None:
+				config.setUTRPolicy('fasta', utrFasta)
+		if cache is not None:
+				cache[key] = config
+		return config
+
+
+# getPopulation - Load a population file, reusing one previously loaded if it
+#                 is unchanged
+#
+# Arguments:
+# filename - Population file, see loadPopulation()
+# config   - tcrConfig object
+# log      - Optional.  Logging object for the tcrRepertoire
+# cache    - Optional.  Dict of populations already loaded, to which the new
+#            population is added
+#
+# Returns:
+# tcrRepertoire object
+#
+def getPopulation(filename, config, log=None, cache=None):
+		status = os.stat(filename)
+		key = (os.path.realpath(filename), status.st_mtime, status.st_size, id(config))
+		if cache is not None and key in cache:
+				repertoire = cache[key]
+				repertoire.setLog(log)
+				return repertoire
+
+		repertoire = loadPopulation(filename, config, log=log)
+		if cache is not None:
+				cache[key] = repertoire
+		return repertoire
+
+
+# populateRepertoire - Populate a repertoire by the --population-... options
+#
+# Arguments:
+# repertoire - tcrRepertoire object
+# args       - Parsed command line arguments
+# first      - Optional.  Index of the first clone to populate, see
+#              tcrRepertoire.populate()
+#
+# Returns: nothing
+#
+def populateRepertoire(repertoire, args, first=0):
+		if args.population_distribution == 'unimodal':
+				repertoire.populate(args.population_size, 'unimodal', g_cutoff = args.population_unimodal_parameters, first=first)
+		elif args.population_distribution == 'chisquare':
+				matches = re.match('^((?:\d+)|(?:\d*.\d+)):((?:\d+)|(?:\d*.\d+))$', args.population_chisquare_parameters)
+				if( matches is not None and
+						len(matches.groups()) == 2 ):
+						k, cutoff = matches.groups()
+						repertoire.populate(args.population_size, 'chisquare', cs_k=float(k), cs_cutoff=float(cutoff), first=first)
+				else:
+						raise ValueError("Invalid format for chi-square parameters: %s" % args.population_chisquare_parameters)
+		elif args.population_distribution == 'logisticcdf':
+				matches = re.match('^((?:\d+)|(?:\d*.\d+)):((?:\d+)|(?:\d*.\d+))$', args.population_logisticcdf_parameters)
+				if( matches is not None and
+						len(matches.groups()) == 2 ):
+						scale, cutoff = matches.groups()
+						repertoire.populate(args.population_size, 'logisticcdf', l_scale=float(scale), l_cutoff=float(cutoff), first=first)
+				else:
+						raise ValueError("Invalid format for logisticcdf parameters: %s" % args.population_logisticcdf_parameters)
+		else:
+				repertoire.populate(args.population_size, args.population_distribution, first=first)
+
+
+# writeRepertoire - Write the statistics, summary and population files of a
+#                   repertoire, as requested by the options
+#
+# Arguments:
+# repertoire - tcrRepertoire object
+# args       - Parsed command line arguments
+# profile    - tcrProfile object
+# built      - Boolean.  True if the clones of a new repertoire were written to
+#              BASENAME.population.bin as they were generated, see
+#              buildRepertoire()
+#
+# Returns: nothing
+#
+def writeRepertoire(repertoire, args, profile, built):
+		if args.load_population is None:
+				# Write statistics to an output file
+				profile.begin('output:statistics')
+				statsFilename = getStatisticsFilename(args.output, args.statistics_format)
+				writeStatistics(repertoire, statsFilename, format = args.statistics_format, sequences = not args.statistics_no_sequences)
+				profile.end('output:statistics')
+
+				# Write the summary of the repertoire
+				repertoire.summary.write(args.output + '.summary.json')
+
+				# Write our repertoire object to a file, or append the new clones to the file extended.
+				# If built, the clones are already written, and only the population is added
+				profile.begin('output:savePopulation')
+				if args.extend_population is not None:
+						appendPopulation(repertoire, args.extend_population)
+				elif built:
+						appendPopulation(repertoire, args.output + '.population.bin')
+				else:
+						populationFilename = args.output + '.population.bin'
+						savePopulation(repertoire, populationFilename)
+				profile.end('output:savePopulation')
+
+		elif args.subsample_cells is not None:
+				# Write the subsampled population of the repertoire loaded
+				profile.begin('output:savePopulation')
+				savePopulation(repertoire, args.output + '.population.bin')
+				profile.end('output:savePopulation')
+
+
+# getDegradeQualities - Return the Phred+33 quality strings used to degrade
+#                       reads, see generate()
+#
+# Arguments:
+# degradeOptions - Dict of degradation options, parsed from the command line
+# config         - tcrConfig object
+# log            - Logging object
+#
+# Returns:
+# 3-tuple of the degradation method passed to tcrConfig.getDegradedFastq(),
+# and lists of quality strings used in turn for the first and second reads,
+# or None if a FASTQ file holds no quality strings
+#
+def getDegradeQualities(degradeOptions, config, log):
+		method = degradeOptions['method']
+		phred = degradeOptions['phred']
+		filename = degradeOptions['filename']
+
+		# Phred strings used for degradation are read from an array
+		phred1 = [ phred ]
+		phred2 = [ phred ]
+
+		# If the user requests we degrade based on FASTQ quality strings, read them into arrays
+		if method == 'fastq' or method == 'fastq-random':
+				log.debug("Using FASTQ-based degradation")
+				method = 'phred' # This is implemented as a special case of Phred degredation
+				phred1 = []
+				phred2 = []
+
+				matches = re.search('^(.+),(.+)$', filename)
+				if matches is not None:
+						filename1 = matches.group(1)
+						filename2 = matches.group(2)
+						log.debug("Fastq-degrade filenames are %s and %s", filename1, filename2)
+						phred1 = config.getFastqQualities(filename1)
+						phred2 = config.getFastqQualities(filename2)
+						if len(phred1) <= 0:
+								log.critical("Invalid number of fastq quality strings %d in file %s", len(phred1), filename1)
+								return None
+						if len(phred2) <= 0:
+								log.critical("Invalid number of fastq quality strings %d in file %s", len(phred2), filename2)
+								return None
+				else:
+						log.debug("Fastq-degrade filename is %s", filename)
+						phred1 = config.getFastqQualities(filename)
+						if len(phred1) <= 0:
+								log.critical("Invalid number of fastq quality strings %d in file %s", len(phred1), filename)
+								return None
+				if degradeOptions['method'] == 'fastq-random':
+						config.random.shuffle(phred1)
+						config.random.shuffle(phred2)
+
+		return (method, phred1, phred2)
+
+
+# run - Run stig
+#
+# Arguments:
+# args        - argparse.Namespace, as returned by getParser().parse_args()
+# log         - Optional.  Logging object.  Default is the 'main' logger
+# configs     - Optional.  Cache of tcrConfig objects, see getConfiguration()
+# populations - Optional.  Cache of populations, see getPopulation()
+#
+# Returns:
+# Exit status, 0 for success
+#
+def run(args, log=None, configs=None, populations=None):
+		if log is None:
+				log = logging.getLogger('main')
+
+		# Process our logging level arguments
+		if( args.log_level == 'debug'):
+				log.setLevel(logging.DEBUG)
+		elif( args.log_level =='info' ):
+				log.setLevel(logging.INFO)
+		elif( args.log_level =='warning' ):
+				log.setLevel(logging.WARNING)
+		elif( args.log_level =='error' ): 
+				log.setLevel(logging.ERROR)
+		elif( args.log_level =='critical' ):
+				log.setLevel(logging.CRITICAL)
+		else:
+				log.error("Error: Unknown log level %s", args.log_level)
+
+		progress = tcrProgress(interval = args.progress_interval,
+													 stream = sys.stderr if args.progress is True else None,
+													 filename = args.progress_file)
+		try:
+				return generate(args, log, progress, configs, populations)
+		finally:
+				progress.close()
+
+
+# generate - Generate a repertoire, population and reads as requested.  See run()
+#
+def generate(args, log, progress, configs=None, populations=None):
+		# Process degredation options: 'display-degradation', 'degrade-logistic', 'degrade-phred', 'degrade-fastq', and 'degrade-fastq-random'
+		degradeOptions = None
+		if ( args.degrade_logistic is not None or
+				 args.degrade_phred is not None or
+				 args.degrade_fastq is not None or
+				 args.degrade_fastq_random is not None ):
+				method, baseError, L, k, midpoint, phred, filename = [0] * 7 # Initialize to zero
+		
+				if args.degrade_logistic is not None:
+						if re.match('^((?:\d+)|(?:\d*.\d+)):((?:\d+)|(?:\d*.\d+)):((?:\d+)|(?:\d*.\d+)):((?:\d+)|(?:\d*.\d+))$', args.degrade_logistic):
+								log.info("Using logistic function for degradation")
+								method = 'logistic'
+								baseError, L, k, midpoint = [ float(x) for x in args.degrade_logistic.split(':') ]
+						else:
+								log.critical("Invalid string for --degrade-logistic: \"%s\".  Valid example: 0.005:0.2:0.25:15", args.degrade_logistic)
+								return -1
+				elif args.degrade_phred is not None:
+						if re.match(r'^[!\"#\$%&\'\(\)\*\+,-./0123456789:;<=>?@ABCDEFGHIJ]+$', args.degrade_phred):
+								log.info("Using Phred string for degradation")
+								method = 'phred'
+								matches = re.match('^(.+)$', args.degrade_phred)
+								phred = matches.groups()[0]
+						else:
+								log.critical("Invalid argument for --degrade-phred: \"%s\".  Valid example: IIIIIIII444433", args.degrade_phred)
+								return -1
+				elif args.degrade_fastq is not None:
+						matches = re.search('^(.+),(.+)$', args.degrade_fastq)
+						if matches is not None and args.read_type not in ('paired', 'amplicon'):
+								log.critical("--args-degrade-fastq cannot take two filenames unless generating paired or amplicon reads")
+								return -10
+						elif matches is None and args.read_type in ('paired', 'amplicon'):
+								log.critical("--args-degrade-fastq must take two filenames when generating paired or amplicon reads")
+								return -10
+						method = 'fastq'
+						filename = args.degrade_fastq
+
+				elif args.degrade_fastq_random is not None:
+						matches = re.search('^(.+),(.+)$', args.degrade_fastq_random)
+						if matches is not None and args.read_type not in ('paired', 'amplicon'):
+								log.critical("--args-degrade-fastq cannot take two filenames unless generating paired or amplicon reads")
+								return -10
+						elif matches is None and args.read_type in ('paired', 'amplicon'):
+								log.critical("--args-degrade-fastq must take two filenames when generating paired or amplicon reads")
+								return -10
+
+						method = 'fastq-random'
+						filename = args.degrade_fastq_random				
+				else:
+						raise ValueError("Fallen through to an invalid choice for degradation")
+
+				degradeOptions = {
+						'method': method,
+						'baseError': baseError,
+						'L': L,
+						'k': k,
+						'midpoint': midpoint,
+						'phred': phred,
+						'filename': filename
+						}
+
+		
+		# Display degradation output, if --display-degradation given
+		if( args.display_degradation is True and
+				degradeOptions is not None ):
+				displayString = "A" * args.read_length_mean
+				tempConfig = tcrConfig()
+				tempConfig.random.seed(args.seed)
+				tempConfig.getDegradedFastq(displayString, method, 'ident',  variability=args.degrade_variability,
+																		phred=degradeOptions['phred'],
+																		baseError=degradeOptions['baseError'], L=degradeOptions['L'],
+																		k=degradeOptions['k'], midpoint=degradeOptions['midpoint'],
+																		display=True)
+				return 0
+		elif args.display_degradation is True:
+				raise ValueError("--display-degradation requires a degradation method.  See --degrade-logistic, --degrade-phred under help")
+
+
+		# Throw some warnings based on unusual command-line options
+		if( args.read_length_mean > args.insert_length_mean ):
+				log.warning("Insert length mean is less than read length mean, this may significantly increase read generation time.  Please ensure this is intentional.")
+
+		
+		# Mix population files, if requested
+		if args.mix_population is not None:
+				if args.load_population is not None or args.extend_population is not None:
+						log.critical("--mix-population writes a new population, and cannot be used with --load-population or --extend-population")
+						return -1
+				filenames = []
+				weights = []
+				for value in args.mix_population:
+						filename, separator, weight = value.rpartition(':')
+						if separator != '' and re.match(r'^((?:\d+)|(?:\d*\.\d+))$', weight):
+								filenames.append(filename)
+								weights.append(float(weight))
+						else:
+								filenames.append(value)
+								weights.append(1.0)
+				populationFilename = args.output + '.population.bin'
+				log.info("Mixing %d population files into %s", len(filenames), populationFilename)
+				counts = mixPopulations(filenames, weights, populationFilename, tcrRandom(args.seed).generator, cells=args.subsample_cells)
+				for filename, count in zip(filenames, counts.tolist()):
+						log.info("%d cells from %s", count, filename)
+				return 0
+		if args.subsample_cells is not None and args.extend_population is not None:
+				log.critical("--subsample-cells cannot be used with --extend-population, which would replace the population of the file extended")
+				return -1
+		if args.subsample_cells is not None and args.load_population is not None:
+				populationFilename = args.output + '.population.bin'
+				if os.path.exists(populationFilename) and os.path.exists(args.load_population) and os.path.samefile(populationFilename, args.load_population):
+						log.critical("--subsample-cells writes BASENAME.population.bin, which cannot be the file given by --load-population, see --output")
+						return -1
+		if args.single_cell is not None and (args.single_cell < 1 or args.umis_per_chain < 1 or not 0 < args.cell_barcode_length < 32 or not 0 < args.umi_length < 32):
+				log.critical("--single-cell requires at least one cell, barcodes and UMIs of 1 to 31 bases and at least one molecule per chain")
+				return -1
+
+
+		# Reference-free runs can only produce RNA
+		if args.reference_free is True and args.sequence_type == 'dna':
+				log.critical("--reference-free can only generate RNA sequences, see --sequence-type")
+				return -1
+		if args.reference_free is True and args.extract_utr is not None:
+				log.critical("--extract-utr requires the reference chromosome(s), and cannot be used with --reference-free")
+				return -1
+
+
+		# Create our configuration object, or reuse one loaded previously
+		profile = tcrProfile(enabled = args.profile is not None)
+		profile.begin('setWorkingDir')
+		my_configuration = getConfiguration(args.working_dir, reference = not args.reference_free, utrFasta = args.utr_fasta,
+																				log = log.getChild('tcrConfig'), cache = configs)
+		my_configuration.profile = profile
+		my_configuration.progress = progress
+		my_configuration.random = tcrRandom(args.seed)
+		profile.end('setWorkingDir')
+
+
+		# Extract the UTR sequence from the reference, if requested
+		if args.extract_utr is not None:
+				log.info("Writing UTR sequence to %s", args.extract_utr)
+				my_configuration.writeUTRFasta(args.extract_utr)
+				return 0
+
+
+		# Convert a previously saved population file, if requested
+		if args.convert_population is not None:
+				populationFilename = args.output + '.population.bin'
+				log.info("Converting population file %s to %s", args.convert_population, populationFilename, my_configuration, log=log.getChild('tcrRepertoire'))
+				convertPopulation(args.convert_population, populationFilename, my_configuration, log=log.getChild('tcrRepertoire'))
+				return 0
+
+
+		# Build a chain library, if requested
+		if args.build_library is not None:
+				log.info("Writing %d chains of each receptor type to chain library %s", args.library_size, args.build_library)
+				attempts = buildChainLibrary(my_configuration, args.build_library, args.library_size)
+				for receptorType in sorted(attempts):
+						log.info("Receptor type %s: %d recombinations for %d chains", receptorType, attempts[receptorType], args.library_size)
+				return 0
+
+
+		# Save checkpoints, if requested, and read the last checkpoint if resuming
+		checkpoint = None
+		resume = None
+		if args.checkpoint_interval is not None or args.resume:
+				checkpoint = tcrCheckpoint(args.output + '.checkpoint', args.checkpoint_interval, getCheckpointArguments(args))
+		if args.resume:
+				resume = checkpoint.load(my_configuration)
+				if resume is None:
+						log.warning("No checkpoint found in %s, starting from the beginning", checkpoint.filename)
+				elif resume['arguments'] != checkpoint.arguments:
+						names = sorted(x for x in set(resume['arguments']) | set(checkpoint.arguments) if resume['arguments'].get(x) != checkpoint.arguments.get(x))
+						log.critical("Checkpoint %s was saved by a run with different options (%s), and cannot be resumed", checkpoint.filename, ', '.join(names))
+						return -1
+				else:
+						log.info("Resuming from checkpoint %s, saved at stage %s", checkpoint.filename, resume['stage'])
+		resumeReads = resume if resume is not None and resume['stage'] == 'simulateRead' else None
+
+
+		# Load our TCR repertoire from file, if requested
+		if args.cprofile is not None:
+				profile.startProfiler()
+		my_repertoire = None
+		built = False
+		if resumeReads is not None:
+				# The repertoire was written before reads were generated, see writeRepertoire()
+				if args.extend_population is not None:
+						populationFilename = args.extend_population
+				elif args.load_population is not None and args.subsample_cells is None:
+						populationFilename = args.load_population
+				else:
+						populationFilename = args.output + '.population.bin'
+				profile.begin('loadPopulation')
+				my_repertoire = loadPopulation(populationFilename, my_configuration, log=log.getChild('tcrRepertoire'), cacheSize=args.clone_cache)
+				profile.end('loadPopulation')
+
+		elif args.load_population is not None:
+				profile.begin('loadPopulation')
+				log.warning("Using previously saved T-cell population from %s, ignoring any --population... or --repertoire... options and using the settings from the saved file" % args.load_population)
+				if not isPopulationFile(args.load_population):
+						log.warning("Population file %s is in the format used by earlier versions of STIG, see --convert-population" % args.load_population)
+				my_repertoire = getPopulation(args.load_population, my_configuration, log=log.getChild('tcrRepertoire'), cache=populations)
+				profile.end('loadPopulation')
+
+		# Or grow a saved repertoire, if requested.  The population is loaded
+		# afresh, rather than from the cache, as it is changed
+		elif args.extend_population is not None:
+				if not isPopulationFile(args.extend_population):
+						log.critical("Population file %s is in the format used by earlier versions of STIG and cannot be extended, see --convert-population" % args.extend_population)
+						return -1
+				profile.begin('loadPopulation')
+				my_repertoire = loadPopulation(args.extend_population, my_configuration, log=log.getChild('tcrRepertoire'))
+				profile.end('loadPopulation')
+				my_repertoire.uniqueTCR = my_repertoire.uniqueTCR or args.repertoire_unique
+				my_repertoire.uniqueChain = my_repertoire.uniqueChain or args.repertoire_chain_unique
+				my_repertoire.uniqueCDR3 = my_repertoire.uniqueCDR3 or args.repertoire_cdr3_unique
+				if args.chain_library is not None:
+						my_repertoire.library = tcrChainLibrary(args.chain_library, my_configuration, log=log.getChild('tcrChainLibrary'))
+				log.info("Extending repertoire of %d clones from %s", len(my_repertoire.repertoire), args.extend_population)
+
+				profile.begin('tcrRepertoire')
+				first = my_repertoire.extend(args.repertoire_size)
+				profile.end('tcrRepertoire')
+
+				profile.begin('populate')
+				populateRepertoire(my_repertoire, args, first = 0 if args.repopulate else first)
+				profile.end('populate')
+
+		else:
+				log.info("Generating new repertoire")
+
+				profile.begin('tcrRepertoire')
+				trace = None
+				if args.trace is not None:
+						trace = open(args.trace, 'w' if resume is None else 'r+')
+				library = None
+				if args.chain_library is not None:
+						library = tcrChainLibrary(args.chain_library, my_configuration, log=log.getChild('tcrChainLibrary'))
+				options = { 'AB_frequency': args.receptor_ratio,
+										'uniqueTCR':    args.repertoire_unique,
+										'uniqueChain':  args.repertoire_chain_unique,
+										'uniqueCDR3':   args.repertoire_cdr3_unique,
+										'trace':        trace,
+										'library':      library,
+										'log':          log.getChild('tcrRepertoire') }
+				# With checkpoints, clones are written as they are generated, so that a resumed run can continue from them
+				built = args.out_of_core or checkpoint is not None
+				if built:
+						my_repertoire = buildRepertoire(my_configuration, args.repertoire_size, args.output + '.population.bin', cacheSize = args.clone_cache,
+																						checkpoint = checkpoint, resume = resume, **options)
+						if not args.out_of_core:
+								my_repertoire.repertoire = list(my_repertoire.repertoire)
+				else:
+						my_repertoire = tcrRepertoire(my_configuration, args.repertoire_size, **options)
+				if trace is not None:
+						my_repertoire.trace = None
+						trace.close()
+				profile.end('tcrRepertoire')
+
+				# Populate the repertiore
+				profile.begin('populate')
+				populateRepertoire(my_repertoire, args)
+				profile.end('populate')
+
+		# Draw a subset of the cells of the repertoire, if requested
+		if args.subsample_cells is not None and resumeReads is None:
+				profile.begin('subsample')
+				my_repertoire = subsampleRepertoire(my_repertoire, args.subsample_cells)
+				profile.end('subsample')
+
+		# With checkpoints, write the repertoire before generating reads, so that a resumed run can load it
+		if checkpoint is not None and resumeReads is None:
+				writeRepertoire(my_repertoire, args, profile, built)
+
+		# Obtain our simulated reads, if requested.  Reads are generated in chunks
+		# by the pipeline when checkpointed, so that they can be resumed by chunk,
+		# and for single cells, so that large libraries are streamed to the files
+		if args.sequence_count > 0 and (args.processes > 1 or checkpoint is not None or args.single_cell is not None):
+				# The random source is saved with each checkpoint and restored when
+				# resuming, as the pipeline (and --degrade-fastq-random) draw from it
+				checkpointState = None
+				if resumeReads is not None:
+						my_configuration.random.setState(resumeReads['state']['random'])
+				if checkpoint is not None:
+						checkpointState = { 'random': my_configuration.random.getState() }
+
+				# Draw the cells of a single-cell library.  They are drawn after the
+				# random source is saved, so that a resumed run draws the same cells
+				cells = None
+				if args.single_cell is not None:
+						profile.begin('singleCell')
+						try:
+								cells = tcrCells(my_repertoire, args.single_cell, barcodeLength = args.cell_barcode_length,
+																 umiLength = args.umi_length, umis = args.umis_per_chain)
+						except ValueError as error:
+								log.critical("Cannot draw %d cells for --single-cell: %s", args.single_cell, error)
+								return -1
+						cells.write(args.output + '.cells.tsv')
+						profile.end('singleCell')
+
+				degrade = None
+				if degradeOptions is not None:
+						qualities = getDegradeQualities(degradeOptions, my_configuration, log)
+						if qualities is None:
+								return -10
+						method, phred1, phred2 = qualities
+						degrade = { 'method': method, 'variability': args.degrade_variability,
+												'baseError': float(degradeOptions['baseError']), 'L': float(degradeOptions['L']),
+												'k': float(degradeOptions['k']), 'midpoint': float(degradeOptions['midpoint']),
+												'phred1': phred1, 'phred2': phred2 }
+
+				pipeline = tcrReadPipeline(my_repertoire, args.sequence_type,
+																	 { 'read_length_mean':        args.read_length_mean,
+																		 'read_length_sd':          args.read_length_sd,
+																		 'read_length_sd_cutoff':   args.read_length_sd_cutoff,
+																		 'insert_length_mean':      args.insert_length_mean,
+																		 'insert_length_sd':        args.insert_length_sd,
+																		 'insert_length_sd_cutoff': args.insert_length_sd_cutoff,
+																		 'amplicon_probe':          args.amplicon_probe,
+																		 'read_type':               args.read_type,
+																		 'cells':                   cells },
+																	 degrade = degrade, processes = args.processes, chunkSize = args.chunk_size,
+																	 truth = args.truth, coverage = args.coverage, log = log.getChild('tcrReadPipeline'))
+				if args.read_type == 'single':
+						filenames = [ args.output + '.fastq' ]
+						degradedFilenames = [ args.output + '.degraded.fastq' ]
+				else:
+						filenames = [ args.output + '_R1.fastq', args.output + '_R2.fastq' ]
+						degradedFilenames = [ args.output + '_R1.degraded.fastq', args.output + '_R2.degraded.fastq' ]
+				if degrade is None:
+						degradedFilenames = []
+
+				profile.begin('simulateRead')
+				mode = 'wb' if resumeReads is None else 'r+b'
+				with contextlib.ExitStack() as files:
+						outputs = [ files.enter_context(open(x, mode)) for x in filenames ]
+						degradedOutputs = [ files.enter_context(open(x, mode)) for x in degradedFilenames ]
+						truthOutput = files.enter_context(open(args.output + '.truth.tsv', mode)) if args.truth else None
+						pipeline.run(args.sequence_count, outputs, degradedOutputs, truthOutput, checkpoint = checkpoint, resume = resumeReads, state = checkpointState)
+				profile.end('simulateRead')
+				if pipeline.coverage is not None:
+						profile.begin('output:coverage')
+						pipeline.coverage.write(args.output + '.coverage.npz')
+						profile.end('output:coverage')
+				if args.cprofile is not None:
+						profile.stopProfiler(args.cprofile)
+
+		elif args.sequence_count > 0:
+				profile.begin('simulateRead')
+				truth = [] if args.truth or args.coverage else None
+				outputSequences = my_repertoire.simulateRead(args.sequence_count, args.sequence_type,
+																										 read_length_mean      = args.read_length_mean,
+																										 read_length_sd        = args.read_length_sd,
+																										 read_length_sd_cutoff = args.read_length_sd_cutoff,
+																										 insert_length_mean      = args.insert_length_mean,
+																										 insert_length_sd        = args.insert_length_sd,
+																										 insert_length_sd_cutoff = args.insert_length_sd_cutoff,
+																										 amplicon_probe        = args.amplicon_probe,
+																										 read_type = args.read_type,
+																										 truth = truth )
+				profile.end('simulateRead')
+				if args.cprofile is not None:
+						profile.stopProfiler(args.cprofile)
+		
+				# Write the read sequences to output file(s)
+				profile.begin('output:fastq')
+				progress.start('output:fastq', len(outputSequences), 'reads')
+				if args.read_type == 'single':
+						filenames = [ args.output + '.fastq' ]
+				elif args.read_type == 'paired' or args.read_type == 'amplicon':
+						filenames = [ args.output + '_R1.fastq', args.output + '_R2.fastq' ]
+				else:
+						raise ValueError("Unknown read_type encountered " + args.read_type)
+				with contextlib.ExitStack() as files:
+						outputs = [ files.enter_context(open(x, 'wb')) for x in filenames ]
+						for i in range(0, len(outputSequences), progress.batch):
+								for fp, data in zip(outputs, getFastq(outputSequences[i:i + progress.batch], args.read_type)):
+										fp.write(data)
+								progress.update(len(outputSequences[i:i + progress.batch]))
+				progress.finish(len(outputSequences))
+				profile.end('output:fastq')
+
+				# Write the truth of each read, if requested
+				if args.truth:
+						profile.begin('output:truth')
+						truthWriter = tcrTruthWriter(my_repertoire, args.sequence_type, args.read_type)
+						with open(args.output + '.truth.tsv', 'w') as fp:
+								fp.write(truthWriter.getHeader())
+								for i in range(0, len(truth), progress.batch):
+										fp.write(truthWriter.getLines(truth[i:i + progress.batch], i))
+						profile.end('output:truth')
+
+				# Count the coverage of each chain, if requested
+				if args.coverage:
+						profile.begin('output:coverage')
+						coverage = tcrCoverage(my_repertoire, args.sequence_type, args.read_type)
+						for i in range(0, len(truth), progress.batch):
+								coverage.add(truth[i:i + progress.batch])
+						coverage.write(args.output + '.coverage.npz')
+						profile.end('output:coverage')
+
+
+
+				# Write degraded-quality reads, if requested by the user.  n.b. the cmd line options were parsed previously and placed in degradeOptions dict
+				if degradeOptions is not None:
+						profile.begin('getDegradedFastq')
+						progress.start('getDegradedFastq', len(outputSequences), 'reads')
+						baseError = float(degradeOptions['baseError'])
+						L = float(degradeOptions['L'])
+						k = float(degradeOptions['k'])
+						midpoint = float(degradeOptions['midpoint'])
+						qualities = getDegradeQualities(degradeOptions, my_configuration, log)
+						if qualities is None:
+								return -10
+						method, phred1, phred2 = qualities
+
+						if args.read_type == 'single':
+								outputFilename = args.output + '.degraded.fastq'
+								with open(outputFilename, 'w') as fp:
+										i = 0
+										for readTuple in outputSequences:
+												read, comment = readTuple
+												ident = comment.replace('@STIG', '@STIG_DEGRADED')
+												fp.write(my_configuration.getDegradedFastq(read, method, ident, variability=args.degrade_variability, phred=phred1[i % len(phred1)], baseError=baseError, L=L, k=k, midpoint=midpoint))
+												i += 1
+												if i % progress.batch == 0:
+														progress.update(progress.batch)
+						elif args.read_type == 'paired' or args.read_type == 'amplicon':
+								output1Filename = args.output + '_R1.degraded.fastq'
+								output2Filename = args.output + '_R2.degraded.fastq'
+								with open(output1Filename, 'w') as output1:
+										with open(output2Filename, 'w') as output2:
+												i = 0
+												for readPairTuple in outputSequences:
+														readPair, comment = readPairTuple
+														read1, read2 = readPair
+														ident = comment.replace('@STIG', '@STIG_DEGRADED')
+														output1.write(my_configuration.getDegradedFastq(read1, method, ident, variability=args.degrade_variability, phred=phred1[i % len(phred1)], baseError=baseError, L=L, k=k, midpoint=midpoint))
+														output2.write(my_configuration.getDegradedFastq(read2, method, ident, variability=args.degrade_variability, phred=phred2[i % len(phred2)], baseError=baseError, L=L, k=k, midpoint=midpoint))
+														i += 1
+														if i % progress.batch == 0:
+																progress.update(progress.batch)
+						else:
+								raise ValueError("Unknown read_type encountered" + args.read_type)
+						progress.finish(len(outputSequences))
+						profile.end('getDegradedFastq')
+
+
+		if args.cprofile is not None and args.sequence_count <= 0:
+				profile.stopProfiler(args.cprofile)
+
+		if checkpoint is None:
+				writeRepertoire(my_repertoire, args, profile, built)
+
+		# The run is complete, so its checkpoint is no longer needed
+		if checkpoint is not None:
+				checkpoint.remove()
+
+		# Write our profile, if requested
+		if args.profile is not None:
+				log.info("Writing profile to %s", args.profile)
+				profile.write(args.profile)
+
+
+		log.info("All actions complete")
+		return 0
+
+
+
+# getLog - Return the 'main' logging object used by stig, with a handler
+#          writing to standard error
+#
+# Arguments: none
+#
+# Returns:
+# logging.Logger
+#
+def getLog():
+		log = logging.getLogger('main')
+		log.setLevel(logging.DEBUG)
+
+		# Stream handler to log warning and higher messages
+		if len(log.handlers) == 0:
+				sh = logging.StreamHandler()
+				sh.setFormatter(logging.Formatter(fmt='%(asctime)s.%(msecs)03d [%(levelname)s] %(name)s %(message)s',
+																					datefmt='%Y%m%d%H%M%S'))
+				log.addHandler(sh)
+		return log
+
+
+# main - Run stig with command line arguments
+#
+# Arguments:
+# argv - Optional.  Command line arguments, default is sys.argv[1:]
+#
+# Returns:
+# Exit status, 0 for success
+#
+def main(argv=None):
+		log = getLog()
+		args = getParser().parse_args(argv)
+		return run(args, log)
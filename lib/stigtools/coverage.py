@@ -0,0 +1,289 @@
+import numpy
+
+# Read coverage
+#
+# A tcrCoverage counts the coverage of each base of each chain read from,
+# and the number of reads spanning each chain's CDR3, from the records of
+# reads made by tcrRepertoire.simulateRead() (see truth.py).  Records are
+# buffered, and the start and end of each read are added in batches (with
+# numpy.add.at) to a difference array of each chain, whose cumulative sum is
+# the chain's coverage.  The reads themselves are not needed, so coverage can
+# be counted as chunks of reads are generated (see pipeline.py), and the
+# coverage of shards can be merged.
+#
+# Coverage is written with write() as a numpy .npz file of the arrays:
+#
+#   space               'dna' or 'rna'
+#   clone, chain        Clone index, and chain (1 or 2), of each chain read from
+#   length              Length of each chain's DNA or RNA
+#   offset              Offset of each chain's coverage in coverage
+#   coverage            Number of read bases on each base of each chain, where
+#                       the coverage of chain i is
+#                       coverage[offset[i]:offset[i] + length[i]].  Bases of the
+#                       UTRs are not counted
+#   reads               Number of reads from each chain
+#   cdr3_start, cdr3_end
+#                       Span of each chain's CDR3 along its sequence, or -1 if
+#                       it has none
+#   cdr3_reads          Number of reads spanning each chain's CDR3.  A paired or
+#                       amplicon read spans the CDR3 if either mate does
+#
+
+
+class tcrCoverage:
+
+		# Arguments:
+		# repertoire - Optional.  tcrRepertoire the reads are taken from.  Only
+		#              coverage read from files can be merged without one
+		# space      - 'dna' or 'rna', as given to tcrRepertoire.simulateRead()
+		# readType   - 'single', 'paired' or 'amplicon'
+		# bufferSize - Optional.  Number of reads buffered before they are counted
+		#
+		def __init__( self, repertoire, space, readType='single', bufferSize=65536 ):
+				if space not in ('dna', 'rna'):
+						raise ValueError("Space must be one of 'dna' or 'rna'")
+				self.repertoire = repertoire
+				self.space = space
+				self.readType = readType
+				self.bufferSize = bufferSize
+				self.pending = []
+
+				# Per chain: (clone, chain) -> index into the lists below
+				self.chains = {}
+				self.clones = []
+				self.chainNumbers = []
+				self.lengths = []
+				self.offsets = []
+				self.cdr3Starts = []
+				self.cdr3Ends = []
+				self.reads = numpy.zeros(0, dtype=numpy.int64)
+				self.cdr3Reads = numpy.zeros(0, dtype=numpy.int64)
+
+				# Difference arrays of every chain, each of its length + 1
+				self.difference = numpy.zeros(0, dtype=numpy.int64)
+				self.size = 0
+
+
+		# addChain - Allocate the counters of a chain
+		#
+		# Returns:
+		# Index of the chain
+		#
+		def addChain( self, clone, chain, length, cdr3Start, cdr3End ):
+				index = len(self.clones)
+				self.chains[(clone, chain)] = index
+				self.clones.append(clone)
+				self.chainNumbers.append(chain)
+				self.lengths.append(length)
+				self.offsets.append(self.size)
+				self.cdr3Starts.append(cdr3Start)
+				self.cdr3Ends.append(cdr3End)
+				self.size += length + 1
+				if self.size > len(self.difference):
+						self.difference = numpy.concatenate((self.difference, numpy.zeros(max(self.size, len(self.difference)), dtype=numpy.int64)))
+				if index >= len(self.reads):
+						self.reads = numpy.concatenate((self.reads, numpy.zeros(max(index + 1, len(self.reads)), dtype=numpy.int64)))
+						self.cdr3Reads = numpy.concatenate((self.cdr3Reads, numpy.zeros(max(index + 1, len(self.cdr3Reads)), dtype=numpy.int64)))
+				return index
+
+
+		# getChainIndex - Return the index of a chain of our repertoire,
+		#                 allocating its counters when it is first read from
+		#
+		def getChainIndex( self, clone, chain ):
+				index = self.chains.get((clone, chain), None)
+				if index is not None:
+						return index
+				if self.repertoire is None:
+						raise ValueError("Coverage without a repertoire cannot count reads of new chains")
+				tcr = self.repertoire.repertoire[clone]
+				sequence = getattr(tcr, self.space.upper() + str(chain))[3]
+				cdr3 = tcr.getCDR3Sequences()[chain - 1]
+				cdr3Start = sequence.find(cdr3) if cdr3 is not None else -1
+				cdr3End = cdr3Start + len(cdr3) if cdr3Start >= 0 else -1
+				return self.addChain(clone, chain, len(sequence), cdr3Start, cdr3End)
+
+
+		# add - Count reads
+		#
+		# Arguments:
+		# records - List of records of reads, as appended to the truth list of
+		#           tcrRepertoire.simulateRead()
+		#
+		# Returns: nothing
+		#
+		def add( self, records ):
+				self.pending.extend(records)
+				if len(self.pending) >= self.bufferSize:
+						self.flush()
+
+
+		# flush - Count the reads buffered by add()
+		#
+		def flush( self ):
+				if len(self.pending) == 0:
+						return
+				records = numpy.array(self.pending, dtype=numpy.int64).reshape(len(self.pending), 6)
+				self.pending = []
+				chains = numpy.array([ self.getChainIndex(x[0], x[1]) for x in records.tolist() ], dtype=numpy.int64)
+				start, length, read1Length, read2Length = records[:, 2], records[:, 3], records[:, 4], records[:, 5]
+				if self.readType == 'single':
+						mates = [ (start, start + length) ]
+				elif self.readType == 'paired':
+						mates = [ (start, start + read1Length), (start + length - read2Length, start + length) ]
+				else:
+						mates = [ (start, start + length), (start, start + length) ]
+
+				offsets = numpy.array(self.offsets, dtype=numpy.int64)[chains]
+				lengths = numpy.array(self.lengths, dtype=numpy.int64)[chains]
+				cdr3Starts = numpy.array(self.cdr3Starts, dtype=numpy.int64)[chains]
+				cdr3Ends = numpy.array(self.cdr3Ends, dtype=numpy.int64)[chains]
+				spanning = numpy.zeros(len(records), dtype=bool)
+				for mateStart, mateEnd in mates:
+						first = numpy.clip(mateStart, 0, lengths)
+						last = numpy.clip(mateEnd, 0, lengths)
+						covered = last > first
+						numpy.add.at(self.difference, offsets[covered] + first[covered], 1)
+						numpy.add.at(self.difference, offsets[covered] + last[covered], -1)
+						spanning |= (cdr3Starts >= 0) & (mateStart <= cdr3Starts) & (mateEnd >= cdr3Ends)
+				numpy.add.at(self.reads, chains, 1)
+				numpy.add.at(self.cdr3Reads, chains[spanning], 1)
+
+
+		# getCoverage - Return the coverage of a chain
+		#
+		# Arguments:
+		# clone - Clone index
+		# chain - 1 or 2
+		#
+		# Returns:
+		# numpy array of the coverage of each base, or None if the chain has not
+		# been read from
+		#
+		def getCoverage( self, clone, chain ):
+				self.flush()
+				index = self.chains.get((clone, chain), None)
+				if index is None:
+						return None
+				offset = self.offsets[index]
+				return numpy.cumsum(self.difference[offset:offset + self.lengths[index]])
+
+
+		# merge - Add the counts of other coverage, e.g. of another shard, to ours
+		#
+		# Arguments:
+		# other - tcrCoverage object, of the same repertoire and space
+		#
+		# Returns:
+		# This object
+		#
+		def merge( self, other ):
+				if other.space != self.space:
+						raise ValueError("Cannot merge coverage of %s with coverage of %s" % (other.space, self.space))
+				self.flush()
+				other.flush()
+				for (clone, chain), otherIndex in other.chains.items():
+						index = self.chains.get((clone, chain), None)
+						if index is None:
+								index = self.addChain(clone, chain, other.lengths[otherIndex], other.cdr3Starts[otherIndex], other.cdr3Ends[otherIndex])
+						elif self.lengths[index] != other.lengths[otherIndex]:
+								raise ValueError("Cannot merge coverage of clone %d chain %d, which differs in length" % (clone, chain))
+						offset = self.offsets[index]
+						otherOffset = other.offsets[otherIndex]
+						self.difference[offset:offset + self.lengths[index] + 1] += other.difference[otherOffset:otherOffset + other.lengths[otherIndex] + 1]
+						self.reads[index] += other.reads[otherIndex]
+						self.cdr3Reads[index] += other.cdr3Reads[otherIndex]
+				return self
+
+
+		# getArrays - Return our counts as arrays, in the format described above,
+		#             with chains sorted by clone and chain
+		#
+		def getArrays( self ):
+				self.flush()
+				order = sorted(self.chains.items())
+				indexes = numpy.array([ x[1] for x in order ], dtype=numpy.int64)
+				lengths = numpy.array(self.lengths, dtype=numpy.int64)[indexes] if len(order) > 0 else numpy.zeros(0, dtype=numpy.int64)
+				coverage = [ self.getCoverage(clone, chain) for (clone, chain), index in order ]
+				return {
+						'space': numpy.array(self.space),
+						'clone': numpy.array([ x[0][0] for x in order ], dtype=numpy.int64),
+						'chain': numpy.array([ x[0][1] for x in order ], dtype=numpy.uint8),
+						'length': lengths,
+						'offset': numpy.cumsum(numpy.concatenate(([0], lengths[:-1])), dtype=numpy.int64) if len(order) > 0 else lengths,
+						'coverage': numpy.concatenate(coverage).astype(numpy.uint32) if len(order) > 0 else numpy.zeros(0, dtype=numpy.uint32),
+						'reads': self.reads[indexes],
+						'cdr3_start': numpy.array(self.cdr3Starts, dtype=numpy.int64)[indexes] if len(order) > 0 else lengths,
+						'cdr3_end': numpy.array(self.cdr3Ends, dtype=numpy.int64)[indexes] if len(order) > 0 else lengths,
+						'cdr3_reads': self.cdr3Reads[indexes],
+						}
+
+
+		# write - Write our counts to a numpy .npz file
+		#
+		# Arguments:
+		# filename - Output file name, e.g. BASENAME.coverage.npz
+		#
+		# Returns: nothing
+		#
+		def write( self, filename ):
+				with open(filename, 'wb') as fp:
+						numpy.savez_compressed(fp, **self.getArrays())
+
+
+
+# readCoverage - Read coverage written by tcrCoverage.write()
+#
+# Arguments:
+# filename - Coverage file name
+#
+# Returns:
+# tcrCoverage object, without a repertoire
+#
+def readCoverage(filename):
+		with numpy.load(filename) as arrays:
+				return loadCoverage(arrays)
+
+
+# loadCoverage - Return coverage of arrays in the format written, e.g. of a
+#                checkpoint (see checkpoint.py)
+#
+# Arguments:
+# arrays     - Dict of numpy arrays, as returned by tcrCoverage.getArrays()
+# repertoire - Optional.  tcrRepertoire the reads are taken from, if more are
+#              to be counted
+# readType   - Optional.  'single', 'paired' or 'amplicon', of the reads
+#              counted
+#
+# Returns:
+# tcrCoverage object
+#
+def loadCoverage(arrays, repertoire=None, readType='single'):
+		coverage = tcrCoverage(repertoire, str(arrays['space'].item()), readType)
+		for i, (clone, chain) in enumerate(zip(arrays['clone'].tolist(), arrays['chain'].tolist())):
+				index = coverage.addChain(clone, chain, int(arrays['length'][i]), int(arrays['cdr3_start'][i]), int(arrays['cdr3_end'][i]))
+				offset = int(arrays['offset'][i])
+				counts = arrays['coverage'][offset:offset + coverage.lengths[index]].astype(numpy.int64)
+				start = coverage.offsets[index]
+				coverage.difference[start:start + len(counts) + 1] = numpy.diff(counts, prepend=0, append=0)
+				coverage.reads[index] = arrays['reads'][i]
+				coverage.cdr3Reads[index] = arrays['cdr3_reads'][i]
+		return coverage
+
+
+# mergeCoverage - Merge coverage files, e.g. of the shards of a run
+#
+# Arguments:
+# filenames - List of coverage file names
+#
+# Returns:
+# tcrCoverage object, without a repertoire
+#
+def mergeCoverage(filenames):
+		coverage = None
+		for filename in filenames:
+				if coverage is None:
+						coverage = readCoverage(filename)
+				else:
+						coverage.merge(readCoverage(filename))
+		return coverage
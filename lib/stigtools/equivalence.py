@@ -0,0 +1,126 @@
+import os
+import sys
+import math
+import importlib.util
+
+import numpy
+
+from .stigtools import chiSquareCDF
+
+# Statistical equivalence of STIG engines
+#
+# Faster versions of the random parts of STIG (rolling chewback and addition
+# lengths, choosing segments, recombination, populating repertoires,
+# simulating and degrading reads) draw their random values differently, so
+# their output cannot be compared with that of earlier versions value for
+# value.  Instead, lib/equivalence.py runs an earlier ('legacy') and a later
+# ('fast') version side by side, loaded from their own lib directories by
+# loadEngine(), and compares samples of their output with the two-sample
+# tests here:
+#
+#   chiSquareTest - Counts of categories (e.g. segment usage, or a histogram
+#                   of chewback lengths), by Pearson's chi-square test of
+#                   homogeneity
+#   ksTest        - Samples of values (e.g. clone sizes, or read start
+#                   positions), by the two-sample Kolmogorov-Smirnov test
+#
+# Both return p-values from numpy alone, without scipy.
+#
+
+
+# loadEngine - Import a copy of the stigtools package from a lib directory
+#
+# Arguments:
+# dirname - Directory containing the stigtools package, e.g. the lib
+#           directory of a git worktree of an earlier version of STIG
+# name    - Module name to import the package as, e.g. 'stigtools_legacy',
+#           so that several versions can be imported at once
+#
+# Returns:
+# The imported module
+#
+def loadEngine(dirname, name):
+		path = os.path.join(dirname, 'stigtools')
+		if not os.path.exists(os.path.join(path, '__init__.py')):
+				raise ValueError("No stigtools package found in %s" % dirname)
+		spec = importlib.util.spec_from_file_location(name, os.path.join(path, '__init__.py'), submodule_search_locations=[path])
+		module = importlib.util.module_from_spec(spec)
+		sys.modules[name] = module
+		spec.loader.exec_module(module)
+		return module
+
+
+
+# chiSquareTest - Test whether two sets of counts of categories are drawn
+#                 from the same distribution
+#
+# Categories expected to be counted fewer than minExpected times in either
+# sample are pooled into one category, where the chi-square approximation
+# would otherwise be poor.
+#
+# Arguments:
+# counts1     - Dict of category -> count, e.g. a collections.Counter
+# counts2     - Dict of category -> count
+# minExpected - Optional.  Default is 5
+#
+# Returns:
+# 3-tuple of the chi-square statistic, the p-value and the degrees of freedom
+#
+def chiSquareTest(counts1, counts2, minExpected=5):
+		categories = sorted(set(counts1) | set(counts2), key=str)
+		table = numpy.array([ [ counts1.get(x, 0) for x in categories ], [ counts2.get(x, 0) for x in categories ] ], dtype=float)
+		samples = table.sum(axis=1)
+		if samples.min() <= 0:
+				raise ValueError("Both samples must have at least one count")
+		totals = table.sum(axis=0)
+		sparse = totals * samples.min() / samples.sum() < minExpected
+		if numpy.any(sparse):
+				table = numpy.column_stack((table[:, ~sparse], table[:, sparse].sum(axis=1)))
+		table = table[:, table.sum(axis=0) > 0]
+		if table.shape[1] < 2:
+				return (0.0, 1.0, 0)
+		expected = numpy.outer(table.sum(axis=1), table.sum(axis=0)) / table.sum()
+		statistic = float(((table - expected)**2 / expected).sum())
+		freedom = table.shape[1] - 1
+		return (statistic, float(1.0 - chiSquareCDF(numpy.array([statistic]), freedom)[0]), freedom)
+
+
+
+# ksTest - Test whether two samples of values are drawn from the same
+#          distribution
+#
+# The p-value is that of the asymptotic Kolmogorov distribution, with the
+# small sample correction of Stephens (1970).  It is conservative for
+# discrete values (e.g. read lengths), where ties make large statistics less
+# likely.
+#
+# Arguments:
+# sample1 - Sequence of numbers
+# sample2 - Sequence of numbers
+#
+# Returns:
+# 2-tuple of the statistic (the largest difference between the empirical
+# distribution functions of the samples) and the p-value
+#
+def ksTest(sample1, sample2):
+		sample1 = numpy.sort(numpy.asarray(sample1, dtype=float))
+		sample2 = numpy.sort(numpy.asarray(sample2, dtype=float))
+		if len(sample1) == 0 or len(sample2) == 0:
+				raise ValueError("Both samples must have at least one value")
+		values = numpy.concatenate((sample1, sample2))
+		difference = (numpy.searchsorted(sample1, values, side='right') / len(sample1) -
+									numpy.searchsorted(sample2, values, side='right') / len(sample2))
+		statistic = float(numpy.abs(difference).max())
+		n = math.sqrt(len(sample1) * len(sample2) / (len(sample1) + len(sample2)))
+		return (statistic, kolmogorovSurvival((n + 0.12 + 0.11 / n) * statistic))
+
+
+
+# kolmogorovSurvival - Return the probability that the Kolmogorov
+#                      distribution exceeds x
+#
+def kolmogorovSurvival(x):
+		if x < 0.2:
+				return 1.0
+		total = sum((-1)**(k - 1) * math.exp(-2 * k * k * x * x) for k in range(1, 101))
+		return min(1.0, max(0.0, 2 * total))
@@ -0,0 +1,243 @@
+import logging
+import numpy
+
+from .stigtools import tcrChain
+from .population import tcrPopulationWriter
+from .population import readFooter
+from .population import getArray
+from .population import encodeStrings
+
+# Chain library file format
+#
+# Most of the time taken to generate a repertoire is spent recombining
+# chains, most of which are rejected (e.g. for frame shifts or stop codons).
+# A chain library holds valid chains generated ahead of time, which
+# repertoires can draw from instead of recombining, see
+# tcrRepertoire(library=...).
+#
+# The file uses the population file layout (see population.py), with the
+# magic 'STIGLIB\0'.  The chains of each receptor type are stored as column
+# arrays of their tcrChain records (segment indexes and alleles, L-PART
+# allele, chewback lengths and inserted nucleotides) and their CDR3, sorted
+# by V segment, J segment and CDR3.  The footer gives, for each receptor type,
+# the first chain and number of chains of each V/J pair, so chains using a
+# given pair are found without scanning the library.  As with population
+# files, the segment fingerprint of the tcrConfig the library was built with
+# is recorded, and the library can only be used with identical segment data.
+#
+
+chainLibraryMagic = b'STIGLIB\x00'
+chainLibraryVersion = 1
+
+
+
+# buildChainLibrary - Generate valid chains and write them to a chain library
+#
+# Chains are generated as by tcr.randomize(): segments are chosen with
+# tcrConfig.chooseRandomSegment() and recombined until the chain is valid.
+#
+# Arguments:
+# config        - tcrConfig object
+# filename      - Output file name
+# size          - Number of chains of each receptor type
+# receptorTypes - Optional.  Receptor types to generate.  Default is all of
+#                 'ABGD'
+#
+# Returns:
+# Dict of receptor type -> number of recombinations attempted
+#
+def buildChainLibrary(config, filename, size, receptorTypes='ABGD'):
+		if size <= 0:
+				raise ValueError("Chain library size must be a positive integer")
+		writer = tcrPopulationWriter(filename, magic=chainLibraryMagic, version=chainLibraryVersion)
+		types = {}
+		attempts = {}
+		config.progress.start('buildChainLibrary', size * len(receptorTypes), 'chains')
+		for receptorType in receptorTypes:
+				chains = []
+				attempts[receptorType] = 0
+				while len(chains) < size:
+						attempts[receptorType] += 1
+						V = config.chooseRandomSegment(receptorType, componentName='V')
+						D = None
+						if receptorType in ('B', 'D'):
+								D = config.chooseRandomSegment(receptorType, componentName='D', V=V)
+						J = config.chooseRandomSegment(receptorType, componentName='J', V=V, D=D)
+						C = config.chooseRandomSegment(receptorType, componentName='C', V=V, D=D, J=J)
+						chain = config.recombinateChain(V, D, J, C)
+						if chain is not None:
+								chains.append((chain, chain.cdr3))
+								if len(chains) % config.progress.batch == 0:
+										config.progress.update(config.progress.batch)
+
+				chains.sort(key=lambda x: (x[0].V[0], x[0].J[0], x[1]))
+				arrays = {}
+				for name, array in encodeChains(chains).items():
+						arrays[name] = writer.writeArray(array)
+
+				groups = []
+				for i, (chain, cdr3) in enumerate(chains):
+						if len(groups) == 0 or groups[-1][0:2] != [chain.V[0], chain.J[0]]:
+								groups.append([chain.V[0], chain.J[0], i, 0])
+						groups[-1][3] += 1
+				types[receptorType] = { 'count': len(chains), 'arrays': arrays, 'groups': groups, 'attempts': attempts[receptorType] }
+
+		writer.writeFooter({
+				'version': chainLibraryVersion,
+				'metadata': { 'segment_fingerprint': config.getSegmentFingerprint() },
+				'types': types,
+				})
+		config.progress.finish(size * len(receptorTypes))
+		return attempts
+
+
+
+# encodeChains - Encode tcrChain records of a single receptor type as column
+#                arrays
+#
+# Arguments:
+# chains - List of 2-tuples of a tcrChain and its CDR3
+#
+# Returns:
+# Dict of column name -> numpy array
+#
+def encodeChains(chains):
+		columns = {}
+		for segment in ('V', 'D', 'J', 'C'):
+				values = [getattr(x[0], segment) for x in chains]
+				columns[segment + '_index'] = numpy.array([-1 if v is None else v[0] for v in values], dtype=numpy.int32)
+				columns[segment + '_allele'] = numpy.array([b'' if v is None else v[1].encode('ascii') for v in values], dtype='S')
+		columns['L_allele'] = numpy.array([x[0].lAllele.encode('ascii') for x in chains], dtype='S')
+		columns['chewback'] = numpy.array([(x[0].vChewback, x[0].d5Chewback, x[0].d3Chewback, x[0].jChewback) for x in chains], dtype=numpy.uint16).reshape(len(chains), 4)
+		columns['N1_offset'], columns['N1_sequence'] = encodeStrings([x[0].n1Insert for x in chains])
+		columns['N2_offset'], columns['N2_sequence'] = encodeStrings([x[0].n2Insert for x in chains])
+		columns['CDR3_offset'], columns['CDR3_sequence'] = encodeStrings([x[1] for x in chains])
+		return columns
+
+
+
+# tcrChainLibrary - Read access to a chain library
+#
+# Arrays are memory-mapped when the library is opened.  The chains of a
+# receptor type are decoded into lists the first time that type is used, so
+# that drawing a chain costs no more than building its tcrChain.
+#
+class tcrChainLibrary:
+
+		# Arguments:
+		# filename - Chain library file name
+		# config   - tcrConfig object the chains are used with
+		# log      - Optional.  Logging object
+		#
+		def __init__( self, filename, config, log=None ):
+				self.setLog(log)
+				self.filename = filename
+				self.config = config
+				footer = readFooter(filename, magic=chainLibraryMagic, version=chainLibraryVersion, name='chain library')
+				if footer['metadata']['segment_fingerprint'] != config.getSegmentFingerprint():
+						raise ValueError("Chain library was generated with different receptor segment or allele data than the working directory", filename)
+				self.types = footer['types']
+				self.buffer = numpy.memmap(filename, dtype=numpy.uint8, mode='r')
+				self.chains = {}
+				self.log.info("Opened chain library %s (%s)", filename, ', '.join("%s: %d" % (x, self.types[x]['count']) for x in sorted(self.types)))
+
+		def setLog( self, log ):
+				if( isinstance(log, logging.Logger) ):
+						self.log = log
+				elif log is None:
+						self.log = logging.getLogger(__name__)
+						self.log.setLevel(99) # A high level, effectively disabling logging
+				else:
+						raise ValueError("Log object for tcrChainLibrary must be a logging.Logger (or None, to disable)")
+
+
+		# getCount - Return the number of chains of a receptor type
+		#
+		def getCount( self, receptorType ):
+				if receptorType not in self.types:
+						return 0
+				return self.types[receptorType]['count']
+
+
+		# getChains - Return the decoded chains of a receptor type
+		#
+		# Arguments:
+		# receptorType - 'A', 'B', 'G' or 'D'
+		#
+		# Returns:
+		# List of 2-tuples of a tcrChain and its CDR3
+		#
+		def getChains( self, receptorType ):
+				chains = self.chains.get(receptorType, None)
+				if chains is not None:
+						return chains
+				if self.getCount(receptorType) == 0:
+						raise ValueError("Chain library has no chains of receptor type %s" % receptorType, self.filename)
+
+				arrays = dict((name, getArray(self.buffer, x)) for name, x in self.types[receptorType]['arrays'].items())
+				segments = {}
+				for segment in ('V', 'D', 'J', 'C'):
+						segments[segment] = [ None if index < 0 else (index, allele.decode('ascii'))
+																	for index, allele in zip(arrays[segment + '_index'].tolist(), arrays[segment + '_allele'].tolist()) ]
+				lAlleles = [ x.decode('ascii') for x in arrays['L_allele'].tolist() ]
+				chewbacks = arrays['chewback'].tolist()
+				strings = {}
+				for name in ('N1', 'N2', 'CDR3'):
+						offsets = arrays[name + '_offset'].tolist()
+						sequence = arrays[name + '_sequence'].tobytes().decode('ascii')
+						strings[name] = [ sequence[offsets[i]:offsets[i + 1]] for i in range(0, len(offsets) - 1) ]
+				chains = []
+				for i in range(0, self.getCount(receptorType)):
+						chains.append((tcrChain(receptorType, segments['V'][i], segments['D'][i], segments['J'][i], segments['C'][i], lAlleles[i],
+																		chewbacks[i][0], chewbacks[i][1], chewbacks[i][2], chewbacks[i][3], strings['N1'][i], strings['N2'][i],
+																		cdr3=strings['CDR3'][i]),
+													 strings['CDR3'][i]))
+				self.chains[receptorType] = chains
+				return chains
+
+
+		# getVJUsage - Return the number of chains using each V/J segment pair
+		#
+		# Arguments:
+		# receptorType - 'A', 'B', 'G' or 'D'
+		#
+		# Returns:
+		# Dict of 2-tuples of V and J segment indexes (into
+		# tcrConfig.receptorSegment) -> number of chains
+		#
+		def getVJUsage( self, receptorType ):
+				return dict(((V, J), count) for V, J, start, count in self.types.get(receptorType, {}).get('groups', []))
+
+
+		# findChains - Return the chains of a receptor type using a V/J segment
+		#              pair, and optionally with a given CDR3
+		#
+		# Arguments:
+		# receptorType - 'A', 'B', 'G' or 'D'
+		# V, J         - Segment indexes, into tcrConfig.receptorSegment
+		# cdr3         - Optional.  CDR3 sequence
+		#
+		# Returns:
+		# List of 2-tuples of a tcrChain and its CDR3
+		#
+		def findChains( self, receptorType, V, J, cdr3=None ):
+				for groupV, groupJ, start, count in self.types.get(receptorType, {}).get('groups', []):
+						if groupV == V and groupJ == J:
+								chains = self.getChains(receptorType)[start:start + count]
+								if cdr3 is not None:
+										chains = [ x for x in chains if x[1] == cdr3 ]
+								return chains
+				return []
+
+
+		# drawChain - Draw a chain of a receptor type, uniformly at random
+		#
+		# Arguments:
+		# receptorType - 'A', 'B', 'G' or 'D'
+		#
+		# Returns:
+		# tcrChain object
+		#
+		def drawChain( self, receptorType ):
+				chains = self.getChains(receptorType)
+				return chains[int(self.config.random.random() * len(chains))][0]
@@ -0,0 +1,321 @@
+import os
+import logging
+import itertools
+import collections
+import multiprocessing
+
+import numpy
+
+from .profiling import tcrProfile
+from .profiling import tcrProgress
+from .rng import tcrRandom
+from .truth import tcrTruthWriter
+from .coverage import tcrCoverage
+from .coverage import loadCoverage
+
+# Pipelined read generation
+#
+# Sampling reads from a repertoire, degrading them and formatting them as
+# FASTQ are CPU bound, and take almost all of the time of a large run.  A
+# tcrReadPipeline splits the reads requested into chunks, which a pool of
+# worker processes sample, format and degrade independently, while this
+# process writes the finished chunks to the output files in order.
+#
+# Each chunk draws its random values from its own generator, seeded from the
+# pipeline's seed and the chunk's index, so the reads written depend only on
+# the seed and the chunk size, and not on the number of workers or the order
+# in which they finish.  At most queueSize chunks are in flight (being
+# generated, or finished but waiting for an earlier chunk to be written), which
+# bounds memory use when the workers outpace the writer.
+#
+# With a checkpoint (see checkpoint.py), the number of chunks written and the
+# length of each output file are saved from time to time, and a run resumed
+# from the checkpoint truncates the files to those lengths and continues from
+# the next chunk, which is generated as it would have been.
+#
+# Workers are forked, sharing the repertoire (and its configuration and any
+# memory-mapped population file) with this process.  Where processes cannot be
+# forked, chunks are generated in this process instead.
+#
+
+# The pipeline being run, inherited by forked workers
+activePipeline = None
+
+
+# getFastq - Format reads as FASTQ, with the highest quality scores
+#
+# Arguments:
+# reads    - List of reads, as returned by tcrRepertoire.simulateRead()
+# readType - 'single', 'paired' or 'amplicon'
+#
+# Returns:
+# List of FASTQ records as bytes, one for single reads, or two for paired or
+# amplicon reads, to be written to files opened in binary mode
+#
+def getFastq(reads, readType):
+		if readType == 'single':
+				return [ ''.join("%s\n%s\n+\n%s\n" % (comment, read, 'J' * len(read)) for read, comment in reads).encode('ascii') ]
+		return [ ''.join("%s\n%s\n+\n%s\n" % (comment, pair[0], 'J' * len(pair[0])) for pair, comment in reads).encode('ascii'),
+						 ''.join("%s\n%s\n+\n%s\n" % (comment, pair[1], 'J' * len(pair[1])) for pair, comment in reads).encode('ascii') ]
+
+
+# simulateChunk - Generate a chunk of reads in a worker, see
+#                 tcrReadPipeline.simulateChunk()
+#
+def simulateChunk(chunk):
+		return activePipeline.simulateChunk(chunk)
+
+
+class tcrReadPipeline:
+
+		# Arguments:
+		# repertoire  - tcrRepertoire, populated, to sample reads from
+		# space       - 'dna' or 'rna', see tcrRepertoire.simulateRead()
+		# readOptions - Dict of further keyword arguments to simulateRead(),
+		#               e.g. read_type and read_length_mean
+		# degrade     - Optional.  Dict of keyword arguments to
+		#               tcrConfig.getDegradedFastq() (method, variability,
+		#               baseError, L, k and midpoint), with lists of Phred+33
+		#               strings phred1 and phred2 used in turn for the first and
+		#               second reads.  If None, reads are not degraded
+		# processes   - Number of worker processes.  Default is 2
+		# chunkSize   - Number of reads in each chunk.  Default is 10000
+		# queueSize   - Maximum number of chunks in flight.  Default is twice
+		#               the number of processes
+		# seed        - Optional.  Integer seed.  Default is to draw one from the
+		#               repertoire configuration's random source
+		# truth       - Optional.  If True, the truth of each read is also
+		#               generated, see truth.py
+		# coverage    - Optional.  If True, the coverage of each chain read from
+		#               is counted as chunks are written, see coverage.py and
+		#               self.coverage
+		# log         - Optional.  Logging object
+		#
+		def __init__( self, repertoire, space, readOptions, degrade=None, processes=2, chunkSize=10000, queueSize=None, seed=None, truth=False, coverage=False, log=None ):
+				if processes < 1 or chunkSize < 1:
+						raise ValueError("A read pipeline needs at least one process and one read per chunk")
+				self.setLog(log)
+				self.repertoire = repertoire
+				self.space = space
+				self.readOptions = readOptions
+				self.readType = readOptions.get('read_type', 'single')
+				self.degrade = degrade
+				self.processes = processes
+				self.chunkSize = chunkSize
+				self.queueSize = queueSize if queueSize is not None else 2 * processes
+				if seed is None:
+						seed = int(repertoire.config.random.generator.integers(2**63))
+				self.seed = seed
+				self.profileEnabled = repertoire.config.profile.enabled
+				self.truth = tcrTruthWriter(repertoire, space, self.readType) if truth else None
+				self.coverage = tcrCoverage(repertoire, space, self.readType) if coverage else None
+
+		def setLog( self, log ):
+				if( isinstance(log, logging.Logger) ):
+						self.log = log
+				elif log is None:
+						self.log = logging.getLogger(__name__)
+						self.log.setLevel(99) # A high level, effectively disabling logging
+				else:
+						raise ValueError("Log object for tcrReadPipeline must be a logging.Logger (or None, to disable)")
+
+
+		# getChunks - Divide a number of reads into chunks
+		#
+		# Arguments:
+		# count - Number of reads
+		#
+		# Returns:
+		# Generator of 3-tuples of the chunk index, the number of its first read
+		# and its number of reads
+		#
+		def getChunks( self, count ):
+				for index, offset in enumerate(range(0, count, self.chunkSize)):
+						yield (index, offset, min(self.chunkSize, count - offset))
+
+
+		# simulateChunk - Generate, format and degrade a chunk of reads
+		#
+		# Arguments:
+		# chunk - 3-tuple, see getChunks()
+		#
+		# Returns:
+		# 5-tuple of a list of FASTQ records (one for each output file), a list of
+		# degraded FASTQ records (or None), the truth lines (or None), all as
+		# bytes, the records of the reads if coverage is counted (or None), and a
+		# dict of profile counters
+		#
+		def simulateChunk( self, chunk ):
+				index, offset, count = chunk
+				config = self.repertoire.config
+				config.random = tcrRandom(numpy.random.SeedSequence(self.seed, spawn_key=(index,)))
+				config.profile = tcrProfile(enabled = self.profileEnabled)
+				config.progress = tcrProgress()
+
+				records = [] if self.truth is not None or self.coverage is not None else None
+				reads = self.repertoire.simulateRead(count, self.space, first_read=offset, truth=records, **self.readOptions)
+				degraded = None
+				if self.degrade is not None:
+						degraded = self.getDegradedFastq(reads, offset)
+				truth = None
+				if self.truth is not None:
+						truth = self.truth.getLines(records, offset).encode('ascii')
+				if self.coverage is None:
+						records = None
+				return (getFastq(reads, self.readType), degraded, truth, records, dict(config.profile.counters))
+
+
+		# getDegradedFastq - Degrade reads and format them as FASTQ, see
+		#                    tcrConfig.getDegradedFastq()
+		#
+		# Arguments:
+		# reads  - List of reads, as returned by tcrRepertoire.simulateRead()
+		# offset - Number of the first read, which chooses the Phred strings used
+		#
+		# Returns:
+		# List of FASTQ records as bytes, see getFastq()
+		#
+		def getDegradedFastq( self, reads, offset ):
+				config = self.repertoire.config
+				options = dict(self.degrade)
+				phred1 = options.pop('phred1')
+				phred2 = options.pop('phred2')
+				output1 = []
+				output2 = []
+				for i, (read, comment) in enumerate(reads, offset):
+						ident = comment.replace('@STIG', '@STIG_DEGRADED')
+						if self.readType == 'single':
+								output1.append(config.getDegradedFastq(read, ident=ident, phred=phred1[i % len(phred1)], **options))
+						else:
+								output1.append(config.getDegradedFastq(read[0], ident=ident, phred=phred1[i % len(phred1)], **options))
+								output2.append(config.getDegradedFastq(read[1], ident=ident, phred=phred2[i % len(phred2)], **options))
+				if self.readType == 'single':
+						return [ ''.join(output1).encode('ascii') ]
+				return [ ''.join(output1).encode('ascii'), ''.join(output2).encode('ascii') ]
+
+
+		# run - Generate reads, writing them to files in order
+		#
+		# Arguments:
+		# count           - Number of reads
+		# outputs         - List of binary file objects FASTQ is written to, one
+		#                   for single reads or two for paired or amplicon reads
+		# degradedOutputs - Optional.  List of binary file objects degraded FASTQ
+		#                   is written to, required if reads are degraded
+		# truthOutput     - Optional.  Binary file object the truth is written to,
+		#                   required if the pipeline generates the truth
+		# checkpoint      - Optional.  tcrCheckpoint our progress is saved to
+		#                   before the first chunk is written, and when due after
+		#                   each chunk is written
+		# resume          - Optional.  Checkpoint saved by run(), as returned by
+		#                   tcrCheckpoint.load(), to continue from.  The output
+		#                   files must be opened for update
+		# state           - Optional.  Dict of further values saved with each
+		#                   checkpoint
+		#
+		# Returns: nothing
+		#
+		def run( self, count, outputs, degradedOutputs=None, truthOutput=None, checkpoint=None, resume=None, state=None ):
+				global activePipeline
+				config = self.repertoire.config
+				profile = config.profile
+				progress = config.progress
+				rng = config.random
+
+				context = None
+				if self.processes > 1 and multiprocessing.current_process().daemon:
+						# e.g. a sample of stig batch, run in a pool whose workers cannot have children
+						self.log.warning("Daemonic processes cannot start processes, generating reads in a single process")
+				elif self.processes > 1:
+						try:
+								context = multiprocessing.get_context('fork')
+						except ValueError:
+								self.log.warning("Processes cannot be forked on this platform, generating reads in a single process")
+
+				first = 0
+				if resume is not None:
+						if resume['state']['seed'] != self.seed:
+								raise ValueError("Checkpoint was saved by a read pipeline with a different seed")
+						first = resume['state']['chunks']
+						for fp, offset in zip(self.getFiles(outputs, degradedOutputs, truthOutput), resume['state']['offsets']):
+								fp.seek(offset)
+								fp.truncate()
+						if self.coverage is not None:
+								self.coverage = loadCoverage(resume['arrays'], self.repertoire, self.readType)
+				elif self.truth is not None:
+						truthOutput.write(self.truth.getHeader().encode('ascii'))
+				progress.start('simulateRead', count, 'reads')
+				progress.update(min(count, first * self.chunkSize))
+				if checkpoint is not None and resume is None:
+						self.saveCheckpoint(checkpoint, 0, outputs, degradedOutputs, truthOutput, state)
+				activePipeline = self
+				try:
+						if context is None:
+								for chunk in itertools.islice(self.getChunks(count), first, None):
+										self.writeChunk(self.simulateChunk(chunk), chunk, outputs, degradedOutputs, truthOutput, profile, progress, checkpoint, state)
+						else:
+								with context.Pool(self.processes) as pool:
+										# Chunks are submitted as earlier chunks are written, so that no more than queueSize are in flight
+										pending = collections.deque()
+										for chunk in itertools.islice(self.getChunks(count), first, None):
+												if len(pending) >= self.queueSize:
+														self.writeChunk(pending[0][1].get(), pending.popleft()[0], outputs, degradedOutputs, truthOutput, profile, progress, checkpoint, state)
+												pending.append((chunk, pool.apply_async(simulateChunk, (chunk,))))
+										while len(pending) > 0:
+												self.writeChunk(pending[0][1].get(), pending.popleft()[0], outputs, degradedOutputs, truthOutput, profile, progress, checkpoint, state)
+				finally:
+						activePipeline = None
+						config.profile = profile
+						config.progress = progress
+						config.random = rng
+				if self.coverage is not None:
+						self.coverage.flush()
+				progress.finish(count)
+
+
+		# writeChunk - Write a finished chunk, and save a checkpoint if one is due,
+		#              see run()
+		#
+		def writeChunk( self, result, chunk, outputs, degradedOutputs, truthOutput, profile, progress, checkpoint=None, state=None ):
+				fastq, degraded, truth, records, counters = result
+				for fp, data in zip(outputs, fastq):
+						fp.write(data)
+				if degraded is not None:
+						for fp, data in zip(degradedOutputs, degraded):
+								fp.write(data)
+				if truth is not None:
+						truthOutput.write(truth)
+				if records is not None:
+						self.coverage.add(records)
+				profile.counters.update(counters)
+				progress.update(chunk[2])
+				if self.log.isEnabledFor(logging.DEBUG):
+						self.log.debug("Wrote chunk %d (%d reads)", chunk[0], chunk[2])
+				if checkpoint is not None and checkpoint.due():
+						self.saveCheckpoint(checkpoint, chunk[0] + 1, outputs, degradedOutputs, truthOutput, state)
+
+
+		# saveCheckpoint - Save the chunks written, the length of each output file
+		#                  and the coverage counted to a checkpoint, see run()
+		#
+		# Arguments:
+		# checkpoint - tcrCheckpoint object
+		# chunks     - Number of chunks written
+		# state      - Dict of further values to save, or None
+		#
+		# Returns: nothing
+		#
+		def saveCheckpoint( self, checkpoint, chunks, outputs, degradedOutputs, truthOutput, state ):
+				offsets = []
+				for fp in self.getFiles(outputs, degradedOutputs, truthOutput):
+						fp.flush()
+						os.fsync(fp.fileno())
+						offsets.append(fp.tell())
+				checkpoint.save('simulateRead', dict(state or {}, seed=self.seed, chunks=chunks, offsets=offsets),
+												arrays=self.coverage.getArrays() if self.coverage is not None else None)
+
+
+		# getFiles - Return the list of the output files of run()
+		#
+		def getFiles( self, outputs, degradedOutputs, truthOutput ):
+				return list(outputs) + list(degradedOutputs or []) + ([ truthOutput ] if truthOutput is not None else [])
@@ -0,0 +1,732 @@
+import os
+import json
+import struct
+import pickle
+import zlib
+import collections
+import numpy
+
+from .stigtools import tcr
+from .stigtools import tcrChain
+from .stigtools import tcrRepertoire
+
+# Population file format
+#
+# A population file stores a tcrRepertoire (its clones and the population
+# distributed across them) in a versioned, columnar layout that can be
+# memory-mapped, so that a saved repertoire can be reopened without decoding
+# every clone up front.  The layout is:
+#
+#   Header:  8-byte magic 'STIGPOP\0', uint32 format version, 4 bytes padding
+#   Arrays:  Raw little-endian numpy arrays, each aligned to 64 bytes
+#   Footer:  UTF-8 JSON describing the repertoire metadata and the dtype,
+#            shape and offset of every array in the file
+#   Trailer: uint64 offset of the footer, 8-byte magic 'STIGEND\0'
+#
+# An array may also be stored zlib-compressed, in which case its descriptor
+# gives the 'compression' and the compressed 'size'.  Population files do not
+# compress their arrays, since those are memory-mapped; checkpoint files (see
+# checkpoint.py) do.
+#
+# Clones are stored in blocks of column arrays (one entry per clone, e.g. the
+# V segment index of chain 1).  Each clone's chains are stored as their
+# tcrChain records, which are rebuilt into sequences from the receptor
+# segments of the tcrConfig the population is loaded with.  Since tcrChain
+# refers to segments by index, the footer records the segment fingerprint of
+# the tcrConfig (see tcrConfig.getSegmentFingerprint()) and the population can
+# only be loaded with identical segment data.
+#
+# Clones that have no chain records (e.g. converted from pickled populations)
+# are stored with their DNA and RNA sequences instead.  Nucleotide strings of
+# a block are stored back-to-back in a single uint8 array, with an array of
+# offsets giving the start of each clone's string.  A clone is only decoded
+# into a tcr object when it is requested, see tcrCloneList.
+#
+# Files written by STIG prior to this format are pickled tcrRepertoire
+# objects; these can still be loaded, and convertPopulation() will rewrite
+# them in this format.
+#
+
+populationFileMagic = b'STIGPOP\x00'
+populationFileTrailer = b'STIGEND\x00'
+populationFileVersion = 2
+populationFileAlignment = 64
+
+# Strands are stored as a single byte
+strandCodes = {'forward': 0, 'reverse': 1}
+strandNames = ('forward', 'reverse')
+
+
+
+# isPopulationFile - Determine if a file is in the population file format
+#
+# Arguments:
+# filename - File to examine
+#
+# Returns:
+# Boolean - True if the file begins with the population file magic, False if
+#           otherwise (e.g. a pickled population from an earlier version)
+#
+def isPopulationFile(filename):
+		with open(filename, 'rb') as fp:
+				return fp.read(len(populationFileMagic)) == populationFileMagic
+
+
+
+# tcrPopulationWriter - Write a population file
+#
+# Clones are written in blocks with writeBlock(), and the file is completed
+# by close(), which writes the population array, footer and trailer.
+#
+# With append, blocks are added to an existing file: they are written over its
+# population array and footer, and the new footer lists both its blocks and
+# the new ones, so the clones already in the file are not rewritten.  Until
+# close(), abort() restores the file as it was.
+#
+# getState() flushes the blocks written so far to disk, and returns the
+# blocks and the end of the last, from which a writer given the state can
+# continue writing the file, e.g. when a run is resumed (see checkpoint.py).
+#
+# The same layout, with a different magic and version, is used by other files
+# of column arrays (see library.py).
+#
+class tcrPopulationWriter:
+
+		def __init__(self, filename, blockSize=65536, magic=populationFileMagic, version=populationFileVersion, append=False, state=None):
+				self.filename = filename
+				self.blockSize = blockSize
+				self.blocks = []
+				self.chainRecords = False
+				self.original = None
+				header = magic + struct.pack('<I', version) + b'\x00' * 4
+				if state is not None:
+						self.fp = open(filename, 'r+b')
+						self.fp.seek(state['offset'])
+						self.fp.truncate()
+						self.blocks = list(state['blocks'])
+						self.chainRecords = state['chain_records']
+						return
+				if not append:
+						self.fp = open(filename, 'wb')
+						self.fp.write(header)
+						return
+
+				footer = readFooter(filename, magic, version)
+				self.blocks = footer['blocks']
+				self.chainRecords = any('chain1_chewback' in x['arrays'] for x in self.blocks)
+				self.fp = open(filename, 'r+b')
+				originalHeader = self.fp.read(len(header))
+				self.fp.seek(-16, 2)
+				footerOffset = struct.unpack('<Q', self.fp.read(8))[0]
+
+				# The population array is written just before the footer, see close()
+				population = footer.get('population', None)
+				if population is not None and population['offset'] + numpy.dtype(population['dtype']).itemsize * int(numpy.prod(population['shape'], dtype=numpy.int64)) == footerOffset:
+						footerOffset = population['offset']
+				self.fp.seek(footerOffset)
+				self.original = (originalHeader, footerOffset, self.fp.read())
+				self.fp.seek(0)
+				self.fp.write(header)
+				self.fp.seek(footerOffset)
+				self.fp.truncate()
+
+		# getCount - Return the number of clones in the blocks of the file
+		#
+		def getCount(self):
+				return sum(x['count'] for x in self.blocks)
+
+		# getState - Flush the blocks written so far to disk, and return the state
+		#            writing can continue from
+		#
+		# Returns:
+		# Dict of JSON-serializable values, given as state to a new writer
+		#
+		def getState(self):
+				self.fp.flush()
+				os.fsync(self.fp.fileno())
+				return {'offset': self.fp.tell(), 'blocks': list(self.blocks), 'chain_records': self.chainRecords}
+
+		# writeArray - Write a numpy array at the next aligned offset
+		#
+		# Arguments:
+		# array    - numpy array
+		# compress - Optional.  If True, write the array zlib-compressed
+		#
+		# Returns:
+		# Dict describing the array (dtype, shape, offset), for the footer
+		#
+		def writeArray(self, array, compress=False):
+				array = numpy.ascontiguousarray(array)
+				if array.dtype.byteorder not in ('<', '|'):
+						array = array.astype(array.dtype.newbyteorder('<'))
+				position = self.fp.tell()
+				padding = (-position) % populationFileAlignment
+				self.fp.write(b'\x00' * padding)
+				descriptor = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': position + padding}
+				if compress:
+						data = zlib.compress(array.tobytes(), 1)
+						descriptor['compression'] = 'zlib'
+						descriptor['size'] = len(data)
+						self.fp.write(data)
+				else:
+						self.fp.write(array.tobytes())
+				return descriptor
+
+		# writeBlock - Write a block of clones
+		#
+		# Arguments:
+		# clones - List of tcr objects
+		#
+		# Returns: nothing
+		#
+		def writeBlock(self, clones):
+				for i in range(0, len(clones), self.blockSize):
+						columns = encodeClones(clones[i:i + self.blockSize])
+						arrays = {}
+						for name in sorted(columns.keys()):
+								arrays[name] = self.writeArray(columns[name])
+						self.blocks.append({'count': len(clones[i:i + self.blockSize]), 'arrays': arrays})
+						if 'chain1_chewback' in columns:
+								self.chainRecords = True
+
+		# copyBlocks - Copy the blocks of clones of a population file, without
+		#              decoding them
+		#
+		# Arguments:
+		# populationFile - tcrPopulationFile object
+		#
+		# Returns: nothing
+		#
+		def copyBlocks(self, populationFile):
+				for block in populationFile.blocks:
+						arrays = {}
+						for name in sorted(block['arrays'].keys()):
+								arrays[name] = self.writeArray(populationFile.getArray(block['arrays'][name]))
+						self.blocks.append({'count': block['count'], 'arrays': arrays})
+				self.chainRecords = self.chainRecords or populationFile.chainRecords
+
+		# close - Complete the population file
+		#
+		# Arguments:
+		# population - Sequence of cell counts, one per clone
+		# metadata   - Dict of repertoire metadata (e.g. AB_frequency).  If chain
+		#              records were written, this must include the
+		#              'segment_fingerprint' of the tcrConfig
+		#
+		# Returns: nothing
+		#
+		def close(self, population, metadata):
+				if self.chainRecords and metadata.get('segment_fingerprint', None) is None:
+						raise ValueError("Segment fingerprint is required when saving chain records")
+				self.writeFooter({
+						'version': populationFileVersion,
+						'metadata': metadata,
+						'population': self.writeArray(numpy.asarray(population, dtype=numpy.int64)),
+						'blocks': self.blocks,
+						})
+
+		# writeFooter - Write the footer and trailer, and close the file
+		#
+		# Arguments:
+		# footer - Dict, written as JSON
+		#
+		# Returns: nothing
+		#
+		def writeFooter(self, footer):
+				footerOffset = self.fp.tell()
+				self.fp.write(json.dumps(footer, sort_keys=True).encode('utf-8'))
+				self.fp.write(struct.pack('<Q', footerOffset) + populationFileTrailer)
+				self.fp.close()
+
+		# abort - Close the file without completing it.  A file being appended to
+		#         is restored as it was
+		#
+		# Returns: nothing
+		#
+		def abort(self):
+				if self.original is not None:
+						header, footerOffset, footer = self.original
+						self.fp.seek(0)
+						self.fp.write(header)
+						self.fp.seek(footerOffset)
+						self.fp.write(footer)
+						self.fp.truncate()
+				self.fp.close()
+
+
+
+# encodeStrings - Encode a list of strings as offset-indexed bytes
+#
+# Arguments:
+# values - List of strings
+#
+# Returns:
+# 2-tuple of numpy arrays: (offsets, bytes), where string i is
+# bytes[offsets[i]:offsets[i + 1]]
+#
+def encodeStrings(values):
+		values = [v.encode('ascii') for v in values]
+		return (numpy.cumsum([0] + [len(v) for v in values], dtype=numpy.int64),
+						numpy.frombuffer(b''.join(values), dtype=numpy.uint8))
+
+def decodeString(arrays, name, i):
+		start, end = arrays[name + '_offset'][i:i + 2]
+		return arrays[name + '_sequence'][start:end].tobytes().decode('ascii')
+
+
+
+# encodeClones - Encode a list of tcr objects as column arrays
+#
+# Arguments:
+# clones - List of tcr objects
+#
+# Returns:
+# Dict of column name -> numpy array
+#
+def encodeClones(clones):
+		columns = {}
+		columns['type'] = numpy.array([(x.type1 + x.type2).encode('ascii') for x in clones], dtype='S2')
+		chainRecords = all(x.chain1 is not None and x.chain2 is not None and len(x.sequences) == 0 for x in clones)
+		for chain in ('1', '2'):
+				for segment in ('V', 'D', 'J', 'C'):
+						values = [getattr(x, segment + chain) for x in clones]
+						columns[segment + chain + '_index'] = numpy.array([-1 if v is None else v[0] for v in values], dtype=numpy.int32)
+						columns[segment + chain + '_allele'] = numpy.array([b'' if v is None else v[1].encode('ascii') for v in values], dtype='S')
+
+				if chainRecords:
+						records = [getattr(x, 'chain' + chain) for x in clones]
+						name = 'chain' + chain
+						columns[name + '_L_allele'] = numpy.array([r.lAllele.encode('ascii') for r in records], dtype='S')
+						columns[name + '_chewback'] = numpy.array([(r.vChewback, r.d5Chewback, r.d3Chewback, r.jChewback) for r in records], dtype=numpy.uint16).reshape(len(records), 4)
+						columns[name + '_N1_offset'], columns[name + '_N1_sequence'] = encodeStrings([r.n1Insert for r in records])
+						columns[name + '_N2_offset'], columns[name + '_N2_sequence'] = encodeStrings([r.n2Insert for r in records])
+						continue
+
+				for space in ('DNA', 'RNA'):
+						values = [getattr(x, space + chain) for x in clones]
+						name = space + chain
+						columns[name + '_chromosome'] = numpy.array([v[0] for v in values], dtype=numpy.int16)
+						columns[name + '_start'] = numpy.array([v[1] for v in values], dtype=numpy.int64)
+						columns[name + '_start_strand'] = numpy.array([strandCodes[v[2]] for v in values], dtype=numpy.uint8)
+						columns[name + '_end'] = numpy.array([v[4] for v in values], dtype=numpy.int64)
+						columns[name + '_end_strand'] = numpy.array([strandCodes[v[5]] for v in values], dtype=numpy.uint8)
+						columns[name + '_offset'], columns[name + '_sequence'] = encodeStrings([v[3] for v in values])
+		return columns
+
+
+
+# readFooter - Read the footer of a file in the population file layout
+#
+# Arguments:
+# filename - File name
+# magic    - Optional.  Magic expected at the start of the file.  Default is
+#            that of population files
+# version  - Optional.  Latest format version supported
+# name     - Optional.  Name of the kind of file, for error messages
+#
+# Returns:
+# Dict, the footer
+#
+def readFooter(filename, magic=populationFileMagic, version=populationFileVersion, name='population'):
+		with open(filename, 'rb') as fp:
+				header = fp.read(16)
+				if len(header) < 16 or header[:8] != magic:
+						raise ValueError("Not a STIG %s file" % name, filename)
+				fileVersion = struct.unpack('<I', header[8:12])[0]
+				if fileVersion > version:
+						raise ValueError("%s file version %d is newer than supported version %d" % (name.capitalize(), fileVersion, version), filename)
+				fp.seek(-16, 2)
+				trailer = fp.read(16)
+				if trailer[8:] != populationFileTrailer:
+						raise ValueError("%s file is truncated or incomplete" % name.capitalize(), filename)
+				footerOffset = struct.unpack('<Q', trailer[:8])[0]
+				fp.seek(footerOffset)
+				return json.loads(fp.read()[:-16].decode('utf-8'))
+
+
+
+# getArray - Return a (memory-mapped) array described in a footer
+#
+# Arguments:
+# buffer     - numpy.memmap of the file, as uint8
+# descriptor - Dict with dtype, shape, and offset of the array
+#
+# Returns:
+# numpy array (a copy, if the array is compressed)
+#
+def getArray(buffer, descriptor):
+		dtype = numpy.dtype(descriptor['dtype'])
+		count = int(numpy.prod(descriptor['shape'], dtype=numpy.int64))
+		if count == 0:
+				return numpy.zeros(descriptor['shape'], dtype=dtype)
+		offset = descriptor['offset']
+		if descriptor.get('compression', None) == 'zlib':
+				data = zlib.decompress(buffer[offset:offset + descriptor['size']].tobytes())
+				return numpy.frombuffer(data, dtype=dtype).reshape(descriptor['shape'])
+		return buffer[offset:offset + count * dtype.itemsize].view(dtype).reshape(descriptor['shape'])
+
+
+
+# tcrPopulationFile - Read access to a population file
+#
+# Arrays are memory-mapped rather than read, so opening a file is
+# independent of the repertoire size.  A footer may be given in place of the
+# file's own, e.g. to read the blocks of a file that is still being written
+# (see buildRepertoire()) or of a checkpoint file (see checkpoint.py).
+#
+class tcrPopulationFile:
+
+		def __init__(self, filename, footer=None):
+				self.filename = filename
+				if footer is None:
+						footer = readFooter(filename)
+				self.version = footer['version']
+				self.metadata = footer['metadata']
+				self.populationDescriptor = footer['population']
+				self.blocks = footer['blocks']
+				self.chainRecords = any('chain1_chewback' in x['arrays'] for x in self.blocks)
+				self.blockStarts = numpy.cumsum([0] + [x['count'] for x in self.blocks], dtype=numpy.int64)
+				self.buffer = numpy.memmap(filename, dtype=numpy.uint8, mode='r')
+				self.blockArrays = [None] * len(self.blocks)
+
+		def __len__(self):
+				return int(self.blockStarts[-1])
+
+		# getArray - Return a (memory-mapped) array described in the footer
+		#
+		# Arguments:
+		# descriptor - Dict with dtype, shape, and offset of the array
+		#
+		# Returns:
+		# numpy array
+		#
+		def getArray(self, descriptor):
+				return getArray(self.buffer, descriptor)
+
+		# getPopulation - Return the number of cells of each clone
+		#
+		# Returns:
+		# numpy array of integers
+		#
+		def getPopulation(self):
+				return numpy.array(self.getArray(self.populationDescriptor), dtype=numpy.int64)
+
+		# getClone - Decode a single clone
+		#
+		# Arguments:
+		# index  - Clone index
+		# config - tcrConfig object to attach to the clone
+		# log    - Optional.  Logging object for the clone
+		#
+		# Returns:
+		# tcr object
+		#
+		def getClone(self, index, config, log=None):
+				if index < 0:
+						index += len(self)
+				if index < 0 or index >= len(self):
+						raise IndexError("Clone index out of range")
+				block = int(numpy.searchsorted(self.blockStarts, index, side='right')) - 1
+				if self.blockArrays[block] is None:
+						self.blockArrays[block] = dict((name, self.getArray(x)) for name, x in self.blocks[block]['arrays'].items())
+				arrays = self.blockArrays[block]
+				i = index - int(self.blockStarts[block])
+
+				clone = tcr(self.metadata['AB_frequency'], config, log=log)
+				receptorTypes = arrays['type'][i].decode('ascii')
+				clone.type1 = receptorTypes[0]
+				clone.type2 = receptorTypes[1]
+				for chain in ('1', '2'):
+						for segment in ('V', 'D', 'J', 'C'):
+								segmentIndex = int(arrays[segment + chain + '_index'][i])
+								if segmentIndex >= 0:
+										setattr(clone, segment + chain, (segmentIndex, arrays[segment + chain + '_allele'][i].decode('ascii')))
+
+						name = 'chain' + chain
+						if name + '_chewback' in arrays:
+								chewback = [int(x) for x in arrays[name + '_chewback'][i]]
+								setattr(clone, name, tcrChain(receptorTypes[int(chain) - 1],
+																							getattr(clone, 'V' + chain), getattr(clone, 'D' + chain),
+																							getattr(clone, 'J' + chain), getattr(clone, 'C' + chain),
+																							arrays[name + '_L_allele'][i].decode('ascii'),
+																							chewback[0], chewback[1], chewback[2], chewback[3],
+																							decodeString(arrays, name + '_N1', i), decodeString(arrays, name + '_N2', i)))
+								continue
+
+						for space in ('DNA', 'RNA'):
+								name = space + chain
+								setattr(clone, name, (int(arrays[name + '_chromosome'][i]),
+																			int(arrays[name + '_start'][i]),
+																			strandNames[arrays[name + '_start_strand'][i]],
+																			decodeString(arrays, name, i),
+																			int(arrays[name + '_end'][i]),
+																			strandNames[arrays[name + '_end_strand'][i]]))
+				return clone
+
+
+
+# tcrCloneList - A list-like view of the clones in a population file
+#
+# Clones are decoded on access, and the most recently used clones are kept
+# in a bounded cache.  This may be used in place of tcrRepertoire.repertoire.
+# Clones appended (see tcrRepertoire.extend()) are kept in memory, after
+# those of the file.
+#
+class tcrCloneList:
+
+		def __init__(self, populationFile, config, log=None, cacheSize=4096):
+				self.populationFile = populationFile
+				self.config = config
+				self.log = log
+				self.cacheSize = cacheSize
+				self.cache = collections.OrderedDict()
+				self.appended = []
+
+		def __len__(self):
+				return len(self.populationFile) + len(self.appended)
+
+		def append(self, clone):
+				self.appended.append(clone)
+
+		def __getitem__(self, index):
+				if index < 0:
+						index += len(self)
+				if index >= len(self.populationFile):
+						return self.appended[index - len(self.populationFile)]
+				clone = self.cache.get(index, None)
+				if clone is not None:
+						self.cache.move_to_end(index)
+						return clone
+				clone = self.populationFile.getClone(index, self.config, log=self.log)
+				self.cache[index] = clone
+				if len(self.cache) > self.cacheSize:
+						self.cache.popitem(last=False)
+				return clone
+
+		def __iter__(self):
+				for i in range(0, len(self)):
+						yield self[i]
+
+
+
+# savePopulation - Write a repertoire to a population file
+#
+# The clones of a repertoire loaded from a population file (and not since
+# extended) are copied from that file without being decoded.
+#
+# Arguments:
+# repertoire - tcrRepertoire object
+# filename   - Output file name
+# blockSize  - Optional.  Number of clones per block.  Default is 65536
+#
+# Returns: nothing
+#
+def savePopulation(repertoire, filename, blockSize=65536):
+		if isinstance(repertoire.repertoire, tcrCloneList):
+				source = repertoire.repertoire.populationFile.filename
+				if os.path.exists(filename) and os.path.samefile(filename, source):
+						raise ValueError("Cannot save a population over the file it was loaded from, see appendPopulation()", filename)
+		writer = tcrPopulationWriter(filename, blockSize=blockSize)
+		try:
+				if isinstance(repertoire.repertoire, tcrCloneList) and len(repertoire.repertoire.appended) == 0:
+						writer.copyBlocks(repertoire.repertoire.populationFile)
+				else:
+						clones = []
+						for clone in repertoire.repertoire:
+								clones.append(clone)
+								if len(clones) == blockSize:
+										writer.writeBlock(clones)
+										clones = []
+						if len(clones) > 0:
+								writer.writeBlock(clones)
+				writer.close(repertoire.population, getPopulationMetadata(repertoire))
+		except BaseException:
+				# An incomplete file is not left behind, to be mistaken for a population
+				writer.abort()
+				os.remove(filename)
+				raise
+
+
+
+# getPopulationMetadata - Return the metadata of a repertoire saved in the
+#                         footer of its population file
+#
+def getPopulationMetadata(repertoire):
+		return {
+				'AB_frequency': repertoire.AB_frequency,
+				'distribution': repertoire.distribution,
+				'population_size': repertoire.population_size,
+				'segment_fingerprint': repertoire.config.getSegmentFingerprint() if repertoire.config is not None else None,
+				'unique_cdr3': repertoire.uniqueCDR3,
+				'unique_chain': repertoire.uniqueChain,
+				'unique_tcr': repertoire.uniqueTCR,
+				}
+
+
+
+# appendPopulation - Append the clones of a repertoire added since it was
+#                    loaded from a population file (see tcrRepertoire.extend())
+#                    to that file, and update its population and metadata.
+#                    The clones already in the file are not rewritten
+#
+# Arguments:
+# repertoire - tcrRepertoire object, whose first clones are those of the file
+# filename   - Population file the repertoire was loaded from
+# blockSize  - Optional.  Number of clones per block.  Default is 65536
+#
+# Returns: nothing
+#
+def appendPopulation(repertoire, filename, blockSize=65536):
+		writer = tcrPopulationWriter(filename, blockSize=blockSize, append=True)
+		try:
+				first = writer.getCount()
+				if first > len(repertoire.repertoire):
+						raise ValueError("Population file holds more clones than the repertoire appended to it", filename)
+				for i in range(first, len(repertoire.repertoire), blockSize):
+						writer.writeBlock([ repertoire.repertoire[j] for j in range(i, min(i + blockSize, len(repertoire.repertoire))) ])
+				writer.close(repertoire.population, getPopulationMetadata(repertoire))
+		except BaseException:
+				writer.abort()
+				raise
+
+
+
+# buildRepertoire - Generate a repertoire out of core
+#
+# Clones are generated as by tcrRepertoire(), but written to a population
+# file in blocks as they are generated, rather than kept in memory.  The
+# repertoire returned reads its clones from the file through a bounded cache
+# (see tcrCloneList), so populate(), simulateRead() and the statistics output
+# work as for a repertoire in memory, and memory use does not grow with the
+# repertoire (except for the uniqueness indexes, see
+# tcrRepertoire.getUniqueKeys()).  The file is written with no cells; once
+# the repertoire is populated, appendPopulation() writes its population and
+# metadata without rewriting its clones.
+#
+# With a checkpoint, the progress of the repertoire (the clones written, those
+# generated since the last block was written, and the state of the random
+# source) is saved to it from time to time, and a repertoire can be resumed
+# from a checkpoint it saved: the file is truncated to the clones written when
+# the checkpoint was saved, and generation continues from there, giving the
+# repertoire that would have been generated had it not been stopped.
+#
+# Arguments:
+# config     - tcrConfig object
+# size       - Number of clones
+# filename   - Population file clones are written to
+# blockSize  - Optional.  Number of clones generated and written at a time.
+#              Default is 65536
+# cacheSize  - Optional.  Number of decoded clones kept in memory
+# log        - Optional.  Logging object for the repertoire
+# checkpoint - Optional.  tcrCheckpoint progress is saved to when due, see
+#              checkpoint.py
+# resume     - Optional.  Checkpoint saved by buildRepertoire(), as returned by
+#              tcrCheckpoint.load(), to continue from
+# options    - Further keyword arguments to tcrRepertoire(), e.g.
+#              AB_frequency, uniqueCDR3, trace and library
+#
+# Returns:
+# tcrRepertoire object
+#
+def buildRepertoire(config, size, filename, blockSize=65536, cacheSize=4096, log=None, checkpoint=None, resume=None, **options):
+		repertoire = tcrRepertoire(config, 0, log=log, **options)
+		clones = []
+		if resume is None:
+				writer = tcrPopulationWriter(filename, blockSize=blockSize)
+		else:
+				# The clones generated before the checkpoint are added to our uniqueness indexes and summary
+				state = resume['state']
+				writer = tcrPopulationWriter(filename, blockSize=blockSize, state=state['writer'])
+				written = tcrPopulationFile(filename, footer={'version': populationFileVersion, 'metadata': getPopulationMetadata(repertoire), 'population': None, 'blocks': writer.blocks})
+				repertoire.repertoire = tcrCloneList(written, config, log=repertoire.log.getChild('tcr'), cacheSize=cacheSize)
+				for clone in resume['clones']:
+						repertoire.repertoire.append(clone)
+				repertoire.indexClones()
+				clones = list(resume['clones'])
+				config.random.setState(state['random'])
+				if repertoire.trace is not None:
+						repertoire.trace.seek(state['trace'])
+						repertoire.trace.truncate()
+		first = writer.getCount() + len(clones)
+		try:
+				config.progress.start('tcrRepertoire', size, 'clones')
+				config.progress.update(first)
+				for i in range(first, size):
+						clones.append(repertoire.generateClone(i))
+						if (i + 1 - first) % config.progress.batch == 0:
+								config.progress.update(config.progress.batch)
+						if len(clones) == blockSize or i == size - 1:
+								writer.writeBlock(clones)
+								clones = []
+						if checkpoint is not None and checkpoint.due():
+								trace = None
+								if repertoire.trace is not None:
+										repertoire.trace.flush()
+										trace = repertoire.trace.tell()
+								checkpoint.save('tcrRepertoire', { 'clones': i + 1, 'writer': writer.getState(), 'random': config.random.getState(), 'trace': trace },
+																clones=clones, metadata=getPopulationMetadata(repertoire))
+				config.progress.finish(size)
+				writer.close(numpy.zeros(size, dtype=numpy.int64), getPopulationMetadata(repertoire))
+		except BaseException:
+				writer.abort()
+				raise
+		repertoire.repertoire = tcrCloneList(tcrPopulationFile(filename), config, log=repertoire.log.getChild('tcr'), cacheSize=cacheSize)
+		repertoire.population = numpy.zeros(size, dtype=numpy.int64)
+		return repertoire
+
+
+
+# loadPopulation - Load a repertoire from a population file
+#
+# Both population files and pickled populations from earlier versions of
+# STIG are accepted.
+#
+# Arguments:
+# filename  - Population file name
+# config    - tcrConfig object for the repertoire
+# log       - Optional.  Logging object for the repertoire
+# cacheSize - Optional.  Number of decoded clones to keep in memory
+#
+# Returns:
+# tcrRepertoire object
+#
+def loadPopulation(filename, config, log=None, cacheSize=4096):
+		if not isPopulationFile(filename):
+				with open(filename, 'rb') as fp:
+						repertoire = pickle.load(fp)
+				repertoire.thaw(log=log, config=config)
+				return repertoire
+
+		populationFile = tcrPopulationFile(filename)
+		if populationFile.chainRecords and populationFile.metadata['segment_fingerprint'] != config.getSegmentFingerprint():
+				raise ValueError("Population file was generated with different receptor segment or allele data than the working directory", filename)
+		repertoire = tcrRepertoire(config, 0, log=log, AB_frequency=populationFile.metadata['AB_frequency'])
+		repertoire.repertoire = tcrCloneList(populationFile, config, log=repertoire.log.getChild('tcr'), cacheSize=cacheSize)
+		repertoire.population = populationFile.getPopulation()
+		repertoire.population_size = populationFile.metadata['population_size']
+		repertoire.distribution = populationFile.metadata['distribution']
+		repertoire.uniqueCDR3 = populationFile.metadata.get('unique_cdr3', False)
+		repertoire.uniqueChain = populationFile.metadata.get('unique_chain', False)
+		repertoire.uniqueTCR = populationFile.metadata.get('unique_tcr', False)
+		return repertoire
+
+
+
+# convertPopulation - Rewrite a pickled population file in the population
+#                     file format
+#
+# Arguments:
+# inputFilename  - Pickled population file, from an earlier version of STIG
+# outputFilename - Population file to write
+# config         - tcrConfig object the repertoire is thawed with
+# log            - Optional.  Logging object for the repertoire
+#
+# Returns: nothing
+#
+def convertPopulation(inputFilename, outputFilename, config, log=None):
+		if isPopulationFile(inputFilename):
+				raise ValueError("File is already in the population file format", inputFilename)
+		with open(inputFilename, 'rb') as fp:
+				repertoire = pickle.load(fp)
+		repertoire.thaw(log=log, config=config)
+		savePopulation(repertoire, outputFilename)
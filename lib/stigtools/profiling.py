@@ -0,0 +1,317 @@
+import sys
+import time
+import json
+import cProfile
+import collections
+import contextlib
+
+try:
+		import resource
+except ImportError: # e.g. Windows
+		resource = None
+
+# Profiling of STIG runs
+#
+# A tcrProfile records the wall and CPU time spent in each stage of a run
+# (e.g. repertoire generation, read simulation), together with counters of
+# events of interest within those stages (e.g. recombination attempts,
+# reference reads).  Each tcrConfig holds a disabled tcrProfile as
+# config.profile, which classes sharing the configuration use for their
+# counters.  Enabling it (see the --profile option of stig) costs little
+# beyond the counting itself.
+#
+
+
+class tcrProfile:
+
+		def __init__( self, enabled=False ):
+				self.enabled = enabled
+				self.stages = collections.OrderedDict()
+				self.running = {}
+				self.counters = collections.Counter()
+				self.profiler = None
+				self.startTime = time.perf_counter()
+
+		# begin - Start timing a stage.  See end() and stage()
+		#
+		# Arguments:
+		# name - Name of the stage.  Time spent in repeated stages of the same
+		#        name is summed
+		#
+		# Returns: nothing
+		#
+		def begin( self, name ):
+				if self.enabled:
+						self.running[name] = (time.perf_counter(), time.process_time())
+
+		# end - Stop timing a stage started with begin()
+		#
+		# Arguments:
+		# name - Name of the stage
+		#
+		# Returns: nothing
+		#
+		def end( self, name ):
+				if not self.enabled or name not in self.running:
+						return
+				wallStart, cpuStart = self.running.pop(name)
+				stage = self.stages.setdefault(name, { 'calls': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0 })
+				stage['calls'] += 1
+				stage['wall_seconds'] += time.perf_counter() - wallStart
+				stage['cpu_seconds'] += time.process_time() - cpuStart
+
+		# stage - Context manager timing a stage, e.g.
+		#
+		#         with profile.stage('simulateRead'):
+		#                 ...
+		#
+		# Arguments:
+		# name - Name of the stage
+		#
+		@contextlib.contextmanager
+		def stage( self, name ):
+				self.begin(name)
+				try:
+						yield
+				finally:
+						self.end(name)
+
+		# count - Increment a counter
+		#
+		# Arguments:
+		# name  - Counter name, e.g. 'readChromosome.calls'
+		# value - Optional.  Amount to increment by.  Default is 1
+		#
+		# Returns: nothing
+		#
+		def count( self, name, value=1 ):
+				if self.enabled:
+						self.counters[name] += value
+
+		# startProfiler - Start collecting cProfile statistics, e.g. for the hot
+		#                 section of a run.  See stopProfiler()
+		#
+		# Arguments: none
+		# Returns: nothing
+		#
+		def startProfiler( self ):
+				if self.profiler is None:
+						self.profiler = cProfile.Profile()
+				self.profiler.enable()
+
+		# stopProfiler - Stop collecting cProfile statistics
+		#
+		# Arguments:
+		# filename - Optional.  Write the statistics collected so far to this
+		#            file, which can be read with the pstats module
+		#
+		# Returns: nothing
+		#
+		def stopProfiler( self, filename=None ):
+				if self.profiler is None:
+						return
+				self.profiler.disable()
+				if filename is not None:
+						self.profiler.dump_stats(filename)
+
+		# getPeakRSS - Return the peak resident set size of this process
+		#
+		# Returns:
+		# Integer number of bytes, or None if this is not available
+		#
+		def getPeakRSS( self ):
+				if resource is None:
+						return None
+				peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+				# ru_maxrss is given in bytes on macOS, but in kilobytes elsewhere
+				if sys.platform == 'darwin':
+						return peak
+				return peak * 1024
+
+		# getReport - Summarize the profile
+		#
+		# Returns:
+		# Dict with stage times, counters, derived rates (e.g. reads per second,
+		# recombination acceptance rates) and peak memory use
+		#
+		def getReport( self ):
+				rates = {}
+				if 'simulateRead' in self.stages and self.stages['simulateRead']['wall_seconds'] > 0:
+						rates['reads_per_second'] = self.counters['simulateRead.reads'] / self.stages['simulateRead']['wall_seconds']
+				for name in sorted(self.counters.keys()):
+						if name.startswith('recombinate.attempts.') and self.counters[name] > 0:
+								chainType = name[len('recombinate.attempts.'):]
+								rates['recombinate.acceptance.%s' % chainType] = self.counters['recombinate.accepted.%s' % chainType] / self.counters[name]
+
+				return {
+						'total_wall_seconds': time.perf_counter() - self.startTime,
+						'stages': self.stages,
+						'counters': dict(sorted(self.counters.items())),
+						'rates': rates,
+						'peak_rss_bytes': self.getPeakRSS()
+						}
+
+		# write - Write the profile report to a file as JSON
+		#
+		# Arguments:
+		# filename - Output filename
+		#
+		# Returns: nothing
+		#
+		def write( self, filename ):
+				with open(filename, 'w') as fp:
+						json.dump(self.getReport(), fp, indent=2)
+						fp.write("\n")
+
+
+# Progress reporting for long runs
+#
+# A tcrProgress reports how far the current stage of a run (e.g. read
+# simulation) has got, its throughput and an estimated time to completion, at
+# most once every interval seconds.  Reports are written as text to a stream
+# (e.g. sys.stderr), and/or as JSON lines to a status file, which a scheduler
+# can follow.  Each tcrConfig holds a disabled tcrProgress as config.progress.
+#
+# Stages call update() with the number of items completed since the previous
+# call.  Callers in tight loops (e.g. per read) count locally and call update()
+# once every self.batch items, so the cost per item is an integer comparison.
+#
+
+
+class tcrProgress:
+
+		def __init__( self, interval=10, stream=None, filename=None, batch=1000 ):
+				self.interval = interval
+				self.stream = stream
+				self.statusFile = None
+				if filename is not None:
+						self.statusFile = open(filename, 'a')
+				self.enabled = self.stream is not None or self.statusFile is not None
+				self.batch = batch
+				self.stage = None
+				self.unit = None
+				self.total = 0
+				self.done = 0
+				self.startTime = None
+				self.lastReport = None
+
+		# start - Start reporting the progress of a stage
+		#
+		# Arguments:
+		# stage - Name of the stage, e.g. 'simulateRead'
+		# total - Number of items the stage will complete, or None if unknown
+		# unit  - Name of the items, e.g. 'reads'
+		#
+		# Returns: nothing
+		#
+		def start( self, stage, total, unit ):
+				if not self.enabled:
+						return
+				self.stage = stage
+				self.total = total
+				self.unit = unit
+				self.done = 0
+				self.startTime = time.perf_counter()
+				self.lastReport = self.startTime
+
+		# update - Record items completed, reporting if interval seconds have
+		#          passed since the last report
+		#
+		# Arguments:
+		# count - Number of items completed since the last call
+		#
+		# Returns: nothing
+		#
+		def update( self, count ):
+				if not self.enabled:
+						return
+				self.done += count
+				now = time.perf_counter()
+				if now - self.lastReport >= self.interval:
+						self.lastReport = now
+						self.report(now)
+
+		# finish - Report the completion of the current stage
+		#
+		# Arguments:
+		# done - Optional.  Total number of items completed, if this differs from
+		#        the count given to update(), e.g. as items were counted in batches
+		#
+		# Returns: nothing
+		#
+		def finish( self, done=None ):
+				if not self.enabled or self.stage is None:
+						return
+				if done is not None:
+						self.done = done
+				self.report(time.perf_counter(), finished=True)
+				self.stage = None
+
+		# getStatus - Return the status of the current stage
+		#
+		# Arguments:
+		# now      - perf_counter() time of the status
+		# finished - Boolean.  True if the stage has completed
+		#
+		# Returns:
+		# Dict of the stage name, items done and total, rate (items/s), elapsed
+		# seconds and estimated seconds remaining (None if unknown)
+		#
+		def getStatus( self, now, finished=False ):
+				elapsed = now - self.startTime
+				rate = self.done / elapsed if elapsed > 0 else None
+				eta = None
+				if finished is True:
+						eta = 0.0
+				elif self.total is not None and rate:
+						eta = max(self.total - self.done, 0) / rate
+				return {
+						'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+						'stage': self.stage,
+						'unit': self.unit,
+						'done': self.done,
+						'total': self.total,
+						'rate': rate,
+						'elapsed_seconds': elapsed,
+						'eta_seconds': eta,
+						'finished': finished
+						}
+
+		# report - Write the status of the current stage to our stream and/or
+		#          status file.  See getStatus()
+		#
+		def report( self, now, finished=False ):
+				status = self.getStatus(now, finished)
+				if self.statusFile is not None:
+						self.statusFile.write(json.dumps(status) + "\n")
+						self.statusFile.flush()
+				if self.stream is not None:
+						line = "%s %s: %d" % (status['time'], self.stage, self.done)
+						if self.total is not None:
+								line += "/%d" % self.total
+						line += " %s" % self.unit
+						if self.total:
+								line += " (%0.1f%%)" % (100.0 * self.done / self.total)
+						if status['rate'] is not None:
+								line += ", %0.1f %s/s" % (status['rate'], self.unit)
+						if finished is True:
+								line += ", done in %s" % self.formatSeconds(status['elapsed_seconds'])
+						elif status['eta_seconds'] is not None:
+								line += ", ETA %s" % self.formatSeconds(status['eta_seconds'])
+						self.stream.write(line + "\n")
+						self.stream.flush()
+
+		def formatSeconds( self, seconds ):
+				seconds = int(round(seconds))
+				return "%d:%02d:%02d" % (seconds // 3600, (seconds // 60) % 60, seconds % 60)
+
+		# close - Close our status file, if any
+		#
+		# Arguments: none
+		# Returns: nothing
+		#
+		def close( self ):
+				if self.statusFile is not None:
+						self.statusFile.close()
+						self.statusFile = None
+				self.enabled = self.stream is not None
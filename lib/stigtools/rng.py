@@ -0,0 +1,138 @@
+import copy
+import numpy
+
+# Random number source for STIG
+#
+# Recombination, repertoire population and read simulation draw many random
+# values, often one at a time (a uniform to roll a probability table, a
+# nucleotide to add to a junction, a read length, a read position).  Drawing
+# each of these from Python's random module, or from numpy one value at a
+# time, costs far more in call overhead than in generating the value itself.
+#
+# A tcrRandom draws values from a numpy.random.Generator in large batches,
+# and hands them out from buffers which are refilled as they run out.  Each
+# tcrConfig holds a tcrRandom as config.random, which classes sharing the
+# configuration use for all of their random choices.  Giving a seed (see the
+# --seed option of stig) makes a run reproducible, and getState() and
+# setState() let a run stopped part way continue with the same values (see
+# checkpoint.py).
+#
+
+
+class tcrRandom:
+
+		def __init__( self, seed=None, size=8192 ):
+				self.size = size
+				self.seed(seed)
+
+		# seed - Reset our generator, discarding any buffered values
+		#
+		# Arguments:
+		# seed - Optional.  Integer seed.  If None, the generator is seeded from
+		#        fresh operating system entropy
+		#
+		# Returns: nothing
+		#
+		def seed( self, seed=None ):
+				self.generator = numpy.random.default_rng(seed)
+				self.nextUniform = iter(()).__next__
+				self.nextNormal = iter(()).__next__
+				self.uniformBlock = []
+				self.uniformPosition = 0
+				self.bases = ''
+				self.basePosition = 0
+
+		# getState - Return the state of our generator and buffers
+		#
+		# Returns:
+		# Dict of JSON-serializable values, see setState()
+		#
+		def getState( self ):
+				return {
+						'size': self.size,
+						'generator': self.generator.bit_generator.state,
+						'uniforms': list(copy.copy(self.nextUniform.__self__)),
+						'normals': list(copy.copy(self.nextNormal.__self__)),
+						'uniform_block': self.uniformBlock[self.uniformPosition:],
+						'bases': self.bases[self.basePosition:],
+						}
+
+		# setState - Restore the state of our generator and buffers, so that we
+		#            draw the values we would have drawn after getState()
+		#
+		# Arguments:
+		# state - Dict returned by getState()
+		#
+		# Returns: nothing
+		#
+		def setState( self, state ):
+				self.size = state['size']
+				self.generator = numpy.random.default_rng()
+				self.generator.bit_generator.state = state['generator']
+				self.nextUniform = iter(state['uniforms']).__next__
+				self.nextNormal = iter(state['normals']).__next__
+				self.uniformBlock = list(state['uniform_block'])
+				self.uniformPosition = 0
+				self.bases = state['bases']
+				self.basePosition = 0
+
+		# random - Return a uniformly distributed float in [0, 1)
+		#
+		def random( self ):
+				try:
+						return self.nextUniform()
+				except StopIteration:
+						self.nextUniform = iter(self.generator.random(self.size).tolist()).__next__
+						return self.nextUniform()
+
+		# uniforms - Return a list of count uniformly distributed floats in
+		#            [0, 1), e.g. one for each base of a read
+		#
+		def uniforms( self, count ):
+				if self.uniformPosition + count > len(self.uniformBlock):
+						self.uniformBlock = self.generator.random(max(self.size, count)).tolist()
+						self.uniformPosition = 0
+				val = self.uniformBlock[self.uniformPosition:self.uniformPosition + count]
+				self.uniformPosition += count
+				return val
+
+		# normal - Return a normally distributed float
+		#
+		# Arguments:
+		# mean - Mean of the distribution
+		# sd   - Standard deviation of the distribution
+		#
+		def normal( self, mean, sd ):
+				try:
+						return mean + sd * self.nextNormal()
+				except StopIteration:
+						self.nextNormal = iter(self.generator.standard_normal(self.size).tolist()).__next__
+						return mean + sd * self.nextNormal()
+
+		# randrange - Return a uniformly distributed integer in [start, stop)
+		#
+		def randrange( self, start, stop ):
+				return start + int(self.random() * (stop - start))
+
+		# choice - Return a uniformly chosen element of a non-empty sequence
+		#
+		def choice( self, sequence ):
+				return sequence[int(self.random() * len(sequence))]
+
+		# shuffle - Shuffle a list in place
+		#
+		def shuffle( self, sequence ):
+				for i in range(len(sequence) - 1, 0, -1):
+						j = int(self.random() * (i + 1))
+						sequence[i], sequence[j] = sequence[j], sequence[i]
+
+		# nucleotides - Return a string of count random C, A, T or G bases
+		#
+		def nucleotides( self, count ):
+				if self.basePosition + count > len(self.bases):
+						indexes = self.generator.integers(0, 4, max(self.size, count), dtype=numpy.uint8)
+						self.bases = numpy.frombuffer(b'CATG', dtype=numpy.uint8)[indexes].tobytes().decode('ascii')
+						self.basePosition = 0
+				val = self.bases[self.basePosition:self.basePosition + count]
+				self.basePosition += count
+				return val
@@ -0,0 +1,205 @@
+import copy
+import numpy
+
+from .summary import tcrSummary
+from .population import tcrPopulationFile
+from .population import tcrPopulationWriter
+
+# Population sampling and mixing
+#
+# Sequencing depth and sample composition are simulated by operations on the
+# cell counts of saved populations, rather than by generating new
+# repertoires:
+#
+#   subsample - Draw a number of cells without replacement, e.g. a blood draw
+#               from a repertoire.  The cells drawn from each clone follow the
+#               multivariate hypergeometric distribution over
+#               tcrRepertoire.population
+#   mix       - Combine the repertoires of several population files, e.g.
+#               tumor and normal, each subsampled to a share of the cells of
+#               the mixture given by its weight
+#
+# Draws are made for all clones at once with numpy (the 'marginals' method of
+# Generator.multivariate_hypergeometric()), in time proportional to the number
+# of clones and independent of the number of cells, and no per-cell or
+# per-clone objects are made.  numpy only draws from populations of fewer than
+# 10^9 cells, so larger populations are subsampled by splitHypergeometric().
+# Mixtures copy the clone blocks of each file
+# into the new population file as they are, without decoding them.
+#
+
+# Largest population numpy's hypergeometric draws are made from
+maxHypergeometricPopulation = 10**9 - 1
+
+
+
+# subsamplePopulation - Draw cells, without replacement, from a population
+#
+# Arguments:
+# population - Sequence of cell counts, one per clone
+# cells      - Number of cells to draw
+# generator  - numpy Generator, e.g. tcrConfig.random.generator
+#
+# Returns:
+# numpy array of the cell count of each clone drawn
+#
+def subsamplePopulation(population, cells, generator):
+		population = numpy.asarray(population, dtype=numpy.int64)
+		total = int(population.sum())
+		if cells < 0 or cells > total:
+				raise ValueError("Cannot draw %d cells from a population of %d cells" % (cells, total))
+		if len(population) == 0:
+				return population.copy()
+		if total > maxHypergeometricPopulation:
+				return splitHypergeometric(population, cells, generator)
+		return generator.multivariate_hypergeometric(population, cells, method='marginals').astype(numpy.int64)
+
+
+
+# splitHypergeometric - Draw cells, without replacement, from a population
+#                       too large for numpy's hypergeometric draws
+#
+# The cells drawn from each range of clones are divided between the two
+# halves of the range by a hypergeometric draw, starting from all clones and
+# halving every range at once, until each range is one clone.  Divisions of
+# ranges of more than maxHypergeometricPopulation cells are drawn from the
+# normal approximation of the hypergeometric distribution, which is close at
+# such sizes.
+#
+# Arguments:
+# population - numpy array of cell counts, one per clone
+# cells      - Number of cells to draw
+# generator  - numpy Generator
+#
+# Returns:
+# numpy array of the cell count of each clone drawn
+#
+def splitHypergeometric(population, cells, generator):
+		totals = numpy.concatenate(([0], numpy.cumsum(population)))
+		drawn = numpy.zeros(len(population), dtype=numpy.int64)
+		starts = numpy.array([0], dtype=numpy.int64)
+		ends = numpy.array([len(population)], dtype=numpy.int64)
+		counts = numpy.array([cells], dtype=numpy.int64)
+		while len(starts) > 0:
+				single = ends - starts == 1
+				drawn[starts[single]] = counts[single]
+				starts, ends, counts = starts[~single], ends[~single], counts[~single]
+				middles = (starts + ends) // 2
+				good = totals[middles] - totals[starts]
+				bad = totals[ends] - totals[middles]
+				left = numpy.zeros(len(starts), dtype=numpy.int64)
+				exact = good + bad <= maxHypergeometricPopulation
+				if numpy.any(exact):
+						left[exact] = generator.hypergeometric(good[exact], bad[exact], counts[exact])
+				if not numpy.all(exact):
+						n, g, b = counts[~exact].astype(numpy.float64), good[~exact].astype(numpy.float64), bad[~exact].astype(numpy.float64)
+						mean = n * g / (g + b)
+						sd = numpy.sqrt(n * (g / (g + b)) * (b / (g + b)) * (g + b - n) / (g + b - 1))
+						left[~exact] = numpy.clip(numpy.rint(generator.normal(mean, sd)), numpy.maximum(0, n - b), numpy.minimum(n, g)).astype(numpy.int64)
+				starts, ends, counts = numpy.concatenate((starts, middles)), numpy.concatenate((middles, ends)), numpy.concatenate((left, counts - left))
+		return drawn
+
+
+
+# subsampleRepertoire - Return a repertoire of cells drawn from another
+#
+# The repertoire returned shares the clones of the repertoire given, which
+# is left unchanged (so may be one cached, see cli.getPopulation()).
+#
+# Arguments:
+# repertoire - tcrRepertoire object
+# cells      - Number of cells to draw
+#
+# Returns:
+# tcrRepertoire object
+#
+def subsampleRepertoire(repertoire, cells):
+		sampled = copy.copy(repertoire)
+		sampled.population = subsamplePopulation(repertoire.population, cells, repertoire.config.random.generator)
+		sampled.population_size = cells
+		sampled.summary = tcrSummary(repertoire.config).merge(repertoire.summary)
+		sampled.summary.setPopulation(sampled.population)
+		return sampled
+
+
+
+# getShares - Divide a number of cells by weight, by the largest remainder
+#             method, so the shares sum to the number of cells
+#
+# Arguments:
+# cells   - Number of cells
+# weights - Sequence of non-negative weights
+#
+# Returns:
+# numpy array of integers
+#
+def getShares(cells, weights):
+		weights = numpy.asarray(weights, dtype=numpy.float64)
+		exact = weights / weights.sum() * cells
+		shares = numpy.floor(exact).astype(numpy.int64)
+		remainder = cells - int(shares.sum())
+		if remainder > 0:
+				shares[numpy.argsort(shares - exact, kind='stable')[:remainder]] += 1
+		return shares
+
+
+
+# mixPopulations - Mix the repertoires of population files into a new
+#                  population file
+#
+# The clones of the files are written one file after another, and the cells
+# of each file are subsampled to its share of the mixture.
+#
+# Arguments:
+# filenames - List of population file names
+# weights   - List of the weight of each file, its share of the cells
+# filename  - Output population file name
+# generator - numpy Generator, e.g. tcrConfig.random.generator
+# cells     - Optional.  Number of cells of the mixture.  Default is the
+#             largest number for which each file has enough cells
+#
+# Returns:
+# numpy array of the number of cells drawn from each file
+#
+def mixPopulations(filenames, weights, filename, generator, cells=None):
+		if len(filenames) == 0 or len(filenames) != len(weights):
+				raise ValueError("A mixture needs one weight for each of at least one population file")
+		weights = numpy.asarray(weights, dtype=numpy.float64)
+		if numpy.any(weights < 0) or weights.sum() <= 0:
+				raise ValueError("Mixture weights must be non-negative, and not all zero")
+
+		populationFiles = [ tcrPopulationFile(x) for x in filenames ]
+		fingerprints = set(x.metadata['segment_fingerprint'] for x in populationFiles if x.chainRecords)
+		if len(fingerprints) > 1:
+				raise ValueError("Population files were generated with different receptor segment or allele data, and cannot be mixed")
+		populations = [ x.getPopulation() for x in populationFiles ]
+		totals = numpy.array([ x.sum() for x in populations ], dtype=numpy.int64)
+
+		shares = weights / weights.sum()
+		if cells is None:
+				cells = int(numpy.floor(numpy.min(totals[shares > 0] / shares[shares > 0])))
+				while numpy.any(getShares(cells, weights) > totals):
+						cells -= 1
+		counts = getShares(cells, weights)
+		for name, count, total in zip(filenames, counts.tolist(), totals.tolist()):
+				if count > total:
+						raise ValueError("Population file has %d cells, fewer than the %d of its share of the mixture" % (total, count), name)
+
+		writer = tcrPopulationWriter(filename)
+		sources = []
+		for i, populationFile in enumerate(populationFiles):
+				writer.copyBlocks(populationFile)
+				populations[i] = subsamplePopulation(populations[i], int(counts[i]), generator)
+				sources.append({ 'filename': filenames[i], 'clones': len(populationFile), 'cells': int(counts[i]), 'weight': float(weights[i]) })
+		clones = numpy.array([ x['clones'] for x in sources ], dtype=numpy.float64)
+		writer.close(numpy.concatenate(populations), {
+				'AB_frequency': float(numpy.sum(clones * [ x.metadata['AB_frequency'] for x in populationFiles ]) / max(1, clones.sum())),
+				'distribution': 'mixture',
+				'population_size': cells,
+				'segment_fingerprint': fingerprints.pop() if len(fingerprints) > 0 else None,
+				'unique_cdr3': False,
+				'unique_chain': False,
+				'unique_tcr': False,
+				'sources': sources,
+				})
+		return counts
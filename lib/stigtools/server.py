@@ -0,0 +1,239 @@
+import os
+import sys
+import time
+import json
+import logging
+import argparse
+import contextlib
+import socketserver
+
+from . import cli
+
+# Resident STIG server
+#
+# Starting stig imports numpy and yaml and reads the working directory before
+# any work is done, which dominates the run time of small runs.  A tcrServer
+# keeps tcrConfig objects (and population files given with --load-population)
+# loaded between runs, and runs jobs described by stig's command line
+# arguments.  Jobs are read as JSON lines, from standard input or from
+# connections to a Unix socket, and run one at a time.
+#
+# Requests:
+#   {"args": ["--repertoire-size=10", "data"], "cwd": "/some/dir", "id": 1}
+#       Run stig with the given arguments.  cwd (optional) is the directory
+#       relative filenames are taken from, by default the server's directory
+#   {"command": "ping"}      Check the server is running
+#   {"command": "status"}    List the working directories and populations loaded
+#   {"command": "reload"}    Discard loaded working directories and populations,
+#                            e.g. after changing their files
+#   {"command": "shutdown"}  Stop the server
+#
+# Each request is answered with a JSON line with the request's id (if any), a
+# status (0 for success, as for stig's exit status), the seconds taken and, if
+# the request failed, an error message.
+#
+
+
+class tcrServer:
+
+		def __init__( self, log=None ):
+				self.setLog(log)
+				self.configs = {}
+				self.populations = {}
+				self.jobs = 0
+				self.running = True
+				self.startTime = time.time()
+
+		def setLog( self, log ):
+				if( isinstance(log, logging.Logger) ):
+						self.log = log
+				elif log is None:
+						self.log = logging.getLogger(__name__)
+						self.log.setLevel(99) # A high level, effectively disabling logging
+				else:
+						raise ValueError("Log object for tcrServer must be a logging.Logger (or None, to disable)")
+
+
+		# preload - Load a working directory before any jobs are received
+		#
+		# Arguments:
+		# workingDir - Working directory, see tcrConfig.setWorkingDir()
+		# reference  - Boolean.  False for reference-free mode
+		# utrFasta   - Optional.  UTR FASTA filename, see tcrConfig.setUTRPolicy()
+		#
+		# Returns: nothing
+		#
+		def preload( self, workingDir, reference=True, utrFasta=None ):
+				self.log.info("Loading working directory %s", workingDir)
+				cli.getConfiguration(workingDir, reference=reference, utrFasta=utrFasta,
+														 log=logging.getLogger('main').getChild('tcrConfig'), cache=self.configs)
+
+
+		# handle - Handle a single request, see the description above
+		#
+		# Arguments:
+		# request - Dict, the decoded request
+		#
+		# Returns:
+		# Dict, the response
+		#
+		def handle( self, request ):
+				response = { 'status': 0 }
+				if isinstance(request, dict) and 'id' in request:
+						response['id'] = request['id']
+				start = time.perf_counter()
+
+				try:
+						if not isinstance(request, dict):
+								raise ValueError("Request must be a JSON object")
+						command = request.get('command', 'run')
+						if command == 'run':
+								response['status'] = self.runJob(request.get('args'), request.get('cwd'))
+						elif command == 'ping':
+								pass
+						elif command == 'status':
+								response['working_dirs'] = [ { 'working_dir': x[0], 'reference': x[1], 'utr_fasta': x[2] } for x in self.configs.keys() ]
+								response['populations'] = sorted(set(x[0] for x in self.populations.keys()))
+								response['jobs'] = self.jobs
+								response['uptime_seconds'] = time.time() - self.startTime
+						elif command == 'reload':
+								self.configs.clear()
+								self.populations.clear()
+						elif command == 'shutdown':
+								self.running = False
+						else:
+								raise ValueError("Unknown command %s" % command)
+				except SystemExit as e: # e.g. invalid arguments, or a critical error within stigtools
+						response['status'] = e.code if isinstance(e.code, int) else 1
+						response['error'] = "Exited with status %s" % e.code
+				except Exception as e:
+						self.log.exception("Request failed")
+						response['status'] = 1
+						response['error'] = "%s: %s" % (type(e).__name__, e)
+
+				response['seconds'] = time.perf_counter() - start
+				return response
+
+
+		# runJob - Run stig, see cli.run()
+		#
+		# Arguments:
+		# argv - List of command line arguments
+		# cwd  - Optional.  Directory to run in
+		#
+		# Returns:
+		# Exit status
+		#
+		def runJob( self, argv, cwd=None ):
+				if not isinstance(argv, list) or not all(isinstance(x, str) for x in argv):
+						raise ValueError("Job arguments must be a list of strings")
+
+				self.jobs += 1
+				self.log.info("Job %d: %s", self.jobs, argv)
+				args = cli.getParser().parse_args(argv)
+
+				previousDir = os.getcwd()
+				if cwd is not None:
+						os.chdir(cwd)
+				try:
+						# Standard output may be our response stream, so anything written there (e.g. by --display-degradation) is sent to standard error
+						with contextlib.redirect_stdout(sys.stderr):
+								return cli.run(args, log=logging.getLogger('main'), configs=self.configs, populations=self.populations)
+				finally:
+						os.chdir(previousDir)
+
+
+		# serveStream - Handle JSON line requests from a file object until it is
+		#               closed or a shutdown request is received
+		#
+		# Arguments:
+		# infile  - File object requests are read from, e.g. sys.stdin
+		# outfile - File object responses are written to, e.g. sys.stdout
+		#
+		# Returns: nothing
+		#
+		def serveStream( self, infile, outfile ):
+				for line in infile:
+						if line.strip() == '':
+								continue
+						try:
+								request = json.loads(line)
+						except ValueError as e:
+								response = { 'status': 1, 'error': "Invalid JSON request: %s" % e }
+						else:
+								response = self.handle(request)
+						outfile.write(json.dumps(response) + "\n")
+						outfile.flush()
+						if not self.running:
+								break
+
+
+		# serveSocket - Handle JSON line requests from connections to a Unix
+		#               socket until a shutdown request is received.
+		#               Connections are handled one at a time
+		#
+		# Arguments:
+		# path - Filename of the socket, which is removed on shutdown
+		#
+		# Returns: nothing
+		#
+		def serveSocket( self, path ):
+				server = self
+
+				class requestHandler(socketserver.StreamRequestHandler):
+						def handle( self ):
+								server.serveStream((x.decode('utf-8') for x in self.rfile), self)
+
+						def write( self, data ):
+								self.wfile.write(data.encode('utf-8'))
+
+						def flush( self ):
+								self.wfile.flush()
+
+				if os.path.exists(path):
+						os.remove(path)
+				socketServer = socketserver.UnixStreamServer(path, requestHandler)
+				self.log.info("Listening on %s", path)
+				try:
+						while self.running:
+								socketServer.handle_request()
+				finally:
+						socketServer.server_close()
+						os.remove(path)
+
+
+# serve - Run a tcrServer with command line arguments (see 'stig serve --help')
+#
+# Arguments:
+# argv - Optional.  Command line arguments following 'serve'
+#
+# Returns:
+# Exit status
+#
+def serve(argv=None):
+		parser = argparse.ArgumentParser(prog = "stig serve",
+																		 description = "Run STIG jobs, keeping working directories and populations loaded between them",
+																		 epilog = "Please see manual or README for further details" )
+		parser.add_argument("--socket", metavar='PATH', type=str,
+												help='Accept requests on the Unix socket PATH.  Default is to read requests from standard input, and write responses to standard output')
+		parser.add_argument("--preload", metavar='WORKING_DIR', type=str, action='append', default=[],
+												help='Load WORKING_DIR on start up.  May be given more than once')
+		parser.add_argument("--reference-free", action = 'store_true',
+												help='Load the --preload directories without their reference chromosomes, see stig --reference-free')
+		parser.add_argument('--log-level', choices=['debug', 'info', 'warning', 'error', 'critical'], default='warning',
+												help='Logging level of the server.  Default is warning and above.  Jobs use their own --log-level')
+		args = parser.parse_args(argv)
+
+		log = cli.getLog()
+		serverLog = log.getChild('server')
+		serverLog.setLevel(getattr(logging, args.log_level.upper()))
+
+		server = tcrServer(log=serverLog)
+		for workingDir in args.preload:
+				server.preload(workingDir, reference = not args.reference_free)
+
+		if args.socket is not None:
+				server.serveSocket(args.socket)
+		else:
+				server.serveStream(sys.stdin, sys.stdout)
+		return 0
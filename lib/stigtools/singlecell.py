@@ -0,0 +1,176 @@
+import numpy
+
+from .sampling import subsamplePopulation
+
+# Single-cell reads
+#
+# Droplet single-cell V(D)J libraries (e.g. 10x Genomics 5' V(D)J) tag the
+# transcripts captured from each cell with the cell's barcode and a unique
+# molecular identifier (UMI) for each molecule, and read both chains of each
+# cell.  A tcrCells draws the cells of such a library from a repertoire, and
+# tcrRepertoire.simulateRead() given one (see stig --single-cell) reads from
+# the molecules of those cells, rather than choosing a cell for each read:
+#
+#   cells     - Cells are drawn without replacement from the population (see
+#               subsamplePopulation()) and shuffled, and each is given a random
+#               barcode of barcodeLength bases, distinct from those of the
+#               other cells
+#   molecules - Each chain of each cell has 1 + Poisson(umis - 1) molecules
+#               captured, so that both chains of every cell are read
+#   reads     - Each read is taken from a molecule drawn uniformly from the
+#               molecules of all cells, i.e. molecules are amplified evenly.
+#               The first read begins with the barcode of the cell and then
+#               the UMI of the molecule, as in read 1 of 10x data, followed by
+#               the read of the chain as usual
+#
+# The clone, barcode and molecule counts of the cells are held in numpy arrays
+# drawn all at once, so that a million cells take a few tens of MB, and the
+# UMI of each molecule is computed from its index (see getUMI()) rather than
+# stored.  The cells are written to BASENAME.cells.tsv (see write()), with the
+# tab-separated columns:
+#
+#   cell     Index of the cell, as in the FASTQ comment (cell=)
+#   barcode  Barcode of the cell (barcode=)
+#   clone    Index of the clone of the cell in the repertoire (clone=)
+#   umis_1   Number of molecules of the clone's first chain captured
+#   umis_2   Number of molecules of the clone's second chain captured
+#
+
+# Bases of each value of 4 bases packed 2 bits per base, in the order of
+# tcrRandom.nucleotides()
+quadruplets = [ a + b + c + d for a in 'CATG' for b in 'CATG' for c in 'CATG' for d in 'CATG' ]
+
+mask64 = 2**64 - 1
+
+
+
+# getBases - Return the bases of a value packed 2 bits per base
+#
+# Arguments:
+# value  - Integer value
+# length - Number of bases
+#
+# Returns:
+# String of length bases, the last from the lowest bits of value
+#
+def getBases(value, length):
+		groups = (length + 3) // 4
+		bases = ''.join([ quadruplets[(value >> (8 * i)) & 255] for i in range(groups - 1, -1, -1) ])
+		return bases[len(bases) - length:]
+
+
+
+class tcrCells:
+
+		columns = ('cell', 'barcode', 'clone', 'umis_1', 'umis_2')
+
+		# Arguments:
+		# repertoire    - tcrRepertoire, populated, to draw cells from
+		# cells         - Number of cells
+		# barcodeLength - Optional.  Number of bases of each cell barcode, no
+		#                 more than 31.  Default is 16
+		# umiLength     - Optional.  Number of bases of each UMI, no more than 31.
+		#                 Default is 10
+		# umis          - Optional.  Mean number of molecules captured of each
+		#                 chain of each cell, at least 1.  Default is 5
+		#
+		def __init__( self, repertoire, cells, barcodeLength=16, umiLength=10, umis=5 ):
+				if not 0 < barcodeLength < 32 or not 0 < umiLength < 32:
+						raise ValueError("Cell barcodes and UMIs must be between 1 and 31 bases long")
+				if cells < 1 or cells > 4**barcodeLength // 2:
+						raise ValueError("Cannot give %d cells distinct barcodes of %d bases" % (cells, barcodeLength))
+				if umis < 1:
+						raise ValueError("Cells must have a mean of at least one molecule of each chain")
+				generator = repertoire.config.random.generator
+				self.barcodeLength = barcodeLength
+				self.umiLength = umiLength
+				counts = subsamplePopulation(repertoire.population, cells, generator)
+				self.clones = generator.permutation(numpy.repeat(numpy.arange(len(counts), dtype=numpy.int64), counts))
+				self.barcodes = self.drawBarcodes(cells, generator)
+				self.molecules = 1 + generator.poisson(umis - 1, (cells, 2))
+				# Molecules of chain 1 of cell 0, chain 2 of cell 0, chain 1 of cell 1 and so on, see getMolecule()
+				self.cumulative = numpy.cumsum(self.molecules.ravel())
+				self.umiSeed = int(generator.integers(2**63))
+
+
+		# drawBarcodes - Draw distinct random barcodes
+		#
+		# Arguments:
+		# cells     - Number of barcodes
+		# generator - numpy Generator
+		#
+		# Returns:
+		# numpy array of barcodes, packed 2 bits per base, see getBases()
+		#
+		def drawBarcodes( self, cells, generator ):
+				barcodes = generator.integers(0, 4**self.barcodeLength, cells, dtype=numpy.int64)
+				while True:
+						# Barcodes drawn before (in order of the cells) are kept, and the rest drawn again
+						order = numpy.argsort(barcodes, kind='stable')
+						duplicates = numpy.zeros(cells, dtype=bool)
+						duplicates[order[1:]] = barcodes[order[1:]] == barcodes[order[:-1]]
+						if not numpy.any(duplicates):
+								return barcodes
+						barcodes[duplicates] = generator.integers(0, 4**self.barcodeLength, int(duplicates.sum()), dtype=numpy.int64)
+
+
+		def __len__( self ):
+				return len(self.clones)
+
+
+		# getBarcode - Return the barcode of a cell
+		#
+		def getBarcode( self, cell ):
+				return getBases(int(self.barcodes[cell]), self.barcodeLength)
+
+
+		# getUMI - Return the UMI of a molecule
+		#
+		# The index of the molecule is hashed (by SplitMix64's finalizer) with a
+		# seed drawn for the cells, so that the molecules of a cell have
+		# independent random UMIs, which (as in real data) may collide
+		#
+		# Arguments:
+		# molecule - Index of the molecule, see getMolecule()
+		#
+		def getUMI( self, molecule ):
+				value = (self.umiSeed + molecule * 0x9E3779B97F4A7C15) & mask64
+				value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & mask64
+				value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & mask64
+				return getBases(value ^ (value >> 31), self.umiLength)
+
+
+		# getMolecule - Choose a molecule to read from
+		#
+		# Arguments:
+		# value - Uniformly distributed float in [0, 1), e.g. from
+		#         tcrRandom.random()
+		#
+		# Returns:
+		# 5-tuple of the index of the cell, the index of its clone, the chain of
+		# the molecule (1 or 2), the cell's barcode and the molecule's UMI
+		#
+		def getMolecule( self, value ):
+				molecule = int(value * int(self.cumulative[-1]))
+				cell, chain = divmod(int(numpy.searchsorted(self.cumulative, molecule, side='right')), 2)
+				return (cell, int(self.clones[cell]), chain + 1, self.getBarcode(cell), self.getUMI(molecule))
+
+
+		# write - Write the cells as a tab-separated file, see above
+		#
+		# Arguments:
+		# filename  - Name of the file
+		# blockSize - Optional.  Number of cells formatted at once
+		#
+		# Returns: nothing
+		#
+		def write( self, filename, blockSize=65536 ):
+				with open(filename, 'w') as fp:
+						fp.write('\t'.join(self.columns) + "\n")
+						for first in range(0, len(self), blockSize):
+								last = min(len(self), first + blockSize)
+								clones = self.clones[first:last].tolist()
+								barcodes = self.barcodes[first:last].tolist()
+								molecules = self.molecules[first:last].tolist()
+								fp.write(''.join([ "%d\t%s\t%d\t%d\t%d\n" % (first + i, getBases(barcodes[i], self.barcodeLength), clones[i], molecules[i][0], molecules[i][1])
+																	 for i in range(0, last - first) ]))
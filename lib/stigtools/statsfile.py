@@ -0,0 +1,137 @@
+import gzip
+import numpy
+
+from .population import encodeStrings
+
+# Statistics files
+#
+# Each run that generates a repertoire writes the statistics of each clone
+# (its alleles, CDR3s and, optionally, sequences) to BASENAME.statistics.csv,
+# see tcrRepertoire.iterStatistics().  Rows are formatted and written in
+# batches as they are generated, so memory use does not grow with the size of
+# the repertoire.  Statistics can also be written gzip-compressed, or as
+# columns in a numpy .npz file:
+#
+#   csv     - BASENAME.statistics.csv
+#   csv.gz  - BASENAME.statistics.csv.gz, as csv
+#   npz     - BASENAME.statistics.npz.  CLONE and CELL_COUNT are int64
+#             arrays.  Alleles and CDR3s are byte string arrays, with an empty
+#             string for a chain with no valid CDR3.  Sequence columns are
+#             stored as for population files, as X_offset and X_sequence,
+#             where the sequence of clone i is
+#             X_sequence[X_offset[i]:X_offset[i + 1]]
+#
+# The columns of npz files are encoded in batches of rows, as the rows of csv
+# files are formatted, but (as numpy writes each column whole) the encoded
+# columns of the whole repertoire are held until they are written.  These
+# take around one byte per base of the sequence columns, so sequences=False
+# (see stig --statistics-no-sequences) keeps large repertoires small.
+#
+
+statisticsFormats = ('csv', 'csv.gz', 'npz')
+
+
+
+# getStatisticsFilename - Return the name of the statistics file of a run
+#
+# Arguments:
+# basename - Output basename, see stig --output
+# format   - One of statisticsFormats
+#
+# Returns:
+# String
+#
+def getStatisticsFilename(basename, format='csv'):
+		if format not in statisticsFormats:
+				raise ValueError("Statistics format must be one of %s" % ', '.join(statisticsFormats))
+		return "%s.statistics.%s" % (basename, format)
+
+
+
+# writeStatistics - Write the statistics of a repertoire to a file
+#
+# Arguments:
+# repertoire - tcrRepertoire object
+# filename   - Output file name
+# format     - Optional.  One of statisticsFormats.  Default is 'csv'
+# sequences  - Optional.  If False, the RNA and DNA columns are left out.
+#              Default is True
+# batchSize  - Optional.  Number of rows formatted and written at a time
+#
+# Returns: nothing
+#
+def writeStatistics(repertoire, filename, format='csv', sequences=True, batchSize=10000):
+		if format not in statisticsFormats:
+				raise ValueError("Statistics format must be one of %s" % ', '.join(statisticsFormats))
+		progress = repertoire.config.progress
+		progress.start('output:statistics', len(repertoire.repertoire), 'clones')
+		if format == 'npz':
+				numpy.savez_compressed(filename, **getStatisticsArrays(repertoire, sequences, batchSize, progress))
+		else:
+				opener = gzip.open if format == 'csv.gz' else open
+				with opener(filename, 'wt') as fp:
+						fp.write(repertoire.getStatisticsHeader(sequences) + "\n")
+						rows = []
+						for row in repertoire.iterStatistics(sequences):
+								rows.append(",".join(str(e) for e in row))
+								if len(rows) >= batchSize:
+										fp.write("\n".join(rows) + "\n")
+										progress.update(len(rows))
+										rows = []
+						if len(rows) > 0:
+								fp.write("\n".join(rows) + "\n")
+		progress.finish(len(repertoire.repertoire))
+
+
+
+# getStatisticsArrays - Return the statistics of a repertoire as columns
+#
+# Arguments:
+# repertoire - tcrRepertoire object
+# sequences  - If False, the RNA and DNA columns are left out
+# batchSize  - Optional.  Number of rows encoded at a time
+# progress   - Optional.  tcrProgress updated as each batch is encoded
+#
+# Returns:
+# Dict of column name -> numpy array, see the npz format above
+#
+def getStatisticsArrays(repertoire, sequences, batchSize=10000, progress=None):
+		columns = repertoire.getStatisticsColumns(sequences)
+		chunks = dict((x, []) for x in columns)
+		rows = []
+		for row in repertoire.iterStatistics(sequences):
+				rows.append(row)
+				if len(rows) >= batchSize:
+						addStatisticsChunks(repertoire, columns, rows, chunks)
+						if progress is not None:
+								progress.update(len(rows))
+						rows = []
+		addStatisticsChunks(repertoire, columns, rows, chunks)
+
+		arrays = {}
+		for name in columns:
+				if name in repertoire.sequenceColumns:
+						lengths = numpy.concatenate([ x[0] for x in chunks[name] ])
+						arrays[name + '_offset'] = numpy.concatenate(([ 0 ], numpy.cumsum(lengths))).astype(numpy.int64)
+						arrays[name + '_sequence'] = numpy.concatenate([ x[1] for x in chunks[name] ])
+				else:
+						arrays[name] = numpy.concatenate(chunks[name])
+				chunks[name] = None
+		return arrays
+
+
+
+# addStatisticsChunks - Encode a batch of rows of statistics, appending the
+#                       encoded values of each column to chunks, see
+#                       getStatisticsArrays()
+#
+def addStatisticsChunks(repertoire, columns, rows, chunks):
+		for i, name in enumerate(columns):
+				values = [ x[i] for x in rows ]
+				if name in ('CLONE', 'CELL_COUNT'):
+						chunks[name].append(numpy.array(values, dtype=numpy.int64))
+				elif name in repertoire.sequenceColumns:
+						offsets, sequence = encodeStrings(values)
+						chunks[name].append((numpy.diff(offsets), sequence))
+				else:
+						chunks[name].append(numpy.array([ b'' if x is None else x.encode('ascii') for x in values ], dtype='S'))
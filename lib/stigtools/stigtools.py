@@ -1,11 +1,19 @@
 import re
 import logging
-import random
 import math
 import numpy
 import time
 import os
 import yaml
+import hashlib
+import collections
+import json
+import mmap
+
+from .profiling import tcrProfile
+from .profiling import tcrProgress
+from .rng import tcrRandom
+from .summary import tcrSummary
 
 # TCR configuration class
 #
@@ -51,6 +59,25 @@ import yaml
 #     }, ...
 #   ]
 #
+# segmentRegions - Dict of (gene, region) -> the receptorSegment entry of that
+#   region of that gene, built by indexSegments() so that the L-PART,
+#   GENE-UNIT and exon records of a segment are found without scanning
+#   receptorSegment
+#
+# geneUnits - Dict of gene -> list of its L-V-, D- and J-GENE-UNIT entries
+#
+# exonSegments - Dict of gene -> list of its EX1, EX2... entries
+#
+# segmentCandidates - Dict of (receptor type, component name) -> list of
+#   indexes into receptorSegment of the V/D/J-REGION and EX1 entries of that
+#   type and component (e.g. ('B', 'V') -> those of the TRBV genes), from
+#   which chooseRandomSegment() chooses
+#
+
+
+# Translation tables for reverseComplement(), built once rather than per call
+complementTable = str.maketrans('CTUAG', 'GAATC')
+complementBytesTable = bytes.maketrans(b'CTUAG', b'GAATC')
 
 
 class tcrConfig:
@@ -60,9 +87,22 @@ class tcrConfig:
 				self.receptorSegment = []
 				self.geneName = []
 				self.chromosomeFile = []
+				self.chromosomeMaps = {}
 				self.setLog(log)
 				self.VDJprobability = []
 				self.junctionProbability = {}
+				self.sequenceCache = collections.OrderedDict()
+				self.sequenceCacheSize = 4096
+				self.alleleNames = {}
+				self.segmentRegions = {}
+				self.geneUnits = {}
+				self.exonSegments = {}
+				self.segmentCandidates = {}
+				self.utrPolicy = 'reference'
+				self.utrSequence = []
+				self.profile = tcrProfile()
+				self.progress = tcrProgress()
+				self.random = tcrRandom()
 				return
 
 
@@ -85,6 +125,12 @@ class tcrConfig:
 				else:
 						raise ValueError("Log object for tcrConfig must be a logging.Logger (or None)")
 
+				# Cache our logging levels, so that hot paths can skip their log calls
+				# (and the construction of their arguments) with a single test.  Call
+				# setLog() again if the level of our logger is changed
+				self.logDebug = self.log.isEnabledFor(logging.DEBUG)
+				self.logInfo = self.log.isEnabledFor(logging.INFO)
+
 
 				
 		# rmLog - Remove our logging object
@@ -96,6 +142,8 @@ class tcrConfig:
 		# 
 		def rmLog( self ):
 				self.log = None
+				self.logDebug = False
+				self.logInfo = False
 
 
 				
@@ -103,10 +151,15 @@ class tcrConfig:
 		#                 This function will scan the directory and ensure
 		#                 necessary files are present, raising ValueError if there
 		#                 are missing components
-		# Arguments: Directory name
+		# Arguments:
+		# dirname   - Directory name
+		# reference - Optional.  If False, the reference chromosomes are not
+		#             required or opened, and only RNA can be generated (see
+		#             setUTRPolicy() for the handling of UTR sequence).  Default
+		#             is True
 		# Returns: nothing
 		#
-		def setWorkingDir( self, dirname ):
+		def setWorkingDir( self, dirname, reference=True ):
 				self.log.info("setWorkingDir(%s) called", dirname)
 
 				#
@@ -122,9 +175,14 @@ class tcrConfig:
 				#
 				# With the component file read, identify our required chromosome references and initialize with self.setChromsomeFile()
 				#
-				chromosomeNumbers=set(map(lambda x: re.match(r'^\d+', x['chromosome']).group(0), self.receptorSegment)) # Extracts chromosome names from receptorSegment members and extracts leading numeric components
-				for x in chromosomeNumbers:
-						self.setChromosomeFile(x, '%s/chr%s.fa' % (dirname, x))
+				if reference is True:
+						chromosomeNumbers=set(map(lambda x: re.match(r'^\d+', x['chromosome']).group(0), self.receptorSegment)) # Extracts chromosome names from receptorSegment members and extracts leading numeric components
+						for x in chromosomeNumbers:
+								self.setChromosomeFile(x, '%s/chr%s.fa' % (dirname, x))
+				else:
+						self.log.info("Reference-free mode, chromosome references will not be used")
+						if self.utrPolicy == 'reference':
+								self.setUTRPolicy('clip')
 
 				#
 				# Read allele files from the working dir
@@ -229,10 +287,37 @@ class tcrConfig:
 				for i in self.receptorSegment:
 						geneName.append(i['gene'])
 				self.geneName = set(geneName)
+				self.indexSegments()
 
 				return
 
 
+		# indexSegments - Index our receptor segments by gene and region, see
+		#                 segmentRegions, geneUnits, exonSegments and
+		#                 segmentCandidates above.  The index holds the entries
+		#                 themselves, so alleles read into them later are found
+		#                 through it
+		#
+		# Arguments: none
+		# Returns: nothing
+		#
+		def indexSegments( self ):
+				self.segmentRegions = {}
+				self.geneUnits = {}
+				self.exonSegments = {}
+				self.segmentCandidates = dict(((x, y), []) for x in ('A', 'B', 'G', 'D') for y in ('V', 'D', 'J', 'C'))
+				for index, i in enumerate(self.receptorSegment):
+						self.segmentRegions[(i['gene'], i['region'])] = i
+						if re.match('^(L-V|D|J)-GENE-UNIT$', i['region']):
+								self.geneUnits.setdefault(i['gene'], []).append(i)
+						if re.match(r'^EX\d$', i['region']):
+								self.exonSegments.setdefault(i['gene'], []).append(i)
+						if re.match('^[VDJ]-REGION|EX1', i['region']):
+								for key in self.segmentCandidates:
+										if i['gene'].startswith('TR' + key[0] + key[1]):
+												self.segmentCandidates[key].append(index)
+
+
 		# readAlleles - Read allele info from fasta files with IMGT/GENE-DB compliant header lines
     #
     # See examples of these files at http://www.imgt.org/vquest/refseqh.html
@@ -363,11 +448,16 @@ class tcrConfig:
 		# strand - Strand to read from.  Can be one of: forward, reverse.  Default is forward.
 		
 		def readChromosome(self, chromosome, start, end, strand):
-				self.log.info("readChromosome(%s, %s, %s, %s) starting", chromosome, start, end, strand)
+				if self.logInfo:
+						self.log.info("readChromosome(%s, %s, %s, %s) starting", chromosome, start, end, strand)
 
 				if start <= 0 or end <= 0:
 						raise ValueError("Stard and end values must be non-zero integers")
 
+				if not self.hasReference():
+						self.log.critical('No chromosome references are loaded (reference-free mode), DNA sequences are not available')
+						raise ValueError("Reference chromosomes are required for DNA sequences, but none were loaded.  See setWorkingDir()")
+
 				chromosomeStruct = list(filter(lambda x: x['chromosome'] == chromosome, self.chromosomeFile))
 				
 				if( len(chromosomeStruct) == 0 ):
@@ -381,24 +471,205 @@ class tcrConfig:
 						self.log.critical("Duplicate entries for chromosome %s in chromosomeFile", chromosome)
 						exit(-10)
 						
-				with open(filename) as fp:
+				if self.logDebug:
 						self.log.debug("Bytes requested %d, seek %d, offset %d, reading +%d",
-													end-start + 1,
-													(end-start+int(math.floor(start/lineLength)) -1),
-													offset,
-													int(math.floor((end-start)/lineLength)))
-						
-						fp.seek(offset + start + int(math.floor(start/lineLength)) - 1)
-						data = fp.read(end - start + int(math.floor((end-start)/lineLength)) + 2)
-						data = data.replace("\n", '').upper()
-						data = data[:(end - start + 1)]
-						if strand == 'reverse':
-								data = self.reverseComplement(data)
-
+													 end-start + 1,
+													 (start - 1 + (start - 1) // lineLength),
+													 offset,
+													 (end - start) // lineLength)
+
+				# The reference is memory-mapped, and the sequence is handled as bytes until it is returned
+				reference = self.getChromosomeMap(filename)
+				position = offset + start - 1 + (start - 1) // lineLength
+				data = reference[position:position + end - start + (end - start) // lineLength + 2]
+				data = data.translate(None, b'\n').upper()[:(end - start + 1)]
+				if strand == 'reverse':
+						data = data.translate(complementBytesTable)[::-1]
+				data = data.decode('ascii')
+
+				self.profile.count('readChromosome.calls')
+				self.profile.count('readChromosome.bytes', end - start + 1)
 				#self.log.debug("Read: %s (%db)", data, len(data))
-				self.log.info("readChromosome() returning")
+				if self.logInfo:
+						self.log.info("readChromosome() returning")
 				return data
 
+
+		# getChromosomeMap - Return a chromosome reference file, memory-mapped
+		#                    read-only.  Files are mapped on first use, and
+		#                    shared by processes forked afterwards
+		#
+		# Arguments:
+		# filename - Reference filename, see setChromosomeFile()
+		#
+		# Returns:
+		# mmap.mmap object
+		#
+		def getChromosomeMap(self, filename):
+				reference = self.chromosomeMaps.get(filename)
+				if reference is None:
+						with open(filename, 'rb') as fp:
+								reference = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+						self.chromosomeMaps[filename] = reference
+				return reference
+
+
+		# hasReference - Determine whether chromosome references are available
+		#
+		# Arguments: none
+		# Returns: True if at least one chromosome reference was registered with
+		#          setChromosomeFile(), False otherwise (i.e. reference-free mode)
+		#
+		def hasReference( self ):
+				return len(self.chromosomeFile) > 0
+
+
+		# setUTRPolicy - Set how sequence beyond the 5' and 3' ends of a chain
+		#                (i.e. the UTRs) is obtained when reads overhang them
+		#
+		# Arguments:
+		# policy   - One of:
+		#            'reference' - Read UTR sequence from the chromosome references
+		#            'fasta'     - Read UTR sequence from a FASTA file of reference
+		#                          windows, see writeUTRFasta()
+		#            'clip'      - Reads do not extend beyond the ends of a chain
+		# filename - Filename of the UTR FASTA.  Required for the 'fasta' policy
+		#
+		# Returns: nothing
+		#
+		def setUTRPolicy( self, policy, filename=None ):
+				self.log.info("setUTRPolicy(%s, %s) called", policy, filename)
+				if policy not in ('reference', 'fasta', 'clip'):
+						raise ValueError("UTR policy must be one of 'reference', 'fasta' or 'clip'", policy)
+				if policy == 'reference' and not self.hasReference():
+						raise ValueError("The 'reference' UTR policy requires chromosome references, see setWorkingDir()")
+
+				if policy == 'fasta':
+						if filename is None:
+								raise ValueError("The 'fasta' UTR policy requires a UTR FASTA filename")
+						self.readUTRFasta(filename)
+				self.utrPolicy = policy
+
+
+		# readUTRFasta - Read UTR sequence windows written by writeUTRFasta()
+		#
+		# Arguments:
+		# filename - FASTA file, with one record per window and headers of the
+		#            form '>chrN:START-END' (NCBI coordinates, forward strand)
+		#
+		# Returns: nothing
+		#
+		def readUTRFasta( self, filename ):
+				if not os.path.isfile(filename):
+						raise ValueError("Could not locate UTR FASTA file", filename)
+
+				self.utrSequence = []
+				with open(filename) as fp:
+						for line in fp:
+								line = line.strip()
+								if len(line) == 0:
+										continue
+								if line.startswith('>'):
+										matches = re.match(r'^>chr(\d+):(\d+)-(\d+)', line)
+										if matches is None:
+												raise ValueError("In UTR FASTA file, header is not of the form '>chrN:START-END'", filename, line)
+										self.utrSequence.append({ 'chromosome': int(matches.group(1)),
+																							'start_position': int(matches.group(2)),
+																							'end_position': int(matches.group(3)),
+																							'sequence': [] })
+								elif len(self.utrSequence) > 0:
+										self.utrSequence[-1]['sequence'].append(line.upper())
+								else:
+										raise ValueError("In UTR FASTA file, sequence found before the first header", filename)
+
+				for window in self.utrSequence:
+						window['sequence'] = ''.join(window['sequence'])
+						if len(window['sequence']) != window['end_position'] - window['start_position'] + 1:
+								raise ValueError("In UTR FASTA file, sequence length does not match its coordinates", filename,
+																 window['chromosome'], window['start_position'], window['end_position'])
+				self.log.debug("Read %d UTR windows from %s", len(self.utrSequence), filename)
+
+
+		# readUTR - Request UTR data according to the UTR policy, see
+		#           setUTRPolicy().  Arguments are as for readChromosome()
+		#
+		# Returns:
+		# String with the requested sequence
+		#
+		def readUTR( self, chromosome, start, end, strand ):
+				if self.utrPolicy == 'reference':
+						return self.readChromosome(chromosome, start, end, strand)
+				elif self.utrPolicy == 'fasta':
+						for window in self.utrSequence:
+								if( window['chromosome'] == chromosome and
+										window['start_position'] <= start and end <= window['end_position'] ):
+										data = window['sequence'][start - window['start_position']:end - window['start_position'] + 1]
+										if strand == 'reverse':
+												data = self.reverseComplement(data)
+										return data
+						self.log.critical("UTR sequence chr%s:%d-%d is not in the UTR FASTA file", chromosome, start, end)
+						raise ValueError("UTR sequence not found in UTR FASTA file, try writing it with a longer UTR length", chromosome, start, end)
+				else:
+						raise ValueError("UTR sequence is not available with the '%s' UTR policy" % self.utrPolicy)
+
+
+		# writeUTRFasta - Write the reference sequence flanking each possible chain
+		#                 to a FASTA file, which can be used in place of the
+		#                 chromosome references for RNA with the 'fasta' UTR policy
+		#
+		# Arguments:
+		# filename - Output filename
+		# length   - Optional.  Number of bases of UTR sequence to write at each
+		#            end of a chain, this limits how far reads may extend beyond
+		#            a chain.  Default is 1000
+		#
+		# Returns: nothing
+		#
+		def writeUTRFasta( self, filename, length=1000 ):
+				self.log.info("writeUTRFasta(%s, %d) called", filename, length)
+				if not self.hasReference():
+						raise ValueError("Writing a UTR FASTA requires chromosome references, see setWorkingDir()")
+
+				# Collect the windows read by tcrRepertoire.simulateRead() at the 5' and 3' ends of chains, see getChainCoordinates()
+				windows = {}
+				cGenes = {}
+				for segment in self.receptorSegment:
+						chromosome = re.match(r'^\d+', segment['chromosome'])
+						if chromosome is None:
+								continue
+						chromosome = int(chromosome.group(0))
+						if segment['region'] == 'L-V-GENE-UNIT':
+								startPosition = segment['start_position'] if segment['strand'] == 'forward' else segment['end_position']
+								windows.setdefault(chromosome, []).append([startPosition - length + 1, startPosition])
+						elif re.match(r'^EX\d$', segment['region']):
+								cGenes.setdefault((chromosome, segment['gene']), []).append(segment)
+
+				for (chromosome, gene), exons in cGenes.items():
+						cLength = max(x['end_position'] for x in exons) - min(x['start_position'] for x in exons) + 1
+						ex1 = [ x for x in exons if x['region'] == 'EX1' ]
+						if len(ex1) != 1:
+								continue
+						# The 3' end depends on the strand of the V segment, so include both
+						for endPosition in (ex1[0]['start_position'] + cLength, ex1[0]['end_position'] - cLength):
+								windows.setdefault(chromosome, []).append([endPosition, endPosition + length - 1])
+
+				with open(filename, 'w') as fp:
+						for chromosome in sorted(windows.keys()):
+								merged = []
+								for window in sorted(windows[chromosome]):
+										window[0] = max(window[0], 1)
+										if len(merged) > 0 and window[0] <= merged[-1][1] + 1:
+												merged[-1][1] = max(merged[-1][1], window[1])
+										else:
+												merged.append(window)
+								for start, end in merged:
+										data = self.readChromosome(chromosome, start, end, 'forward')
+										end = start + len(data) - 1 # Windows may be truncated at the end of the chromosome
+										fp.write(">chr%d:%d-%d\n" % (chromosome, start, end))
+										for i in range(0, len(data), 60):
+												fp.write(data[i:i+60] + "\n")
+				self.log.info("writeUTRFasta() returning")
+
 		# reverseComplement - Return the reverse complement of a nucleotide string
     # 
     # Arguments:
@@ -406,11 +677,12 @@ class tcrConfig:
     # 
     # Returns:
     # A string with complementary DNA nucleotides (CTUAG -> GAATC), reversed from the input value
+    # (bytes if the value is bytes or bytearray)
     # 
 		def reverseComplement(self, value):
-				value = value.translate(str.maketrans('CTUAG', 'GAATC'))
-				value = value[::-1]
-				return value
+				if isinstance(value, str):
+						return value.translate(complementTable)[::-1]
+				return bytes(value).translate(complementBytesTable)[::-1]
 		
 		
 		# chooseRandomSegment - Pick an (appropriately) random V, D, J or C segment for a provided receptor type
@@ -424,8 +696,9 @@ class tcrConfig:
 		# A 2-tuple with an index and allele name to the requested component type
 		#
 		def chooseRandomSegment(self, receptorType, componentName, V=None, D=None, J=None):
-				self.log.debug("chooseRandomSegment() starting")
-				self.log.debug("Arguments: %s, %s, %s, %s, %s", receptorType, componentName, V, D, J)
+				if self.logDebug:
+						self.log.debug("chooseRandomSegment() starting")
+						self.log.debug("Arguments: %s, %s, %s, %s, %s", receptorType, componentName, V, D, J)
 
 				if( receptorType not in ('A', 'B', 'G', 'D') ):
 						raise ValueError("Receptor type must be either A, B, G, or D (alpha, beta, gamma or delta, respectively)")
@@ -449,47 +722,51 @@ class tcrConfig:
 
 				# Generate a list of all valid segments (n.b. we pick CDR3 components here (eg V/D/J-REGION), not gene units (eg L-V-GENE-UNIT))
 				segmentChoices = []
-				for i in range(0, len(self.receptorSegment)):
-						if( re.match('^TR'+receptorType+componentName, self.receptorSegment[i]['gene'] ) and
-								re.match('^[VDJ]-REGION|EX1', self.receptorSegment[i]['region']) ):
+				for i in self.segmentCandidates[(receptorType, componentName)]:
 
-								if componentName == 'V':
+						if componentName == 'V':
+								if self.logDebug:
 										self.log.debug("Valid segment choice %s (%d)", self.receptorSegment[i]['gene'], i)
-										segmentChoices.append(i)
-										
-								if( componentName == 'J' and
-										self.receptorSegment[i]['chromosome'] == self.receptorSegment[Vindex]['chromosome'] ):
-										if D is not None:
-												if( (self.receptorSegment[i]['start_position'] < self.receptorSegment[Dindex]['start_position'] and
-														 self.receptorSegment[i]['strand'] == 'forward' ) or
-														( self.receptorSegment[i]['start_position'] > self.receptorSegment[Dindex]['start_position'] and
-														 self.receptorSegment[i]['strand'] == 'reverse' ) ):
+								segmentChoices.append(i)
+								
+						if( componentName == 'J' and
+								self.receptorSegment[i]['chromosome'] == self.receptorSegment[Vindex]['chromosome'] ):
+								if D is not None:
+										if( (self.receptorSegment[i]['start_position'] < self.receptorSegment[Dindex]['start_position'] and
+												 self.receptorSegment[i]['strand'] == 'forward' ) or
+												( self.receptorSegment[i]['start_position'] > self.receptorSegment[Dindex]['start_position'] and
+												 self.receptorSegment[i]['strand'] == 'reverse' ) ):
+												if self.logDebug:
 														self.log.debug("This is not a valid choice: %s (%d)", self.receptorSegment[i]['gene'], i)
-														continue
+												continue
+								if self.logDebug:
 										self.log.debug("Valid segment choice %s (%d)", self.receptorSegment[i]['gene'], i)
-										segmentChoices.append(i)
+								segmentChoices.append(i)
 
-								if( componentName == 'D' ):
+						if( componentName == 'D' ):
+								if self.logDebug:
 										self.log.debug("Valid segment choice %s (%d)", self.receptorSegment[i]['gene'], i)
-										segmentChoices.append(i)
-
-								if( componentName == 'C' and
-										self.receptorSegment[i]['chromosome'] == self.receptorSegment[Vindex]['chromosome'] and
-										( (self.receptorSegment[i]['start_position'] > self.receptorSegment[Jindex]['start_position'] and
-											 self.receptorSegment[i]['strand'] == 'forward' ) or
-											(self.receptorSegment[i]['start_position'] < self.receptorSegment[Jindex]['start_position'] and
-											 self.receptorSegment[i]['strand'] == 'reverse' ) ) ):
+								segmentChoices.append(i)
+
+						if( componentName == 'C' and
+								self.receptorSegment[i]['chromosome'] == self.receptorSegment[Vindex]['chromosome'] and
+								( (self.receptorSegment[i]['start_position'] > self.receptorSegment[Jindex]['start_position'] and
+									 self.receptorSegment[i]['strand'] == 'forward' ) or
+									(self.receptorSegment[i]['start_position'] < self.receptorSegment[Jindex]['start_position'] and
+									 self.receptorSegment[i]['strand'] == 'reverse' ) ) ):
+								if self.logDebug:
 										self.log.debug("Valid segment choice %s (%d)", self.receptorSegment[i]['gene'], i)
-										if len(segmentChoices) > 0:
-												a = self.receptorSegment[i]
-												b = self.receptorSegment[segmentChoices[0]]
-												if( ( a['strand'] == 'forward' and a['start_position'] < b['start_position']) or
-														( a['strand'] == 'reverse' and a['start_position'] > b['start_position']) ):
-														segmentChoices = [ i ]
+								if len(segmentChoices) > 0:
+										a = self.receptorSegment[i]
+										b = self.receptorSegment[segmentChoices[0]]
+										if( ( a['strand'] == 'forward' and a['start_position'] < b['start_position']) or
+												( a['strand'] == 'reverse' and a['start_position'] > b['start_position']) ):
+												segmentChoices = [ i ]
+										if self.logDebug:
 												self.log.debug("C segment choices are now: %s", segmentChoices)
-										else:
-												segmentChoices.append(i)
-												
+								else:
+										segmentChoices.append(i)
+										
 				# Throw an error here if there are no possible join candidates.
 				# This should never happen if our input probabilities are correctly given
 				if len(segmentChoices) == 0:
@@ -553,20 +830,23 @@ class tcrConfig:
 						
 				
 				# Randomly choose a segment
-				rand = random.random()
-				self.log.debug("Roll: %0.3f", rand)
+				rand = self.random.random()
+				if self.logDebug:
+						self.log.debug("Roll: %0.3f", rand)
 
 				cumulativeProbability = 0
 				for i in segmentProbabilities:
 						segmentIndex, probability = i
 						cumulativeProbability += probability
-						self.log.debug("Examining %s, cumulative: %0.3f", i, cumulativeProbability)
+						if self.logDebug:
+								self.log.debug("Examining %s, cumulative: %0.3f", i, cumulativeProbability)
 						if rand < cumulativeProbability:
 								alleles = list(self.receptorSegment[segmentIndex]['allele'].keys())
-								self.log.debug("Allele choices: %s", ', '.join(alleles))
-								random.shuffle(alleles)
-								allele = alleles[0]
-								self.log.info("Choosing %d(%s) allele %s", segmentIndex, self.receptorSegment[segmentIndex]['gene'], allele)
+								if self.logDebug:
+										self.log.debug("Allele choices: %s", ', '.join(alleles))
+								allele = self.random.choice(alleles)
+								if self.logInfo:
+										self.log.info("Choosing %d(%s) allele %s", segmentIndex, self.receptorSegment[segmentIndex]['gene'], allele)
 								return (segmentIndex, allele)
 
 				# We should always return before here
@@ -585,131 +865,258 @@ class tcrConfig:
 		# 2. None: if this VDJ recombination failed (i.e. early stop codon or invalid CDR3 AA sequence)
 		
 		def recombinate( self, V, D, J, C):
-				self.log.info("Recombinate() called...")
-				self.log.debug("Arguments: %s", (V, D, J, C))
-
-				DNA = None
-				RNA = None
-
-				vIndex, vAllele = V
-				jIndex, jAllele = J
-				cIndex, cAllele = C
+				chain = self.recombinateChain(V, D, J, C)
+				if chain is None:
+						return None
+				return [ self.getChainSequence(chain, 'dna'), self.getChainSequence(chain, 'rna') ]
 
-				# Determine our chromosome number from the J segment index
-				chromosome = None
-				chromosome = re.findall('^\d+', self.receptorSegment[jIndex]['chromosome'])
-				if chromosome is None or not isinstance(chromosome, list) or (isinstance(chromosome, list) and len(chromosome) > 1):
-						self.log.critical("Receptor segment %s chromosome (value: %s) is invalid", self.receptorSegment[jIndex]['gene'], self.receptorSegment[jIndex]['chromosome'])
-						exit(-10)
-				else:
-						chromosome = int(chromosome[0])
 
-				# V segment calculations
+		# recombinateChain - Perform the recombination of V, D, J and C segments
+		#                    (see recombinate()), returning a compact record of
+		#                    the recombined chain rather than its sequences
+		#
+		# Arguments:
+		# V, D, J, C - 2-tuples of an index into self.receptorSegment and an
+		#              allele name.  D is None for alpha and gamma chains
+		#
+		# Returns:
+		# A tcrChain object, or None if this VDJ recombination failed (i.e. early
+		# stop codon or invalid CDR3 AA sequence)
+		#
+		def recombinateChain( self, V, D, J, C):
+				if self.logInfo:
+						self.log.info("recombinateChain() called...")
+				if self.logDebug:
+						self.log.debug("Arguments: %s", (V, D, J, C))
+				receptorType = self.receptorSegment[V[0]]['receptor_type']
+				self.profile.count('recombinate.attempts.%s' % receptorType)
+
+				# Roll our chewback and nucleotide addition values
 				vChewback = self.roll(self.junctionProbability['Vchewback'])
-				self.log.debug("Calculating V segment (chewback == %d)...", vChewback)
-				vSegmentDNA, vSegmentRNA = self.getSegmentSequences(V)
-				if vChewback > 0:
-						vSegmentDNA = vSegmentDNA[:-vChewback]
-						vSegmentRNA = vSegmentRNA[:-vChewback]
-
-				# D xor VJ segment calculations
+				lAllele = self.chooseLPartAllele(V)
+				d5Chewback = 0
+				d3Chewback = 0
 				if D is not None:
 						d5Chewback = self.roll(self.junctionProbability['D5chewback'])
 						d3Chewback = self.roll(self.junctionProbability['D3chewback'])
-						self.log.debug("Calculating D segment (5' chewback == %d, 3' chewback == %d)...", d5Chewback, d3Chewback)
-						dSegmentDNA, dSegmentRNA = self.getSegmentSequences(D)
-						vdAdditions = self.getRandomNucleotides(self.roll(self.junctionProbability['VDaddition']))
-						djAdditions = self.getRandomNucleotides(self.roll(self.junctionProbability['DJaddition']))
-						if d3Chewback > 0:
-								dSegmentDNA = dSegmentDNA[d3Chewback:]
-								dSegmentRNA = dSegmentRNA[d3Chewback:]
-						if d5Chewback > 0:
-								dSegmentDNA = dSegmentDNA[:-d5Chewback]
-								dSegmentRNA = dSegmentRNA[:-d5Chewback]
-						dSegmentDNA = vdAdditions + dSegmentDNA + djAdditions
-						dSegmentRNA = vdAdditions + dSegmentRNA + djAdditions
+						n1Insert = self.getRandomNucleotides(self.roll(self.junctionProbability['VDaddition']))
+						n2Insert = self.getRandomNucleotides(self.roll(self.junctionProbability['DJaddition']))
 				else:
-						self.log.debug("Calculating VJ segment insertions...");
-						dSegmentDNA = self.getRandomNucleotides(self.roll(self.junctionProbability['VJaddition']))
-						dSegmentRNA = dSegmentDNA
-
-				# J segment calculations
+						n1Insert = self.getRandomNucleotides(self.roll(self.junctionProbability['VJaddition']))
+						n2Insert = ''
 				jChewback = self.roll(self.junctionProbability['Jchewback'])
-				self.log.debug("Calculating J segment (chewback == %d)...", jChewback)
-				jSegmentDNA, jSegmentRNA = self.getSegmentSequences(J)
-				if jChewback > 0:
-						jSegmentDNA = jSegmentDNA[jChewback:]
-						jSegmentRNA = jSegmentRNA[jChewback:]
-
-				self.log.debug("Calculating C segment...")
-				cSegmentDNA, cSegmentRNA = self.getSegmentSequences(C)
-				
-				self.log.debug("Calculating JC segment DNA...")
-				jcSegmentDNA = None
-				if self.receptorSegment[jIndex]['strand'] == 'forward':
-						jcSegmentDNA = self.readChromosome(chromosome, self.receptorSegment[jIndex]['end_position'] + 1, self.receptorSegment[cIndex]['start_position'] - 1, self.receptorSegment[cIndex]['strand'])
-				else:
-						jcSegmentDNA = self.readChromosome(chromosome, self.receptorSegment[cIndex]['end_position'] + 1, self.receptorSegment[jIndex]['start_position'] - 1, self.receptorSegment[cIndex]['strand'])
+				if self.logDebug:
+						self.log.debug("Chewback V: %d, D 5': %d, D 3': %d, J: %d.  Additions %s, %s", vChewback, d5Chewback, d3Chewback, jChewback, n1Insert, n2Insert)
+
+				chain = tcrChain(receptorType, V, D, J, C, lAllele,
+												 vChewback, d5Chewback, d3Chewback, jChewback, n1Insert, n2Insert)
 
-				# Assemble DNA/RNA sequences and validate it for early stops and functional CDR amino acid sequence
-				dnaSequence = vSegmentDNA + dSegmentDNA + jSegmentDNA + jcSegmentDNA + cSegmentDNA
-				rnaSequence = vSegmentRNA + dSegmentRNA + jSegmentRNA + cSegmentRNA
+				# Assemble the RNA sequence and validate it for early stops and functional CDR amino acid sequence
+				rnaParts = self.getChainParts(chain, 'rna')
+				rnaSequence = ''.join(x[1] for x in rnaParts)
 
-				self.log.debug("Validating RNA: %s", rnaSequence)
+				if self.logDebug:
+						self.log.debug("Validating RNA: %s", rnaSequence)
 
 				# Ensure string is in-frame first...
 				matches = re.match('^ATG((?:[CTAG]{3})+)$', rnaSequence)
 				if matches is None:
-						self.log.info("Invalid CDR3: Frame shifted (%d)", len(rnaSequence)%3)
+						if self.logInfo:
+								self.log.info("Invalid CDR3: Frame shifted (%d)", len(rnaSequence)%3)
+						self.profile.count('recombinate.rejected.frame')
 						return None
-				
+
 				# Check for early stop codons
 				matches = re.match('^((?:[CTAG]{3})*)(TAA|TAG|TGA)((?:[CTAG]{3})+)$', rnaSequence)
 				if matches is not None:
-						self.log.info("Invalid CDR3: Stop codon found in sequence...")
-						self.log.debug("%s", '.'.join(matches.groups()))
-						self.log.debug("%s", '_'.join([vSegmentRNA, dSegmentRNA, jSegmentRNA, cSegmentRNA]))
+						if self.logInfo:
+								self.log.info("Invalid CDR3: Stop codon found in sequence...")
+						if self.logDebug:
+								self.log.debug("%s", '.'.join(matches.groups()))
+								self.log.debug("%s", '_'.join(x[1] for x in rnaParts))
+						self.profile.count('recombinate.rejected.stop')
 						return None
 
-				# Continue only if our CDR3 sequence is valid
-				if not self.validateCDR3Sequence(rnaSequence):
-						self.log.info("Invalid CDR3: Amino acid sequence incorrect")
+				# Continue only if our CDR3 sequence is valid, keeping it with the chain
+				chain.cdr3 = self.getCDR3Sequence(rnaSequence)
+				if chain.cdr3 is None:
+						if self.logInfo:
+								self.log.info("Invalid CDR3: Amino acid sequence incorrect")
+						self.profile.count('recombinate.rejected.cdr3')
 						return None
-										
-				# Calculate the location of our DNA/RNA 5' and 3' UTR areas
-		    # We need to locate the corresponding L-V-GENE-UNIT to locate our start codon
-				dnaStartPosition = None
-				dnaEndPosition = None
-				geneUnits = list(filter(lambda x:x['gene'] == self.receptorSegment[vIndex]['gene'] and
-																	 re.match('^L-V-GENE-UNIT$', x['region']), self.receptorSegment))
-				if len(geneUnits) == 0:
-						self.log.critical("No corresponding GENE-UNIT found for gene %s", self.receptorSegment[segmentIndex]['gene'])
-						exit(-10)
-				elif len(geneUnits) > 1:
-						self.log.critical("Too many GENE-UNITs found for gene %s", self.receptorSegment[segmentIndex]['gene'])
+
+				# Keep the RNA we have already assembled for the first request of it
+				chromosome, startPosition, startStrand, endPosition, endStrand = self.getChainCoordinates(chain)
+				self.cacheChainSequence(chain, 'rna', (chromosome, startPosition, startStrand, rnaSequence, endPosition, endStrand))
+
+				self.profile.count('recombinate.accepted.%s' % receptorType)
+				if self.logInfo:
+						self.log.info("recombinateChain() returning...")
+				return chain
+
+
+
+		# getChainParts - Return the component sequences of a recombined chain
+		#
+		# Arguments:
+		# chain - tcrChain object
+		# space - String.  One of 'dna' or 'rna'
+		#
+		# Returns:
+		# Array of 2-tuples (region, sequence), 5' to 3', where region is one of
+		# 'V' (including the leader and, in DNA, the V intron), 'N1', 'D', 'N2', 'J',
+		# 'JC' (the J-C intervening DNA, only present in DNA) or 'C'.  The
+		# concatenated sequences give the DNA or RNA sequence of the chain.
+		#
+		def getChainParts( self, chain, space ):
+				if space not in ('dna', 'rna'):
+						raise ValueError("Space must be one of 'dna' or 'rna'")
+				spaceIndex = 0 if space == 'dna' else 1
+
+				vSegment = self.getSegmentSequences(chain.V, lAllele=chain.lAllele, space=space)[spaceIndex]
+				if chain.vChewback > 0:
+						vSegment = vSegment[:-chain.vChewback]
+				parts = [ ('V', vSegment) ]
+
+				if chain.D is not None:
+						dSegment = self.getSegmentSequences(chain.D, space=space)[spaceIndex]
+						if chain.d3Chewback > 0:
+								dSegment = dSegment[chain.d3Chewback:]
+						if chain.d5Chewback > 0:
+								dSegment = dSegment[:-chain.d5Chewback]
+						parts.extend([ ('N1', chain.n1Insert), ('D', dSegment), ('N2', chain.n2Insert) ])
+				else:
+						parts.append(('N1', chain.n1Insert))
+
+				jSegment = self.getSegmentSequences(chain.J, space=space)[spaceIndex]
+				if chain.jChewback > 0:
+						jSegment = jSegment[chain.jChewback:]
+				parts.append(('J', jSegment))
+
+				if space == 'dna':
+						jIndex = chain.J[0]
+						cIndex = chain.C[0]
+						chromosome = self.getChromosomeNumber(jIndex)
+						if self.receptorSegment[jIndex]['strand'] == 'forward':
+								jcSegment = self.readChromosome(chromosome, self.receptorSegment[jIndex]['end_position'] + 1, self.receptorSegment[cIndex]['start_position'] - 1, self.receptorSegment[cIndex]['strand'])
+						else:
+								jcSegment = self.readChromosome(chromosome, self.receptorSegment[cIndex]['end_position'] + 1, self.receptorSegment[jIndex]['start_position'] - 1, self.receptorSegment[cIndex]['strand'])
+						parts.append(('JC', jcSegment))
+
+				parts.append(('C', self.getSegmentSequences(chain.C, space=space)[spaceIndex]))
+				return parts
+
+
+
+		# getChainCoordinates - Calculate the location of a chain's 5' and 3' UTR
+		#                       areas in the reference
+		#
+		# Arguments:
+		# chain - tcrChain object
+		#
+		# Returns:
+		# 5-tuple of ( chromosome, 5' end coordinates (NCBI), 5' strand (forward/reverse),
+		#              3' start coordinates (NCBI), 3' strand (forward/reverse) )
+		# These are shared by the DNA and RNA of the chain.
+		#
+		def getChainCoordinates( self, chain ):
+				vIndex = chain.V[0]
+				cIndex = chain.C[0]
+				chromosome = self.getChromosomeNumber(chain.J[0])
+
+				# We need to locate the corresponding L-V-GENE-UNIT to locate our start codon
+				geneUnit = self.segmentRegions.get((self.receptorSegment[vIndex]['gene'], 'L-V-GENE-UNIT'))
+				if geneUnit is None:
+						self.log.critical("No corresponding GENE-UNIT found for gene %s", self.receptorSegment[vIndex]['gene'])
 						exit(-10)
 
-				geneUnit = geneUnits[0]
-				geneCoordinates = (geneUnit['start_position'], geneUnit['end_position'], geneUnit['strand'])
+				# The 3' UTR follows the span of the C-region exons
+				exons = self.exonSegments[self.receptorSegment[cIndex]['gene']]
+				cLength = max(x['end_position'] for x in exons) - min(x['start_position'] for x in exons) + 1
+
 				if self.receptorSegment[vIndex]['strand'] == 'forward':
-						dnaStartPosition = geneUnit['start_position']
-						rnaStartPosition = dnaStartPosition
-						dnaEndPosition = self.receptorSegment[cIndex]['start_position'] + len(cSegmentDNA)
-						rnaEndPosition = dnaEndPosition
+						startPosition = geneUnit['start_position']
+						endPosition = self.receptorSegment[cIndex]['start_position'] + cLength
 				else:
-						dnaStartPosition = geneUnit['end_position']
-						rnaStartPosition = dnaStartPosition
-						dnaEndPosition = self.receptorSegment[cIndex]['end_position'] - len(cSegmentDNA)
-						rnaEndPosition = dnaEndPosition
-						
-				startStrand = self.receptorSegment[vIndex]['strand']
-				endStrand = self.receptorSegment[cIndex]['strand']
-				
-				DNA = (chromosome, dnaStartPosition, startStrand, dnaSequence, dnaEndPosition, endStrand)
-				RNA = (chromosome, rnaStartPosition, startStrand, rnaSequence, rnaEndPosition, endStrand)
-				self.log.debug("recombinate() returning DNA: %s \nRNA %s", DNA, RNA)
-				self.log.info("recombinate() returning...")
-				return [ DNA, RNA ]
+						startPosition = geneUnit['end_position']
+						endPosition = self.receptorSegment[cIndex]['end_position'] - cLength
+
+				return (chromosome, startPosition, self.receptorSegment[vIndex]['strand'], endPosition, self.receptorSegment[cIndex]['strand'])
+
+
+
+		# getChainSequence - Return the DNA or RNA of a recombined chain
+		#
+		# Sequences are assembled from the receptor segments on request.  The most
+		# recently requested sequences are kept in a cache of up to
+		# self.sequenceCacheSize entries, see setSequenceCacheSize()
+		#
+		# Arguments:
+		# chain - tcrChain object
+		# space - String.  One of 'dna' or 'rna'
+		#
+		# Returns:
+		# 6-tuple defining the sequence:
+		# ( chromosome, 5' end coordinates (NCBI), 5' strand (forward/reverse), DNA/RNA sequence, 3' start coordinates (NCBI), 3' strand (forward/reverse) )
+		#
+		def getChainSequence( self, chain, space ):
+				key = (chain, space)
+				sequence = self.sequenceCache.get(key, None)
+				if sequence is not None:
+						self.sequenceCache.move_to_end(key)
+						return sequence
+
+				chromosome, startPosition, startStrand, endPosition, endStrand = self.getChainCoordinates(chain)
+				sequence = (chromosome, startPosition, startStrand, ''.join(x[1] for x in self.getChainParts(chain, space)), endPosition, endStrand)
+				self.cacheChainSequence(chain, space, sequence)
+				return sequence
+
+
+		# cacheChainSequence - Add a sequence to our cache of chain sequences
+		#
+		# Arguments:
+		# chain    - tcrChain object
+		# space    - String.  One of 'dna' or 'rna'
+		# sequence - 6-tuple, as returned by getChainSequence()
+		#
+		# Returns: nothing
+		#
+		def cacheChainSequence( self, chain, space, sequence ):
+				if self.sequenceCacheSize <= 0:
+						return
+				self.sequenceCache[(chain, space)] = sequence
+				while len(self.sequenceCache) > self.sequenceCacheSize:
+						self.sequenceCache.popitem(last=False)
+
+
+		# setSequenceCacheSize - Set the number of chain sequences kept by
+		#                        getChainSequence()
+		#
+		# Arguments:
+		# size - Integer.  Zero disables the cache
+		#
+		# Returns: nothing
+		#
+		def setSequenceCacheSize( self, size ):
+				self.sequenceCacheSize = size
+				while len(self.sequenceCache) > max(size, 0):
+						self.sequenceCache.popitem(last=False)
+
+
+		# getChromosomeNumber - Return the reference chromosome number of a segment
+		#
+		# Arguments:
+		# segmentIndex - Index into self.receptorSegment
+		#
+		# Returns:
+		# Integer chromosome number (e.g. 7 for '7q34')
+		#
+		def getChromosomeNumber( self, segmentIndex ):
+				chromosome = re.findall('^\d+', self.receptorSegment[segmentIndex]['chromosome'])
+				if len(chromosome) != 1:
+						self.log.critical("Receptor segment %s chromosome (value: %s) is invalid", self.receptorSegment[segmentIndex]['gene'], self.receptorSegment[segmentIndex]['chromosome'])
+						exit(-10)
+				return int(chromosome[0])
 
 		
 
@@ -732,11 +1139,14 @@ class tcrConfig:
 
 				matches = re.match(cdr3Pattern, rnaSeq)
 				if matches is not None:
-						self.log.info("Valid CDR3")
-						self.log.debug(matches.groups())
+						if self.logInfo:
+								self.log.info("Valid CDR3")
+						if self.logDebug:
+								self.log.debug(matches.groups())
 				else:
 						#matches = re.match(cdr3Consolation, rnaSequence)
-						self.log.info("Invalid CDR3")
+						if self.logInfo:
+								self.log.info("Invalid CDR3")
 						#if matches is not None:
 						#		self.log.debug(matches.groups())
 						return False
@@ -762,6 +1172,43 @@ class tcrConfig:
 				if matches is not None:
 						return(''.join(matches.groups()[1:4]))
 				return None
+
+
+		# getChainCDR3 - Return the CDR3 RNA sequence of a recombined chain
+		#
+		# The CDR3 is found when a chain is recombined (or drawn from a chain
+		# library) and kept with the chain.  Chains from elsewhere (e.g. population
+		# files) have theirs found from their RNA on first request
+		#
+		# Arguments:
+		# chain - tcrChain object
+		#
+		# Returns:
+		# String, or None if the chain has no valid CDR3, see getCDR3Sequence()
+		#
+		def getChainCDR3( self, chain ):
+				if chain.cdr3 is None:
+						chain.cdr3 = self.getCDR3Sequence(self.getChainSequence(chain, 'rna')[3])
+				return chain.cdr3
+
+
+		# getAlleleName - Return the name of a segment allele, e.g. TRBV7-2*01
+		#
+		# Arguments:
+		# segment - 2-tuple of an index into self.receptorSegment and an allele
+		#           name, or None
+		#
+		# Returns:
+		# String, or None if segment is None
+		#
+		def getAlleleName( self, segment ):
+				if segment is None:
+						return None
+				name = self.alleleNames.get(segment, None)
+				if name is None:
+						name = "%s*%s" % (self.receptorSegment[segment[0]]['gene'], segment[1])
+						self.alleleNames[segment] = name
+				return name
 				
 
 		# getRandomNucleotides - Generate random nucleotide strings
@@ -778,8 +1225,9 @@ class tcrConfig:
 		def getRandomNucleotides(self, count):
 				if count < 0:
 						raise ValueError("Count must be a non-negative integer (zero is permissible)")
-				val = ''.join(random.choice('CATG') for i in range(count))
-				self.log.debug("getRandomNucleotides(%d): Returning %s", count, val)
+				val = self.random.nucleotides(count)
+				if self.logDebug:
+						self.log.debug("getRandomNucleotides(%d): Returning %s", count, val)
 				return val
 
 
@@ -793,34 +1241,45 @@ class tcrConfig:
 		#
 		# Arguments:
 		# segment - 2-tuple of 1) index into self.receptorSegment and 2) an allele name
+		# lAllele - Optional.  For V segments, the L-PART1+L-PART2 allele name to use
+		#           in RNA.  Default is chosen by chooseLPartAllele()
+		# space   - Optional.  One of 'dna' or 'rna' to assemble only that sequence,
+		#           with None returned in place of the other.  Assembling RNA alone
+		#           does not read the reference chromosomes.  Default is both
 		#
 		# Returns:
 		# Array, with strings representing the DNA and RNA (respectively) of this segment
 		#
 		
-		def getSegmentSequences( self, segment ):
-				self.log.info("getSegmentSequences() called...")
-				self.log.debug("Arguments: %s", segment)
+		def getSegmentSequences( self, segment, lAllele=None, space=None ):
+				if self.logInfo:
+						self.log.info("getSegmentSequences() called...")
+				if self.logDebug:
+						self.log.debug("Arguments: %s", segment)
 				if not len(segment) == 2:
 						raise ValueError("Argument must be a 2-tuple")
+				if space not in (None, 'dna', 'rna'):
+						raise ValueError("Space must be one of 'dna' or 'rna'")
+				withDNA = space != 'rna'
+				withRNA = space != 'dna'
 				
 				segmentIndex, segmentAllele = segment
 				chromosome = None
-				if(re.match('^7', self.receptorSegment[segmentIndex]['chromosome']) ):
+				if self.receptorSegment[segmentIndex]['chromosome'].startswith('7'):
 						chromosome = 7
-				elif(re.match('^14', self.receptorSegment[segmentIndex]['chromosome']) ):
+				elif self.receptorSegment[segmentIndex]['chromosome'].startswith('14'):
 						chromosome = 14
 				else:
 						raise ValueError("Unknown chromosome " + self.receptorSegment[segmentIndex]['chromosome'])
 
-				self.log.debug("Segment sequence requested: %s", self.receptorSegment[segmentIndex])
+				if self.logDebug:
+						self.log.debug("Segment sequence requested: %s", self.receptorSegment[segmentIndex])
 				
 				# If a [VDJ]-REGION provided, find the GENE-UNIT for the given segment
 				if re.match('^[VDJ]-REGION', self.receptorSegment[segmentIndex]['region'] ):
 						# Replace the V-REGION and L-PART1+L-PART2 sequences within the GENE-UNIT sequence
 						if self.receptorSegment[segmentIndex]['region'] == 'V-REGION':
-								geneUnits = list(filter(lambda x:x['gene'] == self.receptorSegment[segmentIndex]['gene'] and
-																	 re.match('^(L-V|D|J)-GENE-UNIT$', x['region']), self.receptorSegment))
+								geneUnits = self.geneUnits.get(self.receptorSegment[segmentIndex]['gene'], [])
 								if len(geneUnits) == 0:
 										self.log.critical("No corresponding GENE-UNIT found for gene %s", self.receptorSegment[segmentIndex]['gene'])
 										exit(-10)
@@ -833,51 +1292,57 @@ class tcrConfig:
 								geneCoordinates = (geneUnit['start_position'], geneUnit['end_position'], geneUnit['strand'])
 								alleleCoordinates = (self.receptorSegment[segmentIndex]['start_position'], self.receptorSegment[segmentIndex]['end_position'], self.receptorSegment[segmentIndex]['strand'])
 
+								dnaData = None
+								if withDNA:
+										geneData = self.readChromosome(chromosome, geneCoordinates[0], geneCoordinates[1], geneCoordinates[2])
 
-								geneData = self.readChromosome(chromosome, geneCoordinates[0], geneCoordinates[1], geneCoordinates[2])
-
-								geneHeaderLength = alleleCoordinates[0] - geneCoordinates[0]
-								geneAlleleLength = alleleCoordinates[1] - alleleCoordinates[0] + 1
-								if self.receptorSegment[segmentIndex]['strand'] == 'reverse':
-										geneHeaderLength = abs(geneCoordinates[1] - alleleCoordinates[1])
-										geneAlleleLength = abs(alleleCoordinates[1] - alleleCoordinates[0]) + 1
-										
-								self.log.debug("Header %d, Allele %d, total %d",
-															 geneHeaderLength,
-															 geneAlleleLength,
-															 len(geneData))
-						
-								self.log.debug("Head (L-PART1 + INTRON + LPART2):   %s", geneData[0:geneHeaderLength])
-								self.log.debug("Allele (V-REGION): %s", self.receptorSegment[segmentIndex]['allele'][segmentAllele])
-								self.log.debug("Tail (V-RS):   %s", geneData[geneHeaderLength+geneAlleleLength:])
-								dnaData = geneData[0:geneHeaderLength] + self.receptorSegment[segmentIndex]['allele'][segmentAllele]
-								# Now substitute the L-PART allele in RNA (as the geneHeader portion has an intron in it)
-								lPartSegments = list(filter(lambda x:x['gene'] == self.receptorSegment[segmentIndex]['gene'] and
-																			 x['region'] == 'L-PART1+L-PART2', self.receptorSegment))
-								if len(lPartSegments) == 1:
-										if segmentAllele in lPartSegments[0]['allele']:
-												rnaData = lPartSegments[0]['allele'][segmentAllele] + self.receptorSegment[segmentIndex]['allele'][segmentAllele]
+										geneHeaderLength = alleleCoordinates[0] - geneCoordinates[0]
+										geneAlleleLength = alleleCoordinates[1] - alleleCoordinates[0] + 1
+										if self.receptorSegment[segmentIndex]['strand'] == 'reverse':
+												geneHeaderLength = abs(geneCoordinates[1] - alleleCoordinates[1])
+												geneAlleleLength = abs(alleleCoordinates[1] - alleleCoordinates[0]) + 1
+												
+										if self.logDebug:
+												self.log.debug("Header %d, Allele %d, total %d",
+																			 geneHeaderLength,
+																			 geneAlleleLength,
+																			 len(geneData))
+								
+										if self.logDebug:
+												self.log.debug("Head (L-PART1 + INTRON + LPART2):   %s", geneData[0:geneHeaderLength])
+												self.log.debug("Allele (V-REGION): %s", self.receptorSegment[segmentIndex]['allele'][segmentAllele])
+												self.log.debug("Tail (V-RS):   %s", geneData[geneHeaderLength+geneAlleleLength:])
+										dnaData = (geneData[0:geneHeaderLength] + self.receptorSegment[segmentIndex]['allele'][segmentAllele]).upper()
+
+								rnaData = None
+								if withRNA:
+										# Now substitute the L-PART allele in RNA (as the geneHeader portion has an intron in it)
+										lPartSegment = self.segmentRegions.get((self.receptorSegment[segmentIndex]['gene'], 'L-PART1+L-PART2'))
+										if lPartSegment is not None:
+												if lAllele is None:
+														lAllele = self.chooseLPartAllele(segment)
+												rnaData = (lPartSegment['allele'][lAllele] + self.receptorSegment[segmentIndex]['allele'][segmentAllele]).upper()
 										else:
-												rnaData = lPartSegments[0]['allele'][random.choice(list(lPartSegments[0]['allele'].keys()))] + self.receptorSegment[segmentIndex]['allele'][segmentAllele]
-										
-								else:
-										self.log.error("Did not find matching L-PART segment for this V-REGION")
-										exit(-10)
+												self.log.error("Did not find matching L-PART segment for this V-REGION")
+												exit(-10)
 
-								self.log.debug("Returning data for V segment")
-								return [ dnaData.upper(), rnaData.upper() ]
+								if self.logDebug:
+										self.log.debug("Returning data for V segment")
+								return [ dnaData, rnaData ]
 						
 						elif self.receptorSegment[segmentIndex]['region'] == 'D-REGION':
 								dnaData = self.receptorSegment[segmentIndex]['allele'][segmentAllele]
 								rnaData = dnaData
-								self.log.debug("Returning data for D segment")
-								return [ dnaData.upper(), rnaData.upper() ]
+								if self.logDebug:
+										self.log.debug("Returning data for D segment")
+								return [ dnaData.upper() if withDNA else None, rnaData.upper() if withRNA else None ]
 
 						elif self.receptorSegment[segmentIndex]['region'] == 'J-REGION':
 								dnaData = self.receptorSegment[segmentIndex]['allele'][segmentAllele]
 								rnaData = dnaData
-								self.log.debug("Returning data for J segment")
-								return [ dnaData.upper(), rnaData.upper() ]
+								if self.logDebug:
+										self.log.debug("Returning data for J segment")
+								return [ dnaData.upper() if withDNA else None, rnaData.upper() if withRNA else None ]
 								
 								
 				# If an EX1 provided, pull ALL of the exons for that C-segment
@@ -886,7 +1351,7 @@ class tcrConfig:
 						cStartPosition = None
 						cEndPosition = None
 						rnaData = ['', '', '', '']
-						for i in list(filter(lambda j:re.match('^EX\d$', j['region']) and j['gene'] == self.receptorSegment[segmentIndex]['gene'], self.receptorSegment)):
+						for i in self.exonSegments[self.receptorSegment[segmentIndex]['gene']]:
 								if cStartPosition is None or i['start_position'] < cStartPosition:
 										cStartPosition = i['start_position']
 								if cEndPosition is None or i['end_position'] > cEndPosition:
@@ -901,15 +1366,64 @@ class tcrConfig:
 										rnaData[3] = i['allele'][segmentAllele]
 						rnaData = ''.join(rnaData)
 						#self.log.debug("Returning RNA: %s", rnaData)
-						dnaData = self.readChromosome(chromosome, cStartPosition, cEndPosition, self.receptorSegment[segmentIndex]['strand'])
+						dnaData = None
+						if withDNA:
+								dnaData = self.readChromosome(chromosome, cStartPosition, cEndPosition, self.receptorSegment[segmentIndex]['strand']).upper()
 						#self.log.debug("Returning DNA: %s", dnaData)
-						self.log.debug("Returning data for C segment")
-						return [ dnaData.upper(), rnaData.upper() ]
+						if self.logDebug:
+								self.log.debug("Returning data for C segment")
+						return [ dnaData, rnaData.upper() if withRNA else None ]
 
 				self.log.critical("We shouldn't be here")
 				exit(-10)
 				return
 
+
+		# chooseLPartAllele - Choose the L-PART1+L-PART2 allele used in the RNA of
+		#                     a V segment
+		#
+		# The L-PART allele matching the V-REGION allele is used when it exists,
+		# otherwise one is chosen at random
+		#
+		# Arguments:
+		# segment - 2-tuple of 1) index into self.receptorSegment and 2) an allele name
+		#
+		# Returns:
+		# String, the allele name. None if segment is not a V-REGION
+		#
+		def chooseLPartAllele( self, segment ):
+				segmentIndex, segmentAllele = segment
+				if self.receptorSegment[segmentIndex]['region'] != 'V-REGION':
+						return None
+				lPartSegment = self.segmentRegions.get((self.receptorSegment[segmentIndex]['gene'], 'L-PART1+L-PART2'))
+				if lPartSegment is None:
+						self.log.error("Did not find matching L-PART segment for this V-REGION")
+						exit(-10)
+				if segmentAllele in lPartSegment['allele']:
+						return segmentAllele
+				return self.random.choice(list(lPartSegment['allele'].keys()))
+
+
+		# getSegmentFingerprint - Return a digest of our receptor segments and
+		#                         their alleles
+		#
+		# tcrChain objects refer to receptor segments by index.  This digest
+		# identifies the segment data a chain was recombined with, so saved
+		# chains are only rebuilt from identical data.
+		#
+		# Arguments: none
+		#
+		# Returns:
+		# String, a hexadecimal digest
+		#
+		def getSegmentFingerprint( self ):
+				digest = hashlib.sha1()
+				for i in self.receptorSegment:
+						digest.update(repr((i['gene'], i['region'], i['chromosome'], i['strand'],
+																i['start_position'], i['end_position'],
+																sorted(i.get('allele', {}).items()))).encode('utf-8'))
+				return digest.hexdigest()
+
 				
 		# Choose an index from a probability array
 		# Arguments:
@@ -920,7 +1434,7 @@ class tcrConfig:
 		# (e.g. 0, 1, 2, or 3 in the above example)
 		#
 		def roll( self, probability ):
-				rand = random.random()
+				rand = self.random.random()
 				cumulativeProbability = 0
 				index = 0
 				for i in range(0, len(probability)):
@@ -962,8 +1476,10 @@ class tcrConfig:
     # FASTQ string of the "degraded" read, with sequence label and quality score
 		#
 		def getDegradedFastq(self, read, method, ident, variability=0, phred='', baseError=0, L=0, k=0, midpoint=0, display=False):
-				self.log.info("getDegradedFastq() called")
-				self.log.debug("Arguments: %s", (read, method, ident, variability, phred, baseError, L, k, midpoint))
+				if self.logInfo:
+						self.log.info("getDegradedFastq() called")
+				if self.logDebug:
+						self.log.debug("Arguments: %s", (read, method, ident, variability, phred, baseError, L, k, midpoint))
 
 				if display == True:
 						print("Displaying degradation output with method %s, variability %0.5f" % (method, variability))
@@ -974,6 +1490,11 @@ class tcrConfig:
 						raise ValueError("Method must be either logistic or phred (given: \"%s\")" % method)
 						exit(-10)
 
+				# Draw the random values for every base of the read at once
+				errorRolls = self.random.uniforms(len(read))
+				if variability != 0:
+						variabilityRolls = self.random.uniforms(len(read))
+
 				if method == 'logistic':
 						readStr = ''
 						qualStr = ''
@@ -981,24 +1502,25 @@ class tcrConfig:
 								errorRate = (L - baseError) / (1 + math.exp(-k*(i - midpoint))) + baseError
 
 								if variability != 0:
-										errorRate += random.random() * 2 * errorRate * variability - errorRate * variability
+										errorRate += variabilityRolls[i] * 2 * errorRate * variability - errorRate * variability
 
 								phredScore = int(-10 * math.log(errorRate))
 								if phredScore > 41:
 										phredScore = 41
-										if random.random() < errorRate:
-												readStr += self.getRandomNucleotides(1)
-										else:
-												readStr += read[i]
-										qualStr += phred33Reference[phredScore]
-										if display == True:
-												print("Position %02d: error rate %0.4f, Phred+33 %s" % (i, errorRate, phred33Reference[phredScore]))
+								if errorRolls[i] < errorRate:
+										readStr += self.getRandomNucleotides(1)
+								else:
+										readStr += read[i]
+								qualStr += phred33Reference[phredScore]
+								if display == True:
+										print("Position %02d: error rate %0.4f, Phred+33 %s" % (i, errorRate, phred33Reference[phredScore]))
 
 						fastqOutput = "%s\n%s\n+\n%s\n" % (ident, readStr, qualStr)
 				
-						self.log.debug("Orig: %s", read)
-						self.log.debug("Read: %s", readStr)
-						self.log.debug("Qual: %s", qualStr)
+						if self.logDebug:
+								self.log.debug("Orig: %s", read)
+								self.log.debug("Read: %s", readStr)
+								self.log.debug("Qual: %s", qualStr)
 
 						return fastqOutput
 
@@ -1017,9 +1539,9 @@ class tcrConfig:
 										errorRate = 0
 								
 								if variability != 0:
-										errorRate += random.random() * 2 * errorRate * variability - errorRate * variability
+										errorRate += variabilityRolls[i] * 2 * errorRate * variability - errorRate * variability
 								
-								if random.random() < errorRate:
+								if errorRolls[i] < errorRate:
 										readStr += self.getRandomNucleotides(1)
 								else:
 										readStr += read[i]
@@ -1073,6 +1595,63 @@ class tcrConfig:
 				return qualities
 
 
+
+# TCR chain class
+#
+# A compact record of a single recombined chain of a TCR (e.g. the alpha
+# chain).  Rather than its DNA and RNA sequences, a chain stores what is
+# needed to rebuild them from the receptor segments of a tcrConfig, see
+# tcrConfig.getChainSequence()
+#
+# Self variables:
+# receptorType - TCR type.  One of 'A', 'B', 'G', 'D'
+# V, D, J, C   - 2-tuples of an index into tcrConfig.receptorSegment and an
+#                allele name.  D is None for alpha and gamma chains
+# lAllele      - Allele name of the L-PART1+L-PART2 used in RNA
+# vChewback, d5Chewback, d3Chewback, jChewback - Integer chewback lengths
+# n1Insert     - String.  Nucleotides added between the V and D (or V and J) segments
+# n2Insert     - String.  Nucleotides added between the D and J segments ('' for alpha and gamma chains)
+# cdr3         - String.  CDR3 sequence, or None if not yet known.  This is
+#                derived from the fields above, and is not part of the key
+#                identifying the chain, see tcrConfig.getChainCDR3()
+#
+class tcrChain:
+
+		fields = ('receptorType', 'V', 'D', 'J', 'C', 'lAllele',
+							'vChewback', 'd5Chewback', 'd3Chewback', 'jChewback', 'n1Insert', 'n2Insert')
+		__slots__ = fields + ('cdr3', )
+
+		def __init__( self, receptorType, V, D, J, C, lAllele, vChewback, d5Chewback, d3Chewback, jChewback, n1Insert, n2Insert, cdr3=None ):
+				self.receptorType = receptorType
+				self.V = V
+				self.D = D
+				self.J = J
+				self.C = C
+				self.lAllele = lAllele
+				self.vChewback = vChewback
+				self.d5Chewback = d5Chewback
+				self.d3Chewback = d3Chewback
+				self.jChewback = jChewback
+				self.n1Insert = n1Insert
+				self.n2Insert = n2Insert
+				self.cdr3 = cdr3
+
+		def key( self ):
+				return tuple(getattr(self, x) for x in self.fields)
+
+		def __eq__( self, other ):
+				return isinstance(other, tcrChain) and self.key() == other.key()
+
+		def __hash__( self ):
+				return hash(self.key())
+
+
+# chainSequenceProperty - Define the DNA1, RNA1, DNA2 and RNA2 attributes of
+#                         the tcr class, see tcr.getSequence()
+#
+def chainSequenceProperty( name ):
+		return property(lambda self: self.getSequence(name), lambda self, value: self.setSequence(name, value))
+
 				
 class tcr:
 
@@ -1100,16 +1679,58 @@ class tcr:
 				self.J2 = None
 				self.C2 = None
 
-				# These tuples define our DNA and RNA sequences
-				# Consist of a 6-tuple with the following definition:
-				# ( chromosome,  5' end coordinates (NCBI), 5' strand (forward/reverse), DNA/RNA sequence, 3' start coordinates (NCBI), 3' strand (forward/reverse) )
-				self.DNA1 = ()
-				self.RNA1 = ()
-				self.DNA2 = ()
-				self.RNA2 = ()
+				# Compact records of our two chains, see tcrChain
+				self.chain1 = None
+				self.chain2 = None
+
+				# DNA and RNA sequences that were assigned directly, rather than
+				# built from chain1 and chain2.  See getSequence()
+				self.sequences = {}
 
 				return
 
+		# These attributes define our DNA and RNA sequences
+		# Consist of a 6-tuple with the following definition:
+		# ( chromosome,  5' end coordinates (NCBI), 5' strand (forward/reverse), DNA/RNA sequence, 3' start coordinates (NCBI), 3' strand (forward/reverse) )
+		DNA1 = chainSequenceProperty('DNA1')
+		RNA1 = chainSequenceProperty('RNA1')
+		DNA2 = chainSequenceProperty('DNA2')
+		RNA2 = chainSequenceProperty('RNA2')
+
+		# getSequence - Return one of our DNA or RNA sequences
+		#
+		# Sequences are built from our chain records by our tcrConfig when
+		# requested, unless they were assigned directly (e.g. clones saved by
+		# earlier versions of STIG)
+		#
+		# Arguments:
+		# name - One of 'DNA1', 'RNA1', 'DNA2', 'RNA2'
+		#
+		# Returns:
+		# A 6-tuple as described above, or an empty tuple if the chain has not been generated
+		#
+		def getSequence( self, name ):
+				if name in self.sequences:
+						return self.sequences[name]
+				chain = self.chain1 if name[-1] == '1' else self.chain2
+				if chain is None:
+						return ()
+				return self.config.getChainSequence(chain, name[:3].lower())
+
+		def setSequence( self, name, value ):
+				self.sequences[name] = value
+
+		# Restore objects pickled by earlier versions, which stored sequences as attributes
+		def __setstate__( self, state ):
+				sequences = state.pop('sequences', {})
+				for name in ('DNA1', 'RNA1', 'DNA2', 'RNA2'):
+						if name in state:
+								sequences[name] = state.pop(name)
+				self.__dict__.update(state)
+				self.__dict__.setdefault('chain1', None)
+				self.__dict__.setdefault('chain2', None)
+				self.sequences = sequences
+
 		# setLog - Configure our logging object
 		# 
 		# args:
@@ -1128,6 +1749,10 @@ class tcr:
 				else:
 						raise ValueError("Log object for tcr must be a logging.Logger (or None, to disable)")
 
+				# Cached logging levels, see tcrConfig.setLog()
+				self.logDebug = self.log.isEnabledFor(logging.DEBUG)
+				self.logInfo = self.log.isEnabledFor(logging.INFO)
+
 
 				
 		# rmLog - Remove our logging object
@@ -1139,6 +1764,8 @@ class tcr:
 		# 
 		def rmLog( self ):
 				self.log = None
+				self.logDebug = False
+				self.logInfo = False
 
 				
 		# freeze - Render this self object suitable for pickling (with pickle or
@@ -1176,39 +1803,64 @@ class tcr:
 				self.config = config
 				
 		
-		def randomize( self ):
-				self.log.info("Starting randomize()")
-				if( random.random() <= self.AB_frequency ):
+		# randomize - Choose a receptor type, and recombine its two chains
+		#
+		# Arguments:
+		# library - Optional.  A tcrChainLibrary to draw both chains from,
+		#           rather than recombining them
+		#
+		# Returns:
+		# A 2-element list of the number of recombinations attempted for each
+		# chain, see tcrConfig.recombinateChain().  Chains drawn from a library
+		# count as no attempts
+		#
+		def randomize( self, library=None ):
+				if self.logInfo:
+						self.log.info("Starting randomize()")
+				if( self.config.random.random() <= self.AB_frequency ):
 						self.type1 = 'A'
 						self.type2 = 'B'
 				else:
 						self.type1 = 'G'
 						self.type2 = 'D'
-				self.log.info("Chosen: %s %s", self.type1, self.type2)
+				if self.logInfo:
+						self.log.info("Chosen: %s %s", self.type1, self.type2)
+				self.D1 = None
+				self.D2 = None
+				self.sequences = {}
+
+				if library is not None:
+						self.chain1 = library.drawChain(self.type1)
+						self.chain2 = library.drawChain(self.type2)
+						self.V1, self.D1, self.J1, self.C1 = self.chain1.V, self.chain1.D, self.chain1.J, self.chain1.C
+						self.V2, self.D2, self.J2, self.C2 = self.chain2.V, self.chain2.D, self.chain2.J, self.chain2.C
+						return [0, 0]
 
+				attempts = [0, 0]
 				while 1:
+						attempts[0] += 1
 						self.V1 = self.config.chooseRandomSegment(self.type1, componentName='V')
 						if self.type1 in ('B', 'D'):
 								self.D1 = self.config.chooseRandomSegment(self.type1, componentName='D', V=self.V1)
 						self.J1 = self.config.chooseRandomSegment(self.type1, componentName='J', V=self.V1, D=self.D1)
 						self.C1 = self.config.chooseRandomSegment(self.type1, componentName='C', V=self.V1, D=self.D1, J=self.J1)
 								
-						sequenceTuple = self.config.recombinate(self.V1, self.D1, self.J1, self.C1)
-						if sequenceTuple is not None:
-								self.DNA1, self.RNA1 = sequenceTuple
+						self.chain1 = self.config.recombinateChain(self.V1, self.D1, self.J1, self.C1)
+						if self.chain1 is not None:
 								break
 				while 1:
+						attempts[1] += 1
 						self.V2 = self.config.chooseRandomSegment(self.type2, componentName='V')
 						if self.type2 in ('B', 'D'):
 								self.D2 = self.config.chooseRandomSegment(self.type2, componentName='D', V=self.V2)
 						self.J2 = self.config.chooseRandomSegment(self.type2, componentName='J', V=self.V2, D=self.D2)
 						self.C2 = self.config.chooseRandomSegment(self.type2, componentName='C', V=self.V2, D=self.D2, J=self.J2)
 										
-						sequenceTuple = self.config.recombinate(self.V2, self.D2, self.J2, self.C2)
-						if sequenceTuple is not None:
-								self.DNA2, self.RNA2 = sequenceTuple
-								self.log.info("randomize() complete")
-								return
+						self.chain2 = self.config.recombinateChain(self.V2, self.D2, self.J2, self.C2)
+						if self.chain2 is not None:
+								if self.logInfo:
+										self.log.info("randomize() complete")
+								return attempts
 
 		# getCDR3Sequences - Return RNA sequences of the CDR3 regions
     # 
@@ -1219,12 +1871,101 @@ class tcr:
     # 
     # 
 		def getCDR3Sequences( self ):
+				if self.chain1 is not None and self.chain2 is not None and len(self.sequences) == 0:
+						return [ self.config.getChainCDR3(self.chain1), self.config.getChainCDR3(self.chain2) ]
 				return [ self.config.getCDR3Sequence(self.RNA1[3]), self.config.getCDR3Sequence(self.RNA2[3]) ]
 
-						
+
+
+# normalCDF - Cumulative distribution function of the standard normal
+#             distribution
+#
+# Arguments:
+# x - numpy array of values
+#
+# Returns:
+# numpy array of probabilities
+#
+def normalCDF( x ):
+		return 0.5 * (1.0 + numpy.frompyfunc(math.erf, 1, 1)(numpy.asarray(x, dtype=float) / math.sqrt(2.0)).astype(float))
+
+
+# chiSquareCDF - Cumulative distribution function of the chi-square
+#                distribution, i.e. the regularized lower incomplete gamma
+#                function P(k/2, x/2)
+#
+# Arguments:
+# x - numpy array of non-negative values
+# k - Degrees of freedom
+#
+# Returns:
+# numpy array of probabilities
+#
+def chiSquareCDF( x, k ):
+		a = k / 2.0
+		z = numpy.asarray(x, dtype=float) / 2.0
+		result = numpy.zeros(z.shape)
+		with numpy.errstate(divide='ignore'):
+				logPrefix = a * numpy.log(z) - z - math.lgamma(a)
+
+		# Series expansion, which converges quickly for z < a + 1
+		series = (z > 0) & (z < a + 1)
+		if series.any():
+				zs = z[series]
+				term = numpy.full(zs.shape, 1.0 / a)
+				total = term.copy()
+				n = 1
+				while n < 10000 and (term > total * 1e-15).any():
+						term = term * zs / (a + n)
+						total += term
+						n += 1
+				result[series] = total * numpy.exp(logPrefix[series])
+
+		# Continued fraction for the upper incomplete gamma function (modified Lentz's method) elsewhere
+		fraction = z >= a + 1
+		if fraction.any():
+				zf = z[fraction]
+				tiny = 1e-300
+				b = zf + 1.0 - a
+				c = numpy.full(zf.shape, 1.0 / tiny)
+				d = 1.0 / b
+				h = d.copy()
+				for n in range(1, 10000):
+						an = -1.0 * n * (n - a)
+						b = b + 2.0
+						d = an * d + b
+						d[numpy.abs(d) < tiny] = tiny
+						c = b + an / c
+						c[numpy.abs(c) < tiny] = tiny
+						d = 1.0 / d
+						delta = d * c
+						h = h * delta
+						if (numpy.abs(delta - 1.0) < 1e-15).all():
+								break
+				result[fraction] = 1.0 - numpy.exp(logPrefix[fraction]) * h
+
+		return result
+
+
+# getBinProbabilities - Convert cumulative probabilities at bin edges to the
+#                       normalized probability of each bin
+#
+# Arguments:
+# cdf - numpy array of cumulative probabilities, at N + 1 bin edges
+#
+# Returns:
+# numpy array of N probabilities, summing to 1
+#
+def getBinProbabilities( cdf ):
+		probabilities = numpy.clip(numpy.diff(cdf), 0, None)
+		if probabilities.sum() <= 0:
+				raise ValueError("Distribution has no probability within its cutoff")
+		return probabilities / probabilities.sum()
+
+
 class tcrRepertoire:
 
-		def __init__( self, config, size, log=None, AB_frequency = 0.9, uniqueCDR3 = False, uniqueChain = False, uniqueTCR = False ):
+		def __init__( self, config, size, log=None, AB_frequency = 0.9, uniqueCDR3 = False, uniqueChain = False, uniqueTCR = False, trace = None, library = None ):
 				if( isinstance(config, tcrConfig) ):
 						self.config = config
 				else:
@@ -1234,57 +1975,190 @@ class tcrRepertoire:
 
 				self.log.info("tcrRepertoire()::__init__ called with size %d, AB ratio %f, unique chains %s, unique CDR3 %s", size, AB_frequency, uniqueChain, uniqueTCR)
 				self.AB_frequency = AB_frequency
+
+				# Uniqueness constraints, and indexes of the CDR3s, chains or TCRs generated so far.  See getUniqueKeys()
+				self.uniqueCDR3 = uniqueCDR3
+				self.uniqueChain = uniqueChain
+				self.uniqueTCR = uniqueTCR
+				self.uniqueIndex = (set(), set())
+
+				# Optional file object for a per-clone trace, see writeTrace()
+				self.trace = trace
+
+				# Optional tcrChainLibrary clones are drawn from, see generateClone()
+				self.library = library
+
+				# Summary metrics of the clones generated and their population, see tcrSummary
+				self.summary = tcrSummary(config)
+
 				self.repertoire = [None] * size
-				for i in range(0, size):
-						self.log.debug("Generating repertoire bucket %d of %d", i + 1, size)
-						self.repertoire[i] = tcr(self.AB_frequency, self.config, log=self.log.getChild('tcr'))
-
-						if uniqueCDR3 == True: # Ensure unique CDR3
-								unique = False
-								while unique == False:
-										self.repertoire[i].randomize()
-										for j in range(0, i):
-												if ( self.config.getCDR3Sequence(self.repertoire[i].RNA1[3]) == self.config.getCDR3Sequence(self.repertoire[j].RNA1[3]) or
-														 self.config.getCDR3Sequence(self.repertoire[i].RNA2[3]) == self.config.getCDR3Sequence(self.repertoire[j].RNA2[3]) ) :
-														self.log.debug("Duplicate CDR3 at position %d", j)
-														break
-										else:
-												unique = True
-												
-						elif uniqueChain == True: # Ensure unique chains
-								unique = False
-								while unique == False:
-										self.repertoire[i].randomize()
-										for j in range(0, i):
-												if ( self.repertoire[i].RNA1 == self.repertoire[j].RNA1 or
-														 self.repertoire[i].RNA2 == self.repertoire[j].RNA2 ) :														
-														self.log.debug("Duplicate chain at position %d", j)
-														break
-										else:
-												unique = True
-
-						elif uniqueTCR == True: # Ensure unique TCR
-								unique = False
-								while unique == False:
-										self.repertoire[i].randomize()
-										for j in range(0, i):
-												if ( self.repertoire[i].RNA1 == self.repertoire[j].RNA1 and
-														 self.repertoire[i].RNA2 == self.repertoire[j].RNA2 ) :
-														self.log.debug("Duplicate TCR at position %d", j)
-														break
-										else:
-												unique = True
-						else: # No uniqueness constraints
-								self.repertoire[i].randomize()
-								
-						self.log.debug("Finished generating repertoire bucket %d of %d", i + 1, size)
-				self.population = [0] * size
+				# An empty repertoire (e.g. one filled from a population file, see
+				# buildRepertoire() and loadPopulation()) reports no progress stage
+				if size > 0:
+						self.config.progress.start('tcrRepertoire', size, 'clones')
+						for i in range(0, size):
+								if self.logDebug:
+										self.log.debug("Generating repertoire bucket %d of %d", i + 1, size)
+								self.repertoire[i] = self.generateClone(i)
+								if (i + 1) % self.config.progress.batch == 0:
+										self.config.progress.update(self.config.progress.batch)
+								if self.logDebug:
+										self.log.debug("Finished generating repertoire bucket %d of %d", i + 1, size)
+						self.config.progress.finish(size)
+				self.population = numpy.zeros(size, dtype=numpy.int64)
 				self.population_size = 0
 				self.distribution_options = ('stripe', 'equal', 'unimodal', 'chisquare', 'logisticcdf')
 				self.distribution = None
 
 				return
 		
+		# Number of duplicate clones in a row after which generateClone() gives up
+		# when drawing from a chain library, which may run out of unique chains
+		maxLibraryDuplicates = 10000
+
+		# generateClone - Generate a new, random clone that satisfies our uniqueness constraints
+		#
+		# Arguments:
+		# index - Optional.  Index of the clone in the repertoire, given in the
+		#         trace, see writeTrace()
+		#
+		# Returns:
+		# tcr object
+		#
+		def generateClone( self, index=None ):
+				clone = tcr(self.AB_frequency, self.config, log=self.log.getChild('tcr'))
+				duplicates = 0
+				while True:
+						attempts = clone.randomize(library=self.library)
+						keys = self.getUniqueKeys(clone)
+						if all(keys[i] not in self.uniqueIndex[i] for i in range(0, len(keys))):
+								for i in range(0, len(keys)):
+										self.uniqueIndex[i].add(keys[i])
+								self.summary.addClone(clone)
+								if self.trace is not None:
+										self.writeTrace(index, clone, attempts, duplicates)
+								return clone
+						duplicates += 1
+						if self.library is not None and duplicates >= self.maxLibraryDuplicates:
+								raise ValueError("Chain library has too few unique chains for this repertoire size and uniqueness constraint", self.library.filename)
+						if self.logDebug:
+								self.log.debug("Duplicate clone generated, retrying")
+
+
+		# extend - Generate further clones, appended to the repertoire, e.g. to
+		#          grow a repertoire loaded from a population file.  New clones
+		#          are unique against every clone under our uniqueness
+		#          constraints, and have no cells until populated, see populate()
+		#
+		# Arguments:
+		# size - Number of clones to generate
+		#
+		# Returns:
+		# Index of the first new clone
+		#
+		def extend( self, size ):
+				first = len(self.repertoire)
+				self.indexClones()
+
+				self.log.info("Extending repertoire of %d clones by %d clones", first, size)
+				self.config.progress.start('tcrRepertoire', size, 'clones')
+				for i in range(first, first + size):
+						self.repertoire.append(self.generateClone(i))
+						if (i + 1 - first) % self.config.progress.batch == 0:
+								self.config.progress.update(self.config.progress.batch)
+				self.config.progress.finish(size)
+				self.population = numpy.concatenate((numpy.asarray(self.population, dtype=numpy.int64), numpy.zeros(size, dtype=numpy.int64)))
+				return first
+
+
+		# indexClones - Add our clones to our uniqueness indexes and our summary,
+		#               if they are not in them.  The clones of a loaded
+		#               repertoire (or one resumed from a checkpoint, see
+		#               buildRepertoire()) were not generated by us, so are added
+		#               before more are generated (which decodes each clone)
+		#
+		# Arguments: none
+		# Returns: nothing
+		#
+		def indexClones( self ):
+				count = len(self.repertoire)
+				constrained = self.uniqueCDR3 or self.uniqueChain or self.uniqueTCR
+				index = constrained and count > 0 and all(len(x) == 0 for x in self.uniqueIndex)
+				summarize = count > 0 and self.summary.clones == 0
+				if index or summarize:
+						self.config.progress.start('tcrRepertoire:index', count, 'clones')
+						for i in range(0, count):
+								clone = self.repertoire[i]
+								if index:
+										keys = self.getUniqueKeys(clone)
+										for j in range(0, len(keys)):
+												self.uniqueIndex[j].add(keys[j])
+								if summarize:
+										self.summary.addClone(clone)
+								if (i + 1) % self.config.progress.batch == 0:
+										self.config.progress.update(self.config.progress.batch)
+						self.config.progress.finish(count)
+
+
+		# writeTrace - Write a JSON line describing a newly generated clone to
+		#              self.trace.  Each line holds the clone's index, the number
+		#              of duplicate clones rejected before it (see getUniqueKeys())
+		#              and, for each chain, its type, alleles, chewback lengths,
+		#              added nucleotides, CDR3 and the number of recombinations
+		#              attempted
+		#
+		# Arguments:
+		# index      - Index of the clone in the repertoire
+		# clone      - tcr object
+		# attempts   - Recombination attempts for each chain, see tcr.randomize()
+		# duplicates - Number of duplicate clones rejected
+		#
+		# Returns: nothing
+		#
+		def writeTrace( self, index, clone, attempts, duplicates ):
+				chains = []
+				for chain, cdr3, attempt in zip((clone.chain1, clone.chain2), clone.getCDR3Sequences(), attempts):
+						chains.append({
+								'type': chain.receptorType,
+								'V': self.config.getAlleleName(chain.V),
+								'D': self.config.getAlleleName(chain.D),
+								'J': self.config.getAlleleName(chain.J),
+								'C': self.config.getAlleleName(chain.C),
+								'chewback': [ chain.vChewback, chain.d5Chewback, chain.d3Chewback, chain.jChewback ],
+								'insert': [ chain.n1Insert, chain.n2Insert ],
+								'cdr3': cdr3,
+								'attempts': attempt
+								})
+				self.trace.write(json.dumps({ 'clone': index, 'duplicates': duplicates, 'chains': chains }) + "\n")
+
+
+		# getUniqueKeys - Return the keys identifying a clone in our uniqueness indexes
+		#
+		# A clone is unique when none of its keys are found in the corresponding
+		# index of self.uniqueIndex.  With uniqueCDR3, the keys are the CDR3
+		# sequences of the two chains.  With uniqueChain, they are digests of the
+		# RNA of the two chains.  With uniqueTCR, the single key is the pair of
+		# RNA digests
+		#
+		# Arguments:
+		# clone - tcr object
+		#
+		# Returns:
+		# A tuple of zero, one or two keys
+		#
+		def getUniqueKeys( self, clone ):
+				if self.uniqueCDR3 == True:
+						return tuple(clone.getCDR3Sequences())
+				elif self.uniqueChain == True:
+						return (self.getSequenceDigest(clone.RNA1), self.getSequenceDigest(clone.RNA2))
+				elif self.uniqueTCR == True:
+						return ((self.getSequenceDigest(clone.RNA1), self.getSequenceDigest(clone.RNA2)), )
+				return ()
+
+		def getSequenceDigest( self, sequence ):
+				return hashlib.md5(repr(sequence).encode('utf-8')).digest()
+
+
 		# setLog - Configure our logging object
 		# 
 		# Arguments:
@@ -1303,6 +2177,10 @@ class tcrRepertoire:
 				else:
 						raise ValueError("Log object for tcrConfig must be a logging.Logger (or None, to disable)")
 
+				# Cached logging levels, see tcrConfig.setLog()
+				self.logDebug = self.log.isEnabledFor(logging.DEBUG)
+				self.logInfo = self.log.isEnabledFor(logging.INFO)
+
 
 				
 		# rmLog - Remove our logging object
@@ -1315,6 +2193,19 @@ class tcrRepertoire:
 
 		def rmLog( self ):
 				self.log = None
+				self.logDebug = False
+				self.logInfo = False
+
+		# Restore objects pickled by earlier versions, which had no uniqueness
+		# constraints, trace or chain library
+		def __setstate__( self, state ):
+				self.__dict__.update(state)
+				self.__dict__.setdefault('uniqueCDR3', False)
+				self.__dict__.setdefault('uniqueChain', False)
+				self.__dict__.setdefault('uniqueTCR', False)
+				self.__dict__.setdefault('uniqueIndex', (set(), set()))
+				self.__dict__.setdefault('trace', None)
+				self.__dict__.setdefault('library', None)
 
 
 		# freeze - Render this self object suitable for pickling (with pickle or
@@ -1333,6 +2224,10 @@ class tcrRepertoire:
 				for i in self.repertoire:
 						i.freeze()
 				self.config = None
+				self.trace = None
+				self.library = None
+				self.summary.flush()
+				self.summary.config = None
 				return self
 
 		# thaw - Recover this object after being serialized
@@ -1353,6 +2248,9 @@ class tcrRepertoire:
 				for i in self.repertoire:
 						i.thaw(self.log.getChild('tcr'), config=config )
 				self.config = config
+				if 'summary' not in self.__dict__:
+						self.summary = tcrSummary()
+				self.summary.config = config
 				
 
 		# populate - Populate the repertoire with T cells
@@ -1374,10 +2272,14 @@ class tcrRepertoire:
 		#                   *logisticcdf: Use logistic cumulative distribution
 		#                    with a std dev cutoff of l_cutoff.  This will produce
 		#                    CDR3 abundancy counts with a near-gaussian distribution
+		# first -           Integer.  Optional.  Index of the first clone to
+		#                   populate, e.g. as returned by extend().  The cells of
+		#                   earlier clones are kept, and population_size cells
+		#                   are added.  Default is 0, populating every clone
 		#
 		# Returns: Nothing
 		#		
-		def populate( self, population_size, distribution, l_scale=1, l_cutoff=3, g_cutoff=3, cs_k=2, cs_cutoff=8 ):
+		def populate( self, population_size, distribution, l_scale=1, l_cutoff=3, g_cutoff=3, cs_k=2, cs_cutoff=8, first=0 ):
 				self.log.info("populate() called...")
 				self.log.debug("Arguments: %s", (population_size, distribution, g_cutoff, cs_k, cs_cutoff))
 				
@@ -1386,50 +2288,36 @@ class tcrRepertoire:
 				else:
 						self.distribution = distribution
 
-				if(population_size > 0):
-						self.population_size = population_size
-				else:
+				if(population_size <= 0):
 						raise ValueError("population size must be a positive integer")
+				repertoireSize = len(self.repertoire) - first
+				if( first < 0 or repertoireSize <= 0 ):
+						raise ValueError("populate() needs at least one clone from clone %d" % first)
 
+				self.config.progress.start('populate', population_size, 'cells')
 				if self.distribution == 'equal':
-						for i in range(0, self.population_size):
-								random_bin = int(math.floor(random.random() * len(self.repertoire)))
-								self.population[random_bin] += 1
+						population = self.config.random.generator.multinomial(population_size, numpy.full(repertoireSize, 1.0 / repertoireSize))
 
 				elif self.distribution == 'stripe':
-						for i in range(0, self.population_size):
-								random_bin = int(i % len(self.repertoire))
-								self.population[random_bin] += 1
+						# The Nth cell is assigned to the (N % repertoire size) clone
+						population = numpy.full(repertoireSize, population_size // repertoireSize, dtype=numpy.int64)
+						population[:population_size % repertoireSize] += 1
 						
 				elif self.distribution == 'unimodal':
-						if( g_cutoff < 0 ):
-								raise ValueError("Argument g_cutoff for populate must be a positive integer")
+						if( g_cutoff <= 0 ):
+								raise ValueError("Argument g_cutoff for populate must be a positive number")
 
-						population_generated = 0						
-						while( population_generated < self.population_size ):
-								self.log.info("Rolling %d individuals", self.population_size - population_generated)
-								
-								for f in numpy.random.normal(0, 1, self.population_size - population_generated):
-										if( abs(f) > g_cutoff ):
-												continue
-										# Scale the normal values to match our repertoire "buckets"
-										f = f + g_cutoff
-										bucket_size = g_cutoff * 2.0 / len(self.repertoire)
-										self.population[int(f / bucket_size)] += 1
-										population_generated += 1
+						# Cells are drawn from a normal distribution truncated to +/- g_cutoff, which is divided into equal-width buckets
+						edges = numpy.linspace(-1 * g_cutoff, g_cutoff, repertoireSize + 1)
+						population = self.config.random.generator.multinomial(population_size, getBinProbabilities(normalCDF(edges)))
 
 				elif self.distribution == 'chisquare':
 						if( cs_k <= 0 or cs_cutoff <= 0 ):
 								raise ValueError("Invalid arguments for chi-square distribution.  Must be k > 0 and cutoff >0.  Got %f, %f" % (cs_k, cs_cutoff))
-						population_generated = 0
-						while population_generated < self.population_size:
-								self.log.info("Rolling %d individuals", self.population_size - population_generated)
-								for x in numpy.random.chisquare(cs_k, self.population_size - population_generated):
-										if( x >= cs_cutoff):
-												continue
-										# Scale the values to match our repertoire "buckets"
-										self.population[int((x/cs_cutoff) * len(self.repertoire))] += 1
-										population_generated += 1
+
+						# Cells are drawn from a chi-square distribution truncated to [0, cs_cutoff), which is divided into equal-width buckets
+						edges = numpy.linspace(0, cs_cutoff, repertoireSize + 1)
+						population = self.config.random.generator.multinomial(population_size, getBinProbabilities(chiSquareCDF(edges, cs_k)))
 
 				elif self.distribution == 'logisticcdf':
 						if( l_cutoff <= 0 ):
@@ -1437,50 +2325,34 @@ class tcrRepertoire:
 						if( l_scale <= 0 ):
 								raise ValueError("Invalid arguments for logisticcdf distribution.  Scale must be a positive number");
 
-						maxDistAttempts=500
-						distAttempt=1
-						while distAttempt <= maxDistAttempts:
-								self.log.info("Attempting to fit population with logisticcdf CDF, attempt %d of %d", distAttempt, maxDistAttempts)
-								
-								# Generate a list of logistically distributed values, with appropriate scale and cutoff values
-								probability_distribution = list()
-								while( len(probability_distribution) < len(self.repertoire) ):
-										dist = numpy.random.logistic(0, l_scale, len(self.repertoire) - len(probability_distribution) )
-										dist = dist[(dist < l_cutoff) & (dist > -1 * l_cutoff)]
-										probability_distribution.extend(dist)
-
-								# Normalize our list, and find the cumulative value of the distribution
-								probability_distribution = sorted(probability_distribution)
-								min_value = abs(probability_distribution[0])
-								sum_value = 0
-								for i in range(0, len(probability_distribution)):
-										probability_distribution[i] += min_value + 1
-										sum_value += probability_distribution[i]
-
-								for i in range(0, len(probability_distribution)):
-										self.population[i] = int(round((probability_distribution[i] / sum_value) * self.population_size))
-
-								if self.population_size != sum(self.population):
-										distAttempt += 1
-								else:
-										break
-												
-						if self.population_size != sum(self.population):
-								self.log.warning("logisticcdf distribution encountered a rounding error when assigning %d out of %d requested cells.  This may affect the distribution in rare cases, please verify acceptable subclone populations in your STIG population file. See the manual for more details", abs(sum(self.population) - self.population_size), self.population_size)
-
-								missing = self.population_size - sum(self.population)
-								if missing > 0:
-										for i in range(0, missing):
-												self.population[(len(self.population) - i - 1) % len(self.population)] += 1
-								elif missing < 0:
-										for i in range(0, abs(missing)):
-												self.population[(0 + i) % len(self.population)] -= 1
-										
-								self.population_size = sum(self.population)
+						# Generate a list of logistically distributed values, with appropriate scale and cutoff values
+						probability_distribution = numpy.empty(0)
+						while( len(probability_distribution) < repertoireSize ):
+								dist = self.config.random.generator.logistic(0, l_scale, repertoireSize - len(probability_distribution))
+								dist = dist[(dist < l_cutoff) & (dist > -1 * l_cutoff)]
+								probability_distribution = numpy.concatenate((probability_distribution, dist))
+
+						# Normalize our list, giving the share of the population of each clone
+						probability_distribution = numpy.sort(probability_distribution)
+						probability_distribution += abs(probability_distribution[0]) + 1
+						shares = probability_distribution / probability_distribution.sum() * population_size
+
+						# Round the shares by the largest remainder method, so the population size is met exactly
+						population = numpy.floor(shares).astype(numpy.int64)
+						remainder = population_size - int(population.sum())
+						if remainder > 0:
+								population[numpy.argsort(population - shares, kind='stable')[:remainder]] += 1
 						
 				else:
 						raise ValueError("Invalid distribution %s, must be one of %s" % (self.distribution, self.distribution_options))
 
+				self.config.progress.finish(population_size)
+				if first > 0:
+						population = numpy.concatenate((numpy.asarray(self.population[:first], dtype=numpy.int64), population))
+						population_size += self.population_size
+				self.population = population
+				self.population_size = population_size
+				self.summary.setPopulation(self.population)
 				self.log.info("populate() complete...")
 
 
@@ -1533,6 +2405,19 @@ class tcrRepertoire:
 		#                  anchors in Exon 1 of the beta chain C-region on the
 		#                  reverse strand.
 		#
+		# first_read     - Integer.  Number of the first read, as given in the
+		#                  read comments.  Reads generated in chunks (see
+		#                  pipeline.py) are numbered from their chunk's offset.
+		#                  Default is 0
+		#
+		# truth          - Optional.  A list to which a record of where each read
+		#                  was taken from is appended, see truth.py
+		#
+		# cells          - Optional.  A tcrCells object (see singlecell.py).  If
+		#                  given, each read is taken from a molecule of its
+		#                  cells, and the first read begins with the barcode of
+		#                  the cell and the UMI of the molecule
+		#
 		# Returns:
 		#
 		# A single 2-tuple (reads, comments), where:
@@ -1546,7 +2431,7 @@ class tcrRepertoire:
 		#            array, where comments[n] describes reads[n].
 		#
 		#
-		def simulateRead( self, count, space, distribution='gaussian', read_length_mean=25, read_length_sd=4, read_length_sd_cutoff=4, read_type = 'single', insert_length_mean=100, insert_length_sd=8, insert_length_sd_cutoff=4, amplicon_probe = 'GATCTCTGCTTCTGATGGCTCAAACAC' ):
+		def simulateRead( self, count, space, distribution='gaussian', read_length_mean=25, read_length_sd=4, read_length_sd_cutoff=4, read_type = 'single', insert_length_mean=100, insert_length_sd=8, insert_length_sd_cutoff=4, amplicon_probe = 'GATCTCTGCTTCTGATGGCTCAAACAC', first_read=0, truth=None, cells=None ):
 				self.log.info("simulateRead() called...")
 
 				self.log.debug("count: %d, space: %s, distribution: %s, read type: %s, read length params: (%d, %d, %d), insert length params: (%d, %d, %d), amplicon probe: %s",
@@ -1557,21 +2442,30 @@ class tcrRepertoire:
 						exit(-10)
 
 				outputReads = []
+				cumulativePopulation = numpy.cumsum(self.population)
 						
 				readIndividual = None
+				progress = self.config.progress
+				rng = self.config.random
+				progress.start('simulateRead', count, 'reads')
 				while len(outputReads) < count:
+						self.config.profile.count('simulateRead.attempts')
 						
 						# Choose an individual cell to read from (a TCR chain [e.g. alpha or beta] is chosen later)
-						randIndividual = random.random() * self.population_size
-						self.log.debug("Starting to generate new read from individual #%d out of %d", randIndividual, self.population_size)
-						cumulativePopulation = 0
-						for j in range(0, len(self.repertoire)):
-								cumulativePopulation += self.population[j]
-								if randIndividual < cumulativePopulation:
-										self.log.debug("Individual is instance of cell %d in repertoire", j)
-										readIndividual = j
-										break
-						outputComment='@STIG:readnum=%d:clone=%d' % (len(outputReads), j)
+						if cells is None:
+								randIndividual = rng.random() * self.population_size
+								if self.logDebug:
+										self.log.debug("Starting to generate new read from individual #%d out of %d", randIndividual, self.population_size)
+								readIndividual = int(numpy.searchsorted(cumulativePopulation, randIndividual, side='right'))
+								if self.logDebug:
+										self.log.debug("Individual is instance of cell %d in repertoire", readIndividual)
+								outputComment='@STIG:readnum=%d:clone=%d' % (first_read + len(outputReads), readIndividual)
+						# Or a molecule of a single cell, which gives the chain
+						else:
+								cell, readIndividual, chainNumber, barcode, umi = cells.getMolecule(rng.random())
+								if self.logDebug:
+										self.log.debug("Reading molecule %s of chain %d of cell %d (%s), an instance of cell %d in repertoire", umi, chainNumber, cell, barcode, readIndividual)
+								outputComment='@STIG:readnum=%d:clone=%d:cell=%d:barcode=%s:umi=%s' % (first_read + len(outputReads), readIndividual, cell, barcode, umi)
 								
 						# Calculate our required length(s) for this particular read
 						readLength = None
@@ -1580,7 +2474,7 @@ class tcrRepertoire:
 										if read_length_sd > 0:
 												readLength = 0
 												while abs(readLength - read_length_mean) / read_length_sd > read_length_sd_cutoff or readLength <= 0:
-														readLength = int(round(numpy.random.normal(read_length_mean, read_length_sd)))
+														readLength = int(round(rng.normal(read_length_mean, read_length_sd)))
 										else:
 												readLength = read_length_mean
 										
@@ -1590,11 +2484,11 @@ class tcrRepertoire:
 										insertLength = 0
 										if read_length_sd > 0:
 												while abs(insertLength - insert_length_mean) / insert_length_sd > insert_length_sd_cutoff or insertLength <= 0:
-														insertLength = int(round(numpy.random.normal(insert_length_mean, insert_length_sd)))
+														insertLength = int(round(rng.normal(insert_length_mean, insert_length_sd)))
 												while abs(read1Length - read_length_mean) / read_length_sd > read_length_sd_cutoff or read1Length <= 0 or read1Length > insertLength:
-														read1Length = int(round(numpy.random.normal(read_length_mean, read_length_sd)))
+														read1Length = int(round(rng.normal(read_length_mean, read_length_sd)))
 												while abs(read2Length - read_length_mean) / read_length_sd > read_length_sd_cutoff or read2Length <= 0 or read2Length > insertLength:
-														read2Length = int(round(numpy.random.normal(read_length_mean, read_length_sd)))
+														read2Length = int(round(rng.normal(read_length_mean, read_length_sd)))
 										else:
 												read1Length = read_length_mean
 												read2Length = read_length_mean
@@ -1605,7 +2499,7 @@ class tcrRepertoire:
 										if read_length_sd > 0:
 												readLength = 0
 												while abs(readLength - read_length_mean) / read_length_sd > read_length_sd_cutoff or readLength <= 0:
-														readLength = int(round(numpy.random.normal(read_length_mean, read_length_sd)))
+														readLength = int(round(rng.normal(read_length_mean, read_length_sd)))
 										else:
 												readLength = read_length_mean
 
@@ -1621,24 +2515,29 @@ class tcrRepertoire:
 						# Pick a location within this individual's DNA and generate the read
 						totalReadLength = readLength if isinstance(readLength, int) else readLength[1]
 
-						self.log.debug("Read length for this read will be: %s", totalReadLength)
+						if self.logDebug:
+								self.log.debug("Read length for this read will be: %s", totalReadLength)
 
 						# Pick a chain to read from (alpha / beta or gamma / delta)
 						receptorCoordinates = None
-						if random.random() < 0.5:
+						if cells is None:
+								chainNumber = 1 if rng.random() < 0.5 else 2
+						if chainNumber == 1:
 								if space == 'dna':
 										receptorCoordinates = self.repertoire[readIndividual].DNA1
 								elif space == 'rna':
 										receptorCoordinates = self.repertoire[readIndividual].RNA1
 								outputComment = (outputComment + ":chain=%s" % self.repertoire[readIndividual].type1)
-								self.log.debug("Output chain is of type %s", self.repertoire[readIndividual].type1)
+								if self.logDebug:
+										self.log.debug("Output chain is of type %s", self.repertoire[readIndividual].type1)
 						else:
 								if space == 'dna':
 										receptorCoordinates = self.repertoire[readIndividual].DNA2
 								elif space == 'rna':
 										receptorCoordinates = self.repertoire[readIndividual].RNA2
 								outputComment = (outputComment + ":chain=%s" % self.repertoire[readIndividual].type2)
-								self.log.debug("Output chain is of type %s", self.repertoire[readIndividual].type2)
+								if self.logDebug:
+										self.log.debug("Output chain is of type %s", self.repertoire[readIndividual].type2)
 
 						chromosome, sequenceStart, strandStart, sequence, sequenceEnd, strandEnd = receptorCoordinates
 
@@ -1647,20 +2546,33 @@ class tcrRepertoire:
 						if read_type != 'amplicon': # Non amplicon reads have a random location selected...
 								startRange = 0 - totalReadLength + 1
 								endRange = len(sequence) - 1
-								self.log.debug("Choosing between [%d, %d]", startRange, endRange)
-								startIndex = random.choice(range(startRange, endRange)) # Range is /inclusive/
+								if self.config.utrPolicy == 'clip': # ...entirely within the chain if UTRs are unavailable
+										startRange = 0
+										endRange = len(sequence) - totalReadLength + 1
+										if endRange <= startRange:
+												if self.logDebug:
+														self.log.debug("Read length %d exceeds chain length %d", totalReadLength, len(sequence))
+												self.config.profile.count('simulateRead.rejected.length')
+												continue
+								if self.logDebug:
+										self.log.debug("Choosing between [%d, %d]", startRange, endRange)
+								startIndex = rng.randrange(startRange, endRange) # Range is /inclusive/
 								outputComment = outputComment + ":randpos=%d" % startIndex
 						elif read_type == 'amplicon':
 								if sequence.find(amplicon_probe) > 0:
-										self.log.debug("Found amplicon sequence at position %d", sequence.find(amplicon_probe))
+										if self.logDebug:
+												self.log.debug("Found amplicon sequence at position %d", sequence.find(amplicon_probe))
 										startIndex = sequence.find(amplicon_probe)
 										outputComment = outputComment + ":ampliconStartPos=%d" % startIndex
 								elif sequence.find(self.config.reverseComplement(amplicon_probe)) > 0:
-										self.log.debug("Found amplicon sequence at complement position %d",  sequence.find(self.config.reverseComplement(amplicon_probe)))
+										if self.logDebug:
+												self.log.debug("Found amplicon sequence at complement position %d",  sequence.find(self.config.reverseComplement(amplicon_probe)))
 										startIndex =  sequence.find(self.config.reverseComplement(amplicon_probe)) - totalReadLength + len(amplicon_probe)
 										outputComment = outputComment + ":ampliconStartPos=%d:ampliconProbePos=%d" % (startIndex, startIndex + totalReadLength - len(amplicon_probe))
 								else:
-										self.log.debug("Did not find amplicon probe on this chain")
+										if self.logDebug:
+												self.log.debug("Did not find amplicon probe on this chain")
+										self.config.profile.count('simulateRead.rejected.probe')
 										continue
 						else:
 								self.log.critical("simulateRead(): Invalid read_type %s", read_type)
@@ -1678,10 +2590,16 @@ class tcrRepertoire:
 						elif startIndex <  0 and (len(sequence) + abs(startIndex)) < totalReadLength: # Read spans 5' UTR, sequence and 3' UTR
 								_3UTRBases = totalReadLength - (len(sequence) + abs(startIndex))
 
-						self.log.debug("Starting read at position %d, 5p %db 3p %db", startIndex, _5UTRBases, _3UTRBases)
+						if self.logDebug:
+								self.log.debug("Starting read at position %d, 5p %db 3p %db", startIndex, _5UTRBases, _3UTRBases)
+						if self.config.utrPolicy == 'clip' and (_5UTRBases > 0 or _3UTRBases > 0):
+								if self.logDebug:
+										self.log.debug("Read extends into UTR, which is clipped")
+								self.config.profile.count('simulateRead.rejected.utr')
+								continue
 								
 						if _5UTRBases > 0:
-								outputSequence = self.config.readChromosome(chromosome, sequenceStart - _5UTRBases + 1, sequenceStart, strandStart)
+								outputSequence = self.config.readUTR(chromosome, sequenceStart - _5UTRBases + 1, sequenceStart, strandStart)
 								
 						if _5UTRBases > 0 and _5UTRBases < totalReadLength:
 								outputSequence += sequence[0:totalReadLength - _5UTRBases]
@@ -1696,7 +2614,7 @@ class tcrRepertoire:
 								raise ValueError("We shouldn't be here")
 								
 						if _3UTRBases > 0:
-								outputSequence += self.config.readChromosome(chromosome, sequenceEnd, sequenceEnd + _3UTRBases - 1, strandEnd)
+								outputSequence += self.config.readUTR(chromosome, sequenceEnd, sequenceEnd + _3UTRBases - 1, strandEnd)
 
 						# Append this single/paired/amplicon read to our output array outputReads
 						if read_type == 'single':
@@ -1717,40 +2635,104 @@ class tcrRepertoire:
 						else:
 								self.log.critical("simulateRead(): Invalid read type %s", read_type)
 								exit(-10)
-								
+
+						# Single-cell reads begin with the cell barcode and UMI, as read 1 of 10x data
+						if cells is not None:
+								read, comment = outputReads[-1]
+								outputReads[-1] = (barcode + umi + read if read_type == 'single' else (barcode + umi + read[0], read[1]), comment)
+
+						if truth is not None:
+								if read_type == 'paired':
+										truth.append((readIndividual, chainNumber, startIndex, totalReadLength, read1Length, read2Length))
+								else:
+										truth.append((readIndividual, chainNumber, startIndex, totalReadLength, totalReadLength, totalReadLength))
+
+						# Reads are counted in batches, as tcrProgress.update() reads the clock
+						if len(outputReads) % progress.batch == 0:
+								progress.update(progress.batch)
+
+				self.config.profile.count('simulateRead.reads', len(outputReads))
+				progress.finish(len(outputReads))
 				return outputReads # end simulateRead()
 
 
 		
-		# Return statistics about this repertoire, suitable for saving to a file
-    #
-    # Arguments: none
-    #
-    # Returns:
-    # Array with one element for each repertoire clone, formatted as so:
-    # [ Clone count,
-		#   V allele 1, J allele 1, CDR3 sequence 1, RNA sequence 1, DNA sequence 1,
-		#   V allele 2, J allele 2, CDR3 sequence 2, RNA sequence 2, DNA sequence 2 ]
-    #
-    #
-		
-		def getStatistics(self, addHeader = False):
-				retval = []
-				if addHeader == True:
-						retval.append(["CLONE,CELL_COUNT,VALLELE_1, JALLELE_1, CDR3_1, RNA_1, DNA_1, VALLELE_2, JALLELE_2, CDR3_2, RNA_2, DNA_2"])
+		# Columns of the statistics of each clone, see iterStatistics().  The
+		# sequence columns are optional, as they dominate the size of the output
+		statisticsColumns = ('CLONE', 'CELL_COUNT',
+												 'VALLELE_1', 'JALLELE_1', 'CDR3_1', 'RNA_1', 'DNA_1',
+												 'VALLELE_2', 'JALLELE_2', 'CDR3_2', 'RNA_2', 'DNA_2')
+		sequenceColumns = ('RNA_1', 'DNA_1', 'RNA_2', 'DNA_2')
+
+		# getStatisticsColumns - Return the names of the statistics columns
+		#
+		# Arguments:
+		# sequences - Optional.  If False, the RNA and DNA columns are left out
+		#
+		# Returns:
+		# List of column names
+		#
+		def getStatisticsColumns( self, sequences=True ):
+				return [ x for x in self.statisticsColumns if sequences or x not in self.sequenceColumns ]
+
+		# getStatisticsHeader - Return the header line of the statistics file,
+		#                       spaced as written by earlier versions of STIG
+		#
+		def getStatisticsHeader( self, sequences=True ):
+				columns = self.getStatisticsColumns(sequences)
+				return "%s,%s,%s" % (columns[0], columns[1], ', '.join(columns[2:]))
+
 
+		# iterStatistics - Generate statistics about each clone of this
+		#                  repertoire, one at a time
+		#
+		# Alleles and CDR3s are taken from those cached by our tcrConfig and each
+		# clone's chains, so no sequence is assembled unless sequences are
+		# requested
+		#
+		# Arguments:
+		# sequences - Optional.  If False, the RNA and DNA of each chain are left
+		#             out.  Default is True
+		#
+		# Returns:
+		# Generator of lists, one per clone, with the values of the columns given
+		# by getStatisticsColumns():
+		# [ Clone index, Cell count,
+		#   V allele 1, J allele 1, CDR3 sequence 1, (RNA sequence 1, DNA sequence 1,)
+		#   V allele 2, J allele 2, CDR3 sequence 2, (RNA sequence 2, DNA sequence 2) ]
+		# DNA sequences are empty in reference-free mode
+		#
+		def iterStatistics( self, sequences=True ):
+				getAlleleName = self.config.getAlleleName
+				hasReference = self.config.hasReference()
 				for i in range(0, len(self.repertoire)):
-						CDR3_1, CDR3_2 = self.repertoire[i].getCDR3Sequences()
+						clone = self.repertoire[i]
+						CDR3_1, CDR3_2 = clone.getCDR3Sequences()
+						if sequences:
+								yield [ i, self.population[i],
+												getAlleleName(clone.V1), getAlleleName(clone.J1), CDR3_1, clone.RNA1[3], clone.DNA1[3] if hasReference else '',
+												getAlleleName(clone.V2), getAlleleName(clone.J2), CDR3_2, clone.RNA2[3], clone.DNA2[3] if hasReference else '' ]
+						else:
+								yield [ i, self.population[i],
+												getAlleleName(clone.V1), getAlleleName(clone.J1), CDR3_1,
+												getAlleleName(clone.V2), getAlleleName(clone.J2), CDR3_2 ]
 
-						v1Allele = "%s*%s" % (self.config.receptorSegment[self.repertoire[i].V1[0]]['gene'], self.repertoire[i].V1[1])
-						v2Allele = "%s*%s" % (self.config.receptorSegment[self.repertoire[i].V2[0]]['gene'], self.repertoire[i].V2[1])
-						j1Allele = "%s*%s" % (self.config.receptorSegment[self.repertoire[i].J1[0]]['gene'], self.repertoire[i].J1[1])
-						j2Allele = "%s*%s" % (self.config.receptorSegment[self.repertoire[i].J2[0]]['gene'], self.repertoire[i].J2[1])
-				
-						stats = [ i, self.population[i],
-											v1Allele, j1Allele, CDR3_1, self.repertoire[i].RNA1[3], self.repertoire[i].DNA1[3],
-											v2Allele, j2Allele, CDR3_2, self.repertoire[i].RNA2[3], self.repertoire[i].DNA2[3] ]
-											
-						retval.append(stats)
+
+		# Return statistics about this repertoire, suitable for saving to a file.
+		# See iterStatistics(), and statsfile.writeStatistics(), which writes
+		# them without holding every row in memory
+		#
+		# Arguments:
+		# addHeader - Optional.  If True, the first element is a 1-element list of
+		#             the header line
+		#
+		# Returns:
+		# Array with one element for each repertoire clone, see iterStatistics()
+		#
+		def getStatistics(self, addHeader = False):
+				retval = []
+				if addHeader == True:
+						retval.append([ self.getStatisticsHeader() ])
+				retval.extend(self.iterStatistics())
 				return retval
 				
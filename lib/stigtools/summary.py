@@ -0,0 +1,274 @@
+import json
+import collections
+import numpy
+
+# Repertoire summaries
+#
+# A tcrSummary accumulates the metrics usually wanted from a repertoire:
+# receptor pair (alpha/beta vs gamma/delta) counts, V, D, J and C gene usage,
+# CDR3 and N-addition length and chewback histograms for each chain type, and
+# the distribution of clone sizes.  Clones are added as they are generated
+# (see tcrRepertoire.generateClone()), so the metrics do not need to be
+# recovered from the statistics file.
+#
+# Values are buffered per metric and counted in batches with numpy, so adding
+# a clone costs little more than appending to a few lists.  Summaries of
+# shards of a study (e.g. separate runs, or the samples of a batch) can be
+# merged, see merge() and mergeSummaries(), and are written as compact JSON:
+#
+#   {
+#     "format": 1,
+#     "clones": 1000, "cells": 100000, "max_clone_size": 8510,
+#     "clone_size_log2": [0, 3, 10, ...],
+#     "receptor_pairs": { "AB": 900, "GD": 100 },
+#     "chains": {
+#       "B": { "count": 900, "no_cdr3": 0,
+#              "V": { "TRBV20-1": 91, ... }, "D": {...}, "J": {...}, "C": {...},
+#              "cdr3_length": [0, 0, ..., 12, 30, ...],
+#              "n1_length": [...], "n2_length": [...],
+#              "v_chewback": [...], "d5_chewback": [...], "d3_chewback": [...], "j_chewback": [...] },
+#       ...
+#     }
+#   }
+#
+# Histograms are lists of counts indexed by value, e.g. cdr3_length[45] is
+# the number of chains with a 45 nucleotide CDR3.  clone_size_log2[0] is the
+# number of clones with no cells, and clone_size_log2[k] the number with
+# between 2^(k-1) and 2^k - 1 cells.
+#
+
+summaryFormat = 1
+
+# Per chain histograms, in the order written
+chainHistograms = ('cdr3_length', 'n1_length', 'n2_length', 'v_chewback', 'd5_chewback', 'd3_chewback', 'j_chewback')
+chainSegments = ('V', 'D', 'J', 'C')
+
+
+class tcrSummary:
+
+		# Arguments:
+		# config     - Optional.  tcrConfig of the clones added, used to name
+		#              their genes and find their CDR3s.  Not needed for
+		#              summaries read from files
+		# bufferSize - Optional.  Number of clones buffered before they are
+		#              counted
+		#
+		def __init__( self, config=None, bufferSize=4096 ):
+				self.config = config
+				self.bufferSize = bufferSize
+				self.clones = 0
+				self.cells = 0
+				self.maxCloneSize = 0
+				self.cloneSizes = numpy.zeros(0, dtype=numpy.int64)
+				self.receptorPairs = collections.Counter()
+				self.chainCounts = collections.Counter()
+				self.noCDR3 = collections.Counter()
+				self.usage = collections.defaultdict(collections.Counter)
+				self.histograms = {}
+				self.pending = collections.defaultdict(list)
+				self.pendingClones = 0
+
+
+		# addClone - Add a clone to the summary
+		#
+		# Arguments:
+		# clone - tcr object
+		#
+		# Returns: nothing
+		#
+		def addClone( self, clone ):
+				self.clones += 1
+				self.receptorPairs[clone.type1 + clone.type2] += 1
+				pending = self.pending
+				for receptorType, chain, segments in ((clone.type1, clone.chain1, (clone.V1, clone.D1, clone.J1, clone.C1)),
+																							(clone.type2, clone.chain2, (clone.V2, clone.D2, clone.J2, clone.C2))):
+						self.chainCounts[receptorType] += 1
+						for name, segment in zip(chainSegments, segments):
+								if segment is not None:
+										pending[(receptorType, name)].append(segment[0])
+
+						# Clones saved by earlier versions of STIG have no chain records
+						if chain is None:
+								continue
+						cdr3 = self.config.getChainCDR3(chain)
+						if cdr3 is None:
+								self.noCDR3[receptorType] += 1
+						else:
+								pending[(receptorType, 'cdr3_length')].append(len(cdr3))
+						pending[(receptorType, 'n1_length')].append(len(chain.n1Insert))
+						pending[(receptorType, 'n2_length')].append(len(chain.n2Insert))
+						pending[(receptorType, 'v_chewback')].append(chain.vChewback)
+						pending[(receptorType, 'd5_chewback')].append(chain.d5Chewback)
+						pending[(receptorType, 'd3_chewback')].append(chain.d3Chewback)
+						pending[(receptorType, 'j_chewback')].append(chain.jChewback)
+
+				self.pendingClones += 1
+				if self.pendingClones >= self.bufferSize:
+						self.flush()
+
+
+		# addRepertoire - Add every clone of a repertoire, and its population, to
+		#                 the summary, e.g. for a repertoire loaded from a file
+		#
+		# Arguments:
+		# repertoire - tcrRepertoire object
+		#
+		# Returns: nothing
+		#
+		def addRepertoire( self, repertoire ):
+				for i in range(0, len(repertoire.repertoire)):
+						self.addClone(repertoire.repertoire[i])
+				self.setPopulation(repertoire.population)
+
+
+		# setPopulation - Set the clone sizes of the summary
+		#
+		# Arguments:
+		# population - Sequence of cell counts, one per clone
+		#
+		# Returns: nothing
+		#
+		def setPopulation( self, population ):
+				population = numpy.asarray(population, dtype=numpy.int64)
+				bins = numpy.zeros(len(population), dtype=numpy.int64)
+				populated = population > 0
+				bins[populated] = numpy.floor(numpy.log2(population[populated])).astype(numpy.int64) + 1
+				self.cloneSizes = numpy.bincount(bins)
+				self.cells = int(population.sum())
+				self.maxCloneSize = int(population.max()) if len(population) > 0 else 0
+
+
+		# flush - Count the values buffered by addClone()
+		#
+		def flush( self ):
+				for key, values in self.pending.items():
+						counts = numpy.bincount(values)
+						if key[1] in chainSegments:
+								for index in numpy.flatnonzero(counts).tolist():
+										self.usage[key][self.config.receptorSegment[index]['gene']] += int(counts[index])
+						else:
+								self.addHistogram(key, counts)
+				self.pending.clear()
+				self.pendingClones = 0
+
+		def addHistogram( self, key, counts ):
+				histogram = self.histograms.get(key, numpy.zeros(0, dtype=numpy.int64))
+				if len(counts) > len(histogram):
+						histogram = numpy.concatenate((histogram, numpy.zeros(len(counts) - len(histogram), dtype=numpy.int64)))
+				histogram[:len(counts)] += counts
+				self.histograms[key] = histogram
+
+
+		# merge - Add the counts of another summary to this one
+		#
+		# Arguments:
+		# other - tcrSummary object
+		#
+		# Returns:
+		# This summary
+		#
+		def merge( self, other ):
+				self.flush()
+				other.flush()
+				self.clones += other.clones
+				self.cells += other.cells
+				self.maxCloneSize = max(self.maxCloneSize, other.maxCloneSize)
+				cloneSizes = numpy.zeros(max(len(self.cloneSizes), len(other.cloneSizes)), dtype=numpy.int64)
+				cloneSizes[:len(self.cloneSizes)] += self.cloneSizes
+				cloneSizes[:len(other.cloneSizes)] += other.cloneSizes
+				self.cloneSizes = cloneSizes
+				self.receptorPairs.update(other.receptorPairs)
+				self.chainCounts.update(other.chainCounts)
+				self.noCDR3.update(other.noCDR3)
+				for key, counter in other.usage.items():
+						self.usage[key].update(counter)
+				for key, histogram in other.histograms.items():
+						self.addHistogram(key, histogram)
+				return self
+
+
+		# getDict - Return the summary as a dict, in the format described above
+		#
+		def getDict( self ):
+				self.flush()
+				chains = {}
+				for receptorType in sorted(self.chainCounts):
+						chain = { 'count': self.chainCounts[receptorType], 'no_cdr3': self.noCDR3[receptorType] }
+						for name in chainSegments:
+								chain[name] = dict(sorted(self.usage[(receptorType, name)].items()))
+						for name in chainHistograms:
+								chain[name] = self.histograms.get((receptorType, name), numpy.zeros(0, dtype=numpy.int64)).tolist()
+						chains[receptorType] = chain
+				return {
+						'format': summaryFormat,
+						'clones': self.clones,
+						'cells': self.cells,
+						'max_clone_size': self.maxCloneSize,
+						'clone_size_log2': self.cloneSizes.tolist(),
+						'receptor_pairs': dict(sorted(self.receptorPairs.items())),
+						'chains': chains,
+						}
+
+
+		# write - Write the summary to a JSON file
+		#
+		# Arguments:
+		# filename - Output file name
+		#
+		# Returns: nothing
+		#
+		def write( self, filename ):
+				with open(filename, 'w') as fp:
+						json.dump(self.getDict(), fp, sort_keys=True)
+						fp.write("\n")
+
+
+
+# getSummary - Return a tcrSummary holding the counts of a dict, as returned
+#              by tcrSummary.getDict()
+#
+def getSummary(values):
+		if values.get('format', None) != summaryFormat:
+				raise ValueError("Unsupported summary format %s" % values.get('format', None))
+		summary = tcrSummary()
+		summary.clones = values['clones']
+		summary.cells = values['cells']
+		summary.maxCloneSize = values['max_clone_size']
+		summary.cloneSizes = numpy.array(values['clone_size_log2'], dtype=numpy.int64)
+		summary.receptorPairs.update(values['receptor_pairs'])
+		for receptorType, chain in values['chains'].items():
+				summary.chainCounts[receptorType] = chain['count']
+				summary.noCDR3[receptorType] = chain['no_cdr3']
+				for name in chainSegments:
+						summary.usage[(receptorType, name)].update(chain[name])
+				for name in chainHistograms:
+						summary.histograms[(receptorType, name)] = numpy.array(chain[name], dtype=numpy.int64)
+		return summary
+
+
+# readSummary - Read a summary written by tcrSummary.write()
+#
+# Arguments:
+# filename - Summary file name
+#
+# Returns:
+# tcrSummary object
+#
+def readSummary(filename):
+		with open(filename) as fp:
+				return getSummary(json.load(fp))
+
+
+# mergeSummaries - Merge summary files, e.g. of the shards of a study
+#
+# Arguments:
+# filenames - List of summary file names
+#
+# Returns:
+# tcrSummary object
+#
+def mergeSummaries(filenames):
+		summary = tcrSummary()
+		for filename in filenames:
+				summary.merge(readSummary(filename))
+		return summary
@@ -0,0 +1,151 @@
+import re
+import os
+import shutil
+import numpy
+
+from .stigtools import tcrConfig
+
+# Synthetic reference generation
+#
+# STIG requires the reference chromosomes named in tcell_receptor.tsv to be
+# present in its working directory.  For benchmarking and testing where the
+# (multi-hundred MB) hg38 references are not available, the functions here
+# build a stand-in working directory: the allele files and recombination
+# probabilities are copied verbatim, and each chrN.fa is filled with random
+# sequence, with the allele sequences written in at their coordinates so that
+# DNA and RNA agree wherever the reference would.
+#
+
+
+# makeSyntheticReference - Build a synthetic working directory
+#
+# Arguments:
+# workingDir - A STIG working directory (e.g. 'data') providing
+#              tcell_receptor.tsv, tcell_recombination.yaml and allele/
+# outputDir  - Directory to write the synthetic working directory into.  It is
+#              created if it does not exist
+#
+# Optional arguments:
+# compact    - Boolean.  If True, each cluster of receptor segments (e.g. the
+#              TRB locus) is shifted down towards the start of its chromosome
+#              and the coordinates in tcell_receptor.tsv are rewritten to match.
+#              This keeps the relative layout of every segment while reducing
+#              the size of chr7.fa from ~145MB to a few MB.  Default is True
+# margin     - Integer.  Number of random bases kept around each cluster of
+#              segments, which supplies 5' and 3' UTR sequence.  Default 20000
+# lineLength - Integer.  FASTA line length.  Default is 60
+# seed       - Integer or None.  Seed for the random sequence
+#
+# Returns:
+# Dict of chromosome number (string) -> chromosome length
+#
+def makeSyntheticReference(workingDir, outputDir, compact=True, margin=20000, lineLength=60, seed=None):
+		if not os.path.isfile("%s/tcell_receptor.tsv" % workingDir):
+				raise ValueError("Could not locate T-cell receptor component file in working directory", workingDir)
+		if not os.path.isdir(outputDir):
+				os.makedirs(outputDir)
+
+		with open("%s/tcell_receptor.tsv" % workingDir) as fp:
+				lines = fp.read().split("\n")
+
+		# Collect the coordinates used on each chromosome
+		intervals = {}
+		for line in lines:
+				fields = line.split("\t")
+				if len(fields) != 15 or line.startswith('#'):
+						continue
+				chromosome = re.match(r'^\d+', fields[1])
+				coordinates = re.match(r'^(\d+)\.\.(\d+)$', fields[13])
+				if chromosome is None or coordinates is None:
+						continue
+				intervals.setdefault(chromosome.group(0), []).append((int(coordinates.group(1)), int(coordinates.group(2))))
+
+		# Cluster the coordinates on each chromosome and calculate the shift applied to each cluster
+		clusters = {}
+		for chromosome, chrIntervals in intervals.items():
+				chrIntervals.sort()
+				chrClusters = []
+				for start, end in chrIntervals:
+						if len(chrClusters) > 0 and start - chrClusters[-1][1] < 2 * margin:
+								chrClusters[-1][1] = max(chrClusters[-1][1], end)
+						else:
+								chrClusters.append([start, end])
+				cursor = margin + 1
+				for cluster in chrClusters:
+						shift = (cluster[0] - cursor) if compact is True else 0
+						cluster.append(shift)
+						cursor += cluster[1] - cluster[0] + 1 + 2 * margin
+				clusters[chromosome] = chrClusters
+
+		def shiftCoordinate(chromosome, position):
+				for start, end, shift in clusters[chromosome]:
+						if start <= position <= end:
+								return position - shift
+				raise ValueError("Coordinate outside of any cluster", chromosome, position)
+
+		# Rewrite the component file with the new coordinates
+		output = []
+		for line in lines:
+				fields = line.split("\t")
+				if len(fields) == 15 and not line.startswith('#'):
+						chromosome = re.match(r'^\d+', fields[1])
+						coordinates = re.match(r'^(\d+)\.\.(\d+)$', fields[13])
+						if chromosome is not None and coordinates is not None:
+								chromosome = chromosome.group(0)
+								fields[13] = "%d..%d" % (shiftCoordinate(chromosome, int(coordinates.group(1))),
+																				 shiftCoordinate(chromosome, int(coordinates.group(2))))
+								line = "\t".join(fields)
+				output.append(line)
+		with open("%s/tcell_receptor.tsv" % outputDir, 'w') as fp:
+				fp.write("\n".join(output))
+
+		# Copy the remaining inputs unchanged
+		shutil.copyfile("%s/tcell_recombination.yaml" % workingDir, "%s/tcell_recombination.yaml" % outputDir)
+		if os.path.isdir("%s/allele" % outputDir):
+				shutil.rmtree("%s/allele" % outputDir)
+		shutil.copytree("%s/allele" % workingDir, "%s/allele" % outputDir)
+
+		# Read the rewritten components and alleles so the allele sequences can be placed in the chromosomes
+		config = tcrConfig()
+		config.readTCRConfig("%s/tcell_receptor.tsv" % outputDir)
+		config.readAlleles(["%s/allele/%s" % (outputDir, x) for x in sorted(os.listdir("%s/allele" % outputDir)) if x.endswith('.fasta')])
+
+		rng = numpy.random.default_rng(seed)
+		nucleotides = numpy.frombuffer(b'ACGT', dtype=numpy.uint8)
+		complement = bytes.maketrans(b'ACGT', b'TGCA')
+		lengths = {}
+		for chromosome, chrClusters in clusters.items():
+				length = max(end - shift for start, end, shift in chrClusters) + margin
+				sequence = nucleotides[rng.integers(0, 4, length)]
+
+				for segment in config.receptorSegment:
+						if re.match(r'^\d+', segment['chromosome']).group(0) != chromosome or 'allele' not in segment:
+								continue
+						alleles = sorted(segment['allele'].keys())
+						allele = segment['allele'][alleles[0]].upper().encode()
+						start = segment['start_position']
+						end = segment['end_position']
+						if segment['region'] == 'EX1' and len(allele) == end - start:
+								# EX1 alleles omit their first base, which is given with the J-REGION allele
+								if segment['strand'] == 'forward':
+										start += 1
+								else:
+										end -= 1
+						if len(allele) != end - start + 1:
+								continue # e.g. L-PART1+L-PART2, whose allele excludes the intron
+						if segment['strand'] == 'reverse':
+								allele = allele.translate(complement)[::-1]
+						sequence[start - 1:end] = numpy.frombuffer(allele, dtype=numpy.uint8)
+
+				fullLines = length // lineLength
+				body = numpy.empty((fullLines, lineLength + 1), dtype=numpy.uint8)
+				body[:, :lineLength] = sequence[:fullLines * lineLength].reshape(fullLines, lineLength)
+				body[:, lineLength] = ord("\n")
+				with open("%s/chr%s.fa" % (outputDir, chromosome), 'wb') as fp:
+						fp.write(b'>chr' + chromosome.encode() + b"\n")
+						fp.write(body.tobytes())
+						if length % lineLength > 0:
+								fp.write(sequence[fullLines * lineLength:].tobytes() + b"\n")
+				lengths[chromosome] = length
+
+		return lengths
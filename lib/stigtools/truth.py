@@ -0,0 +1,161 @@
+# Read truth files
+#
+# Each simulated read is taken from a known position of a known chain, which
+# is otherwise only recorded (in part) in its FASTQ comment.  With stig
+# --truth, the origin of every read is written to BASENAME.truth.tsv as reads
+# are generated, so simulated data can be scored without aligning it.  Each
+# line describes one read (one line for single reads, one for each mate of
+# paired and amplicon reads), with the tab-separated columns:
+#
+#   read        Read number, as in the FASTQ comment (readnum=)
+#   mate        1, or 2 for the second read of a pair
+#   clone       Index of the clone in the repertoire (clone=)
+#   chain       1 or 2, the clone's chain read from
+#   type        Receptor type of the chain, A, B, G or D (chain=)
+#   strand      + if the read is the chain's sequence, - if it is the reverse
+#               complement (the second read of a pair or amplicon)
+#   start, end  Span of the read along the chain's DNA or RNA, counted from 0
+#               at its 5' end, end exclusive.  Spans reaching into the UTRs
+#               start before 0, or end after the length of the chain
+#   utr5, utr3  Number of bases of the read from the 5' and 3' UTRs
+#   chromosome, ref_5p, ref_3p
+#               Chromosome, and reference coordinates of the 5' and 3' ends
+#               of the chain, as for the sequences of the statistics file
+#   V, D, J, C  Alleles of the chain (D is . for alpha and gamma chains)
+#   regions     The regions of the chain covered by the read, 5' to 3' along
+#               the chain, as REGION:OFFSET:LENGTH, separated by commas.
+#               REGION is one of 5UTR, V (including the leader and, in DNA,
+#               the V intron), N1, D, N2, J, JC (J-C intervening DNA), C or
+#               3UTR.  OFFSET is the position in the region of its first base
+#               covered, counted from the region's 5' end (for 5UTR, from the
+#               start of the chain, so offsets are negative)
+#
+# For reads on the - strand, read base i is base end - 1 - i of the chain.
+# Single-cell reads (see singlecell.py) are described likewise, but the first
+# read begins with the cell barcode and UMI, which start and end leave out.
+# Clones saved by earlier versions of STIG, which have no chain records, have
+# regions and alleles given as '.'.
+#
+# Reads are not given reference coordinates of their own: chromosome, ref_5p
+# and ref_3p are those of the whole chain, so a read of a spliced RNA chain,
+# or a DNA read across the V-D-J junction, cannot be placed on the reference
+# from its start and end.  The regions column, with the alleles, places it
+# within each receptor segment instead; N1 and N2 have no reference position,
+# and the sequence of an allele may differ from the reference it replaces.
+#
+
+
+class tcrTruthWriter:
+
+		columns = ('read', 'mate', 'clone', 'chain', 'type', 'strand', 'start', 'end', 'utr5', 'utr3',
+							 'chromosome', 'ref_5p', 'ref_3p', 'V', 'D', 'J', 'C', 'regions')
+
+		# Arguments:
+		# repertoire - tcrRepertoire the reads are taken from
+		# space      - 'dna' or 'rna', as given to tcrRepertoire.simulateRead()
+		# readType   - 'single', 'paired' or 'amplicon'
+		#
+		def __init__( self, repertoire, space, readType ):
+				self.repertoire = repertoire
+				self.config = repertoire.config
+				self.space = space
+				self.readType = readType
+				# (clone, chain) -> chain layout, see getChainLayout()
+				self.layouts = {}
+
+
+		# getHeader - Return the header line of the truth file
+		#
+		def getHeader( self ):
+				return '\t'.join(self.columns) + "\n"
+
+
+		# getChainLayout - Return the layout of a chain of a clone, i.e. the
+		#                  span of each of its regions, and its coordinates
+		#
+		# Arguments:
+		# clone - Index of the clone
+		# chain - 1 or 2
+		#
+		# Returns:
+		# 4-tuple of the length of the chain's sequence, a list of 3-tuples
+		# (region, start, end), the columns chromosome to C (see above) as strings,
+		# and the receptor type
+		#
+		def getChainLayout( self, clone, chain ):
+				layout = self.layouts.get((clone, chain), None)
+				if layout is not None:
+						return layout
+
+				tcr = self.repertoire.repertoire[clone]
+				name = str(chain)
+				sequence = getattr(tcr, self.space.upper() + name)
+				record = getattr(tcr, 'chain' + name)
+				segments = [ getattr(tcr, x + name) for x in ('V', 'D', 'J', 'C') ]
+				regions = []
+				if record is not None and len(tcr.sequences) == 0:
+						position = 0
+						for region, part in self.config.getChainParts(record, self.space):
+								regions.append((region, position, position + len(part)))
+								position += len(part)
+						alleles = [ '.' if x is None else self.config.getAlleleName(x) for x in segments ]
+				else:
+						alleles = [ '.' ] * 4
+				columns = [ str(sequence[0]), str(sequence[1]), str(sequence[4]) ] + alleles
+				layout = (len(sequence[3]), regions, columns, getattr(tcr, 'type' + name))
+				self.layouts[(clone, chain)] = layout
+				return layout
+
+
+		# getRegions - Return the regions column of a read, see above
+		#
+		# Arguments:
+		# length  - Length of the chain's sequence
+		# regions - List of (region, start, end), see getChainLayout()
+		# start   - Start of the read along the chain
+		# end     - End of the read along the chain, exclusive
+		#
+		def getRegions( self, length, regions, start, end ):
+				if len(regions) == 0:
+						return '.'
+				covered = []
+				if start < 0:
+						covered.append("5UTR:%d:%d" % (start, min(end, 0) - start))
+				for region, regionStart, regionEnd in regions:
+						first = max(start, regionStart)
+						last = min(end, regionEnd)
+						if last > first:
+								covered.append("%s:%d:%d" % (region, first - regionStart, last - first))
+				if end > length:
+						first = max(start, length)
+						covered.append("3UTR:%d:%d" % (first - length, end - first))
+				return ','.join(covered)
+
+
+		# getLines - Format the truth of a list of reads
+		#
+		# Arguments:
+		# truth      - List of records appended by tcrRepertoire.simulateRead()
+		# first_read - Number of the first read
+		#
+		# Returns:
+		# String of lines, one per read or mate
+		#
+		def getLines( self, truth, first_read=0 ):
+				lines = []
+				for readNumber, (clone, chain, start, length, read1Length, read2Length) in enumerate(truth, first_read):
+						chainLength, regions, columns, receptorType = self.getChainLayout(clone, chain)
+						if self.readType == 'single':
+								mates = [ (1, '+', start, start + length) ]
+						elif self.readType == 'paired':
+								mates = [ (1, '+', start, start + read1Length), (2, '-', start + length - read2Length, start + length) ]
+						else:
+								mates = [ (1, '+', start, start + length), (2, '-', start, start + length) ]
+
+						for mate, strand, mateStart, mateEnd in mates:
+								utr5 = max(0, min(mateEnd, 0) - mateStart)
+								utr3 = max(0, mateEnd - max(mateStart, chainLength))
+								lines.append('\t'.join([ str(readNumber), str(mate), str(clone), str(chain), receptorType, strand,
+																				 str(mateStart), str(mateEnd), str(utr5), str(utr3) ] + columns +
+																			 [ self.getRegions(chainLength, regions, mateStart, mateEnd) ]))
+				return "\n".join(lines) + "\n" if len(lines) > 0 else ''
@@ -1,12 +1,23 @@
 #! /usr/bin/python3
 
 import stigtools
+import stigtools.batch
+import stigtools.cli
+import stigtools.equivalence
+import stigtools.statsfile
 import unittest
 import tempfile
 import os
 import re
 import pprint
 import logging
+import pickle
+import shutil
+import json
+import io
+import collections
+import gzip
+import numpy
 
 config_iterations = 100
 
@@ -246,6 +257,988 @@ class TestTcrConfig_recombinate(unittest.TestCase):
 				self.assertTrue("Recombinate failed too many times, perhaps retry unit tests?" == '')
 
 
+class TestTcrConfig_referenceFree(unittest.TestCase):
+		def setUp(self):
+				(self.tempfilehandle, self.tempfilename) = tempfile.mkstemp()
+				self.config = stigtools.tcrConfig(log = myLog.getChild('tcrConfig'))
+				self.config.setWorkingDir('./data', reference=False)
+
+		def tearDown(self):
+				os.close(self.tempfilehandle)
+				os.remove(self.tempfilename)
+
+		def test_no_reference(self):
+				self.assertFalse(self.config.hasReference())
+				self.assertEqual(self.config.utrPolicy, 'clip')
+				with self.assertRaises(ValueError):
+						self.config.readChromosome(7, 1, 10, 'forward')
+				with self.assertRaises(ValueError):
+						self.config.setUTRPolicy('reference')
+
+		def test_rna_without_chromosome(self):
+				# RNA is assembled from the alleles alone, so generating clones should not touch the reference
+				clone = stigtools.tcr(0.5, self.config)
+				clone.randomize()
+				self.assertTrue(re.match('^ATG([CTAG]{3})+$', clone.RNA1[3]))
+				self.assertTrue(re.match('^ATG([CTAG]{3})+$', clone.RNA2[3]))
+				with self.assertRaises(ValueError):
+						clone.DNA1
+
+		def test_utr_fasta(self):
+				window = 'ACGTTGCAAC' * 3
+				os.write(self.tempfilehandle, str.encode(">chr7:101-130\n%s\n%s\n" % (window[:20], window[20:])))
+				self.config.setUTRPolicy('fasta', self.tempfilename)
+				self.assertEqual(self.config.readUTR(7, 101, 130, 'forward'), window)
+				self.assertEqual(self.config.readUTR(7, 105, 110, 'forward'), window[4:10])
+				self.assertEqual(self.config.readUTR(7, 105, 110, 'reverse'), self.config.reverseComplement(window[4:10]))
+				with self.assertRaises(ValueError):
+						self.config.readUTR(7, 125, 135, 'forward')
+				with self.assertRaises(ValueError):
+						self.config.readUTR(14, 105, 110, 'forward')
+
+		def test_clipped_reads(self):
+				repertoire = stigtools.tcrRepertoire(self.config, 3)
+				repertoire.populate(30, 'equal')
+				for read, comment in repertoire.simulateRead(50, 'rna', read_length_mean=30, read_length_sd=0):
+						clone = repertoire.repertoire[int(re.search(':clone=(\\d+)', comment).group(1))]
+						self.assertEqual(len(read), 30)
+						self.assertTrue(read in clone.RNA1[3] or read in clone.RNA2[3])
+
+
+class TestTcrRepertoire_populate(unittest.TestCase):
+		def setUp(self):
+				self.config = stigtools.tcrConfig()
+				self.repertoire = stigtools.tcrRepertoire(self.config, 0)
+				self.repertoire.repertoire = [None] * 7
+
+		def test_population_size(self):
+				for distribution in self.repertoire.distribution_options:
+						for size in (1, 7, 1000, 10**9):
+								self.repertoire.populate(size, distribution)
+								self.assertEqual(len(self.repertoire.population), 7)
+								self.assertEqual(sum(self.repertoire.population), size)
+								self.assertTrue(min(self.repertoire.population) >= 0)
+
+		def test_stripe(self):
+				self.repertoire.populate(26, 'stripe')
+				self.assertEqual(list(self.repertoire.population), [4, 4, 4, 4, 4, 3, 3])
+
+		def test_invalid_parameters(self):
+				with self.assertRaises(ValueError):
+						self.repertoire.populate(100, 'unimodal', g_cutoff=0)
+				with self.assertRaises(ValueError):
+						self.repertoire.populate(100, 'chisquare', cs_k=0)
+				with self.assertRaises(ValueError):
+						self.repertoire.populate(100, 'logisticcdf', l_scale=-1)
+
+
+class TestTcrProfile(unittest.TestCase):
+		def test_disabled(self):
+				profile = stigtools.tcrProfile()
+				with profile.stage('stage'):
+						profile.count('counter')
+				report = profile.getReport()
+				self.assertEqual(len(report['stages']), 0)
+				self.assertEqual(len(report['counters']), 0)
+
+		def test_recombination_counters(self):
+				config = stigtools.tcrConfig()
+				config.setWorkingDir('./data', reference=False)
+				config.profile.enabled = True
+				with config.profile.stage('recombinate'):
+						for i in range(0, 20):
+								V = config.chooseRandomSegment('A', componentName='V')
+								J = config.chooseRandomSegment('A', componentName='J', V=V)
+								C = config.chooseRandomSegment('A', componentName='C', V=V, J=J)
+								config.recombinateChain(V, None, J, C)
+				report = config.profile.getReport()
+				counters = report['counters']
+				self.assertEqual(report['stages']['recombinate']['calls'], 1)
+				self.assertEqual(counters['recombinate.attempts.A'], 20)
+				self.assertEqual(counters.get('recombinate.accepted.A', 0) +
+												 sum(counters.get('recombinate.rejected.%s' % x, 0) for x in ('frame', 'stop', 'cdr3')), 20)
+
+
+class TestTcrRandom(unittest.TestCase):
+		def test_seed(self):
+				values = []
+				for i in range(0, 2):
+						rng = stigtools.tcrRandom(seed=5, size=16)
+						values.append([ rng.random() for j in range(0, 40) ] + [ rng.nucleotides(30), rng.normal(10, 2), rng.uniforms(20) ])
+				self.assertEqual(values[0], values[1])
+				rng.seed(6)
+				self.assertNotEqual(rng.random(), values[0][0])
+
+		def test_ranges(self):
+				rng = stigtools.tcrRandom(size=64)
+				bases = rng.nucleotides(1000)
+				self.assertEqual(len(bases), 1000)
+				self.assertEqual(set(bases), set('CATG'))
+				self.assertEqual(rng.nucleotides(0), '')
+				draws = [ rng.randrange(-3, 4) for i in range(0, 1000) ]
+				self.assertEqual(set(draws), set(range(-3, 4)))
+				self.assertTrue(all(0 <= x < 1 for x in rng.uniforms(500)))
+				sequence = list(range(0, 50))
+				rng.shuffle(sequence)
+				self.assertEqual(sorted(sequence), list(range(0, 50)))
+
+		def test_state(self):
+				rng = stigtools.tcrRandom(seed=5, size=16)
+				for i in range(0, 7):
+						rng.random()
+				rng.nucleotides(5), rng.normal(0, 1), rng.uniforms(3)
+				state = json.loads(json.dumps(rng.getState()))
+				expected = [ rng.random() for i in range(0, 40) ] + [ rng.nucleotides(30), rng.normal(10, 2), rng.uniforms(20) ]
+				restored = stigtools.tcrRandom()
+				restored.setState(state)
+				self.assertEqual([ restored.random() for i in range(0, 40) ] + [ restored.nucleotides(30), restored.normal(10, 2), restored.uniforms(20) ], expected)
+
+
+class TestTcrProgress(unittest.TestCase):
+		def setUp(self):
+				(self.tempfilehandle, self.tempfilename) = tempfile.mkstemp()
+
+		def tearDown(self):
+				os.close(self.tempfilehandle)
+				os.remove(self.tempfilename)
+
+		def test_status_file(self):
+				config = stigtools.tcrConfig()
+				config.setWorkingDir('./data', reference=False)
+				config.progress = stigtools.tcrProgress(interval=0, filename=self.tempfilename, batch=10)
+				repertoire = stigtools.tcrRepertoire(config, 2)
+				repertoire.populate(10, 'equal')
+				repertoire.simulateRead(25, 'rna', read_length_sd=0)
+				config.progress.close()
+				with open(self.tempfilename) as fp:
+						statuses = [ json.loads(x) for x in fp ]
+				finished = [ (x['stage'], x['done']) for x in statuses if x['finished'] is True ]
+				self.assertEqual(finished, [ ('tcrRepertoire', 2), ('populate', 10), ('simulateRead', 25) ])
+				self.assertEqual([ x['done'] for x in statuses if x['stage'] == 'simulateRead' ], [ 10, 20, 25 ])
+
+		def test_rejected_reads(self):
+				# Amplicon reads of chains without the probe are rejected, and are not counted
+				config = stigtools.tcrConfig()
+				config.setWorkingDir('./data', reference=False)
+				config.profile = stigtools.tcrProfile(enabled=True)
+				config.progress = stigtools.tcrProgress(interval=0, filename=self.tempfilename, batch=10)
+				repertoire = stigtools.tcrRepertoire(config, 4)
+				repertoire.populate(20, 'equal')
+				repertoire.simulateRead(100, 'rna', read_length_mean=48, read_length_sd=0, read_type='amplicon')
+				config.progress.close()
+				self.assertGreater(config.profile.counters['simulateRead.rejected.probe'], 0)
+				with open(self.tempfilename) as fp:
+						statuses = [ json.loads(x) for x in fp if json.loads(x)['stage'] == 'simulateRead' ]
+				self.assertTrue(all(x['done'] <= x['total'] for x in statuses))
+				self.assertEqual([ x['done'] for x in statuses ], list(range(10, 101, 10)) + [ 100 ])
+
+		def test_out_of_core(self):
+				# The empty repertoire the clones are written from reports no stage of its own
+				config = stigtools.tcrConfig()
+				config.setWorkingDir('./data', reference=False)
+				config.progress = stigtools.tcrProgress(interval=0, filename=self.tempfilename, batch=10)
+				stigtools.buildRepertoire(config, 5, self.tempfilename + '.bin', blockSize=2)
+				os.remove(self.tempfilename + '.bin')
+				config.progress.close()
+				with open(self.tempfilename) as fp:
+						statuses = [ json.loads(x) for x in fp ]
+				self.assertEqual([ (x['stage'], x['total'], x['done']) for x in statuses if x['finished'] is True ], [ ('tcrRepertoire', 5, 5) ])
+
+
+class TestTcrRepertoire_trace(unittest.TestCase):
+		def test_trace(self):
+				config = stigtools.tcrConfig()
+				config.setWorkingDir('./data', reference=False)
+				trace = io.StringIO()
+				repertoire = stigtools.tcrRepertoire(config, 3, uniqueCDR3=True, trace=trace)
+				records = [ json.loads(x) for x in trace.getvalue().splitlines() ]
+				self.assertEqual([ x['clone'] for x in records ], [ 0, 1, 2 ])
+				for record, clone in zip(records, repertoire.repertoire):
+						self.assertEqual([ x['cdr3'] for x in record['chains'] ], clone.getCDR3Sequences())
+						self.assertEqual([ x['type'] for x in record['chains'] ], [ clone.type1, clone.type2 ])
+						self.assertTrue(all(x['attempts'] >= 1 for x in record['chains']))
+
+		def test_log_levels(self):
+				log = logging.getLogger('test.levels')
+				log.setLevel(logging.INFO)
+				config = stigtools.tcrConfig(log=log)
+				self.assertTrue(config.logInfo)
+				self.assertFalse(config.logDebug)
+				self.assertFalse(stigtools.tcrConfig().logInfo)
+
+
+class TestStatisticsFile(unittest.TestCase):
+		def setUp(self):
+				self.tempdir = tempfile.mkdtemp()
+				self.config = stigtools.tcrConfig()
+				self.config.setWorkingDir('./data', reference=False)
+				self.repertoire = stigtools.tcrRepertoire(self.config, 4)
+				self.repertoire.populate(20, 'stripe')
+
+		def tearDown(self):
+				shutil.rmtree(self.tempdir)
+
+		def test_formats(self):
+				expected = [ ",".join(str(e) for e in x) for x in self.repertoire.getStatistics(addHeader = True) ]
+				filename = os.path.join(self.tempdir, 'stats.csv')
+				stigtools.writeStatistics(self.repertoire, filename, batchSize=3)
+				with open(filename) as fp:
+						self.assertEqual(fp.read().splitlines(), expected)
+				filename = os.path.join(self.tempdir, 'stats.csv.gz')
+				stigtools.writeStatistics(self.repertoire, filename, format='csv.gz', sequences=False)
+				with gzip.open(filename, 'rt') as fp:
+						lines = fp.read().splitlines()
+				self.assertEqual(lines[0], "CLONE,CELL_COUNT,VALLELE_1, JALLELE_1, CDR3_1, VALLELE_2, JALLELE_2, CDR3_2")
+				self.assertEqual(lines[1].split(','), [ x for i, x in enumerate(expected[1].split(',')) if i not in (5, 6, 10, 11) ])
+
+				filename = os.path.join(self.tempdir, 'stats.npz')
+				stigtools.writeStatistics(self.repertoire, filename, format='npz')
+				arrays = numpy.load(filename)
+				self.assertEqual(list(arrays['CELL_COUNT']), [ 5, 5, 5, 5 ])
+				for i, clone in enumerate(self.repertoire.repertoire):
+						self.assertEqual(arrays['CDR3_2'][i].decode('ascii'), clone.getCDR3Sequences()[1])
+						start, end = arrays['RNA_1_offset'][i:i + 2]
+						self.assertEqual(arrays['RNA_1_sequence'][start:end].tobytes().decode('ascii'), clone.RNA1[3])
+
+				# Columns encoded in batches are the same as those encoded at once
+				batched = stigtools.statsfile.getStatisticsArrays(self.repertoire, True, batchSize=3)
+				self.assertEqual(sorted(batched), sorted(arrays.files))
+				for name in arrays.files:
+						self.assertEqual(batched[name].dtype, arrays[name].dtype)
+						self.assertTrue(numpy.array_equal(batched[name], arrays[name]))
+
+
+class TestTcrSummary(unittest.TestCase):
+		def setUp(self):
+				(self.tempfilehandle, self.tempfilename) = tempfile.mkstemp()
+				self.config = stigtools.tcrConfig()
+				self.config.setWorkingDir('./data', reference=False)
+				self.repertoire = stigtools.tcrRepertoire(self.config, 6, AB_frequency=0.5)
+				self.repertoire.populate(40, 'equal')
+
+		def tearDown(self):
+				os.close(self.tempfilehandle)
+				os.remove(self.tempfilename)
+
+		def test_summary(self):
+				summary = self.repertoire.summary.getDict()
+				self.assertEqual(summary['clones'], 6)
+				self.assertEqual(summary['cells'], 40)
+				self.assertEqual(sum(summary['receptor_pairs'].values()), 6)
+				self.assertEqual(sum(summary['clone_size_log2']), 6)
+				lengths = collections.Counter()
+				for clone in self.repertoire.repertoire:
+						for receptorType, cdr3 in zip((clone.type1, clone.type2), clone.getCDR3Sequences()):
+								lengths[(receptorType, len(cdr3))] += 1
+				for receptorType, chain in summary['chains'].items():
+						self.assertEqual(sum(chain['V'].values()), chain['count'])
+						self.assertEqual(sum(chain['j_chewback']), chain['count'])
+						for length, count in enumerate(chain['cdr3_length']):
+								self.assertEqual(count, lengths[(receptorType, length)])
+
+				# Summaries of a loaded repertoire, and of files, give the same counts
+				other = stigtools.tcrSummary(self.config)
+				other.addRepertoire(self.repertoire)
+				self.assertEqual(other.getDict(), summary)
+				self.repertoire.summary.write(self.tempfilename)
+				self.assertEqual(stigtools.readSummary(self.tempfilename).getDict(), summary)
+
+				merged = stigtools.mergeSummaries([ self.tempfilename, self.tempfilename ]).getDict()
+				self.assertEqual(merged['clones'], 12)
+				self.assertEqual(merged['max_clone_size'], summary['max_clone_size'])
+				for receptorType, chain in merged['chains'].items():
+						self.assertEqual(chain['cdr3_length'], [ 2 * x for x in summary['chains'][receptorType]['cdr3_length'] ])
+						self.assertEqual(chain['V'], dict((k, 2 * v) for k, v in summary['chains'][receptorType]['V'].items()))
+
+
+class TestReverseComplement(unittest.TestCase):
+		def test_types(self):
+				config = stigtools.tcrConfig()
+				self.assertEqual(config.reverseComplement('ACCTGU'), 'ACAGGT')
+				self.assertEqual(config.reverseComplement(b'ACCTGU'), b'ACAGGT')
+				self.assertEqual(config.reverseComplement(bytearray(b'GGA')), b'TCC')
+
+
+class TestTcrReadPipeline(unittest.TestCase):
+		def setUp(self):
+				self.config = stigtools.tcrConfig()
+				self.config.setWorkingDir('./data', reference=False)
+				self.repertoire = stigtools.tcrRepertoire(self.config, 5)
+				self.repertoire.populate(100, 'stripe')
+
+		def getOutput(self, processes):
+				degrade = { 'method': 'phred', 'variability': 0.2, 'baseError': 0, 'L': 0, 'k': 0, 'midpoint': 0,
+										'phred1': [ 'IIII5555' ], 'phred2': [ '55554444' ] }
+				pipeline = stigtools.tcrReadPipeline(self.repertoire, 'rna', { 'read_type': 'paired', 'read_length_mean': 20 },
+																						 degrade=degrade, processes=processes, chunkSize=7, seed=11)
+				outputs = [ io.BytesIO() for i in range(0, 4) ]
+				pipeline.run(50, outputs[0:2], outputs[2:4])
+				return [ x.getvalue() for x in outputs ]
+
+		def test_deterministic(self):
+				output = self.getOutput(1)
+				self.assertEqual(self.getOutput(3), output)
+				for fastq in output:
+						lines = fastq.decode('ascii').splitlines()
+						self.assertEqual(len(lines), 200)
+						self.assertEqual([ int(re.search('readnum=(\\d+)', x).group(1)) for x in lines[0::4] ], list(range(0, 50)))
+				self.assertTrue(output[2].startswith(b'@STIG_DEGRADED'))
+
+
+class TestTruth(unittest.TestCase):
+		def test_paired(self):
+				config = stigtools.tcrConfig()
+				config.setWorkingDir('./data', reference=False)
+				repertoire = stigtools.tcrRepertoire(config, 4)
+				repertoire.populate(20, 'stripe')
+				truth = []
+				reads = repertoire.simulateRead(40, 'rna', read_type='paired', read_length_mean=30, insert_length_mean=60, first_read=5, truth=truth)
+				writer = stigtools.tcrTruthWriter(repertoire, 'rna', 'paired')
+				lines = [ dict(zip(writer.columns, x.split('\t'))) for x in writer.getLines(truth, 5).splitlines() ]
+				self.assertEqual(len(lines), 80)
+				for line, mate in zip(lines, [ x for (pair, comment) in reads for x in pair ]):
+						self.assertEqual(line['read'], re.search('readnum=(\\d+)', reads[int(line['read']) - 5][1]).group(1))
+						sequence = getattr(repertoire.repertoire[int(line['clone'])], 'RNA' + line['chain'])[3]
+						start, end = int(line['start']), int(line['end'])
+						self.assertEqual((line['utr5'], line['utr3']), ('0', '0'))
+						expected = sequence[start:end]
+						self.assertEqual(mate, expected if line['strand'] == '+' else config.reverseComplement(expected))
+						regions = [ x.split(':') for x in line['regions'].split(',') ]
+						self.assertEqual(sum(int(x[2]) for x in regions), end - start)
+
+		def test_pipeline(self):
+				config = stigtools.tcrConfig()
+				config.setWorkingDir('./data', reference=False)
+				repertoire = stigtools.tcrRepertoire(config, 4)
+				repertoire.populate(20, 'stripe')
+				output = []
+				for processes in (1, 2):
+						pipeline = stigtools.tcrReadPipeline(repertoire, 'rna', { 'read_length_mean': 20 }, processes=processes, chunkSize=6, seed=3, truth=True)
+						truth = io.BytesIO()
+						pipeline.run(20, [ io.BytesIO() ], truthOutput=truth)
+						output.append(truth.getvalue().decode('ascii').splitlines())
+				self.assertEqual(output[0], output[1])
+				self.assertEqual(output[0][0].split('\t'), list(stigtools.tcrTruthWriter.columns))
+				self.assertEqual([ int(x.split('\t')[0]) for x in output[0][1:] ], list(range(0, 20)))
+
+
+class TestCoverage(unittest.TestCase):
+		def setUp(self):
+				self.tempdir = tempfile.mkdtemp()
+				self.config = stigtools.tcrConfig()
+				self.config.setWorkingDir('./data', reference=False)
+				self.repertoire = stigtools.tcrRepertoire(self.config, 4)
+				self.repertoire.populate(20, 'stripe')
+
+		def tearDown(self):
+				shutil.rmtree(self.tempdir)
+
+		def test_paired(self):
+				truth = []
+				self.repertoire.simulateRead(200, 'rna', read_type='paired', read_length_mean=60, insert_length_mean=120, truth=truth)
+				coverage = stigtools.tcrCoverage(self.repertoire, 'rna', 'paired', bufferSize=16)
+				coverage.add(truth)
+				expected = collections.defaultdict(lambda: collections.Counter())
+				spanning = collections.Counter()
+				for clone, chain, start, length, read1Length, read2Length in truth:
+						tcr = self.repertoire.repertoire[clone]
+						sequence = getattr(tcr, 'RNA' + str(chain))[3]
+						cdr3 = tcr.getCDR3Sequences()[chain - 1]
+						cdr3Start = sequence.find(cdr3)
+						spans = False
+						for mateStart, mateEnd in ((start, start + read1Length), (start + length - read2Length, start + length)):
+								expected[(clone, chain)].update(range(max(0, mateStart), min(len(sequence), mateEnd)))
+								spans |= mateStart <= cdr3Start and mateEnd >= cdr3Start + len(cdr3)
+						spanning[(clone, chain)] += spans
+				self.assertGreater(sum(spanning.values()), 0)
+				for (clone, chain), counts in expected.items():
+						depth = coverage.getCoverage(clone, chain)
+						self.assertEqual(depth.tolist(), [ counts[x] for x in range(0, len(depth)) ])
+						self.assertEqual(coverage.cdr3Reads[coverage.chains[(clone, chain)]], spanning[(clone, chain)])
+				self.assertEqual(int(coverage.reads.sum()), 200)
+
+		def test_merge(self):
+				truth = []
+				self.repertoire.simulateRead(40, 'rna', read_length_mean=20, truth=truth)
+				whole = stigtools.tcrCoverage(self.repertoire, 'rna')
+				whole.add(truth)
+				filenames = []
+				for i, shard in enumerate((truth[:15], truth[15:])):
+						coverage = stigtools.tcrCoverage(self.repertoire, 'rna')
+						coverage.add(shard)
+						filenames.append(os.path.join(self.tempdir, '%d.coverage.npz' % i))
+						coverage.write(filenames[-1])
+				merged = stigtools.mergeCoverage(filenames).getArrays()
+				for name, array in whole.getArrays().items():
+						self.assertEqual(array.tolist(), merged[name].tolist())
+
+		def test_pipeline(self):
+				arrays = []
+				for processes in (1, 2):
+						pipeline = stigtools.tcrReadPipeline(self.repertoire, 'rna', { 'read_length_mean': 20, 'read_length_sd': 0 }, processes=processes, chunkSize=6, seed=3, coverage=True)
+						pipeline.run(20, [ io.BytesIO() ])
+						arrays.append(pipeline.coverage.getArrays())
+				for name in arrays[0]:
+						self.assertEqual(arrays[0][name].tolist(), arrays[1][name].tolist())
+				self.assertEqual(int(arrays[0]['reads'].sum()), 20)
+				self.assertEqual(int(arrays[0]['coverage'].sum()), 20 * 20)
+
+
+class StoppedRun(Exception):
+		pass
+
+class TestSingleCell(unittest.TestCase):
+		def setUp(self):
+				self.tempdir = tempfile.mkdtemp()
+				self.config = stigtools.tcrConfig()
+				self.config.setWorkingDir('./data', reference=False)
+				self.repertoire = stigtools.tcrRepertoire(self.config, 5)
+				self.repertoire.populate(100, 'stripe')
+
+		def tearDown(self):
+				shutil.rmtree(self.tempdir)
+
+		def test_cells(self):
+				cells = stigtools.tcrCells(self.repertoire, 60, barcodeLength=4, umiLength=6, umis=2)
+				self.assertEqual(len(set(cells.barcodes.tolist())), 60)
+				self.assertTrue(all(x <= y for x, y in zip(numpy.bincount(cells.clones, minlength=5).tolist(), self.repertoire.population)))
+				self.assertTrue(numpy.all(cells.molecules >= 1))
+				self.assertEqual(len(cells.getUMI(12345)), 6)
+				filename = os.path.join(self.tempdir, 'cells.tsv')
+				cells.write(filename, blockSize=7)
+				with open(filename) as fp:
+						lines = [ x.split('\t') for x in fp.read().splitlines() ]
+				self.assertEqual(lines[0], list(stigtools.tcrCells.columns))
+				self.assertEqual([ x[1] for x in lines[1:] ], [ cells.getBarcode(i) for i in range(0, 60) ])
+				self.assertEqual([ int(x[2]) for x in lines[1:] ], cells.clones.tolist())
+				with self.assertRaises(ValueError):
+						stigtools.tcrCells(self.repertoire, 200)
+				with self.assertRaises(ValueError):
+						stigtools.tcrCells(self.repertoire, 60, barcodeLength=3)
+
+		def test_reads(self):
+				cells = stigtools.tcrCells(self.repertoire, 20, umiLength=8)
+				truth = []
+				reads = self.repertoire.simulateRead(200, 'rna', read_type='paired', read_length_mean=20, read_length_sd=0, insert_length_mean=60, truth=truth, cells=cells)
+				umis = collections.defaultdict(set)
+				for ((read1, read2), comment), record in zip(reads, truth):
+						fields = dict(x.split('=') for x in comment.split(':')[1:])
+						cell = int(fields['cell'])
+						self.assertEqual(fields['barcode'], cells.getBarcode(cell))
+						self.assertEqual(int(fields['clone']), cells.clones[cell])
+						self.assertEqual(record[0], cells.clones[cell])
+						self.assertEqual(read1[:24], fields['barcode'] + fields['umi'])
+						self.assertEqual((len(read1), len(read2)), (44, 20))
+						umis[(cell, record[1])].add(fields['umi'])
+				self.assertTrue(all(len(umis[x]) <= cells.molecules[x[0], x[1] - 1] for x in umis))
+
+
+class TestEquivalence(unittest.TestCase):
+		def test_chi_square(self):
+				statistic, p, freedom = stigtools.equivalence.chiSquareTest({ 'a': 10, 'b': 20 }, { 'a': 20, 'b': 10 })
+				self.assertAlmostEqual(statistic, 20 / 3.0)
+				self.assertAlmostEqual(p, 0.0098232745, places=6)
+				self.assertEqual(freedom, 1)
+				generator = numpy.random.default_rng(3)
+				same = [ collections.Counter(generator.integers(0, 10, 5000).tolist()) for i in range(0, 2) ]
+				self.assertGreater(stigtools.equivalence.chiSquareTest(*same)[1], 0.001)
+				shifted = collections.Counter(generator.integers(1, 11, 5000).tolist())
+				self.assertLess(stigtools.equivalence.chiSquareTest(same[0], shifted)[1], 1e-6)
+				# Rare categories are pooled
+				self.assertEqual(stigtools.equivalence.chiSquareTest({ 'a': 100, 'b': 100, 'c': 1 }, { 'a': 100, 'b': 100, 'd': 2 })[2], 2)
+				with self.assertRaises(ValueError):
+						stigtools.equivalence.chiSquareTest({ 'a': 1 }, {})
+
+		def test_ks(self):
+				generator = numpy.random.default_rng(3)
+				sample = generator.normal(0, 1, 2000)
+				self.assertEqual(stigtools.equivalence.ksTest(sample, sample), (0.0, 1.0))
+				self.assertGreater(stigtools.equivalence.ksTest(sample, generator.normal(0, 1, 1000))[1], 0.001)
+				self.assertLess(stigtools.equivalence.ksTest(sample, generator.normal(0.3, 1, 1000))[1], 1e-6)
+
+		def test_load_engine(self):
+				dirname = os.path.dirname(os.path.dirname(os.path.abspath(stigtools.__file__)))
+				engine = stigtools.equivalence.loadEngine(dirname, 'stigtools_test_engine')
+				self.assertIsNot(engine.tcrConfig, stigtools.tcrConfig)
+				self.assertEqual(engine.tcrConfig.__module__, 'stigtools_test_engine.stigtools')
+				with self.assertRaises(ValueError):
+						stigtools.equivalence.loadEngine(os.path.join(dirname, 'missing'), 'stigtools_missing')
+
+
+class TestCheckpoint(unittest.TestCase):
+		def setUp(self):
+				self.tempdir = tempfile.mkdtemp()
+				self.filename = os.path.join(self.tempdir, 'run.checkpoint')
+				self.config = stigtools.tcrConfig()
+				self.config.setWorkingDir('./data', reference=False)
+
+		def tearDown(self):
+				shutil.rmtree(self.tempdir)
+
+		# getCheckpoint - Return a checkpoint saved at every chance, which stops the run as if it were killed once stopAfter are saved
+		def getCheckpoint(self, stopAfter=None):
+				checkpoint = stigtools.tcrCheckpoint(self.filename, interval=0)
+				save = checkpoint.save
+				saved = []
+				def stop(*args, **kwargs):
+						save(*args, **kwargs)
+						saved.append(args[0])
+						if len(saved) == stopAfter:
+								raise StoppedRun()
+				checkpoint.save = stop
+				return checkpoint
+
+		def test_repertoire(self):
+				filename = os.path.join(self.tempdir, 'run.population.bin')
+				self.config.random.seed(3)
+				expected = stigtools.tcrRepertoire(self.config, 12, uniqueCDR3=True)
+
+				self.config.random.seed(3)
+				with self.assertRaises(StoppedRun):
+						stigtools.buildRepertoire(self.config, 12, filename, blockSize=5, checkpoint=self.getCheckpoint(7), uniqueCDR3=True)
+				self.config.random.seed(100) # A resumed run does not start from the same random state
+				resume = self.getCheckpoint().load(self.config)
+				self.assertEqual((resume['stage'], resume['state']['clones'], len(resume['clones'])), ('tcrRepertoire', 7, 2))
+				built = stigtools.buildRepertoire(self.config, 12, filename, blockSize=5, resume=resume, uniqueCDR3=True)
+				self.assertEqual([ x.getCDR3Sequences() for x in built.repertoire ], [ x.getCDR3Sequences() for x in expected.repertoire ])
+				self.assertEqual(built.summary.getDict(), expected.summary.getDict())
+
+		def test_pipeline(self):
+				repertoire = stigtools.tcrRepertoire(self.config, 4)
+				repertoire.populate(20, 'stripe')
+				def getPipeline():
+						return stigtools.tcrReadPipeline(repertoire, 'rna', { 'read_type': 'paired', 'read_length_mean': 20 }, chunkSize=6, seed=3, truth=True, coverage=True)
+				expected = getPipeline()
+				outputs = [ io.BytesIO() for i in range(0, 3) ]
+				expected.run(40, outputs[0:2], truthOutput=outputs[2])
+
+				filenames = [ os.path.join(self.tempdir, x) for x in ('1.fastq', '2.fastq', 'truth.tsv') ]
+				files = [ open(x, 'wb') for x in filenames ]
+				with self.assertRaises(StoppedRun):
+						getPipeline().run(40, files[0:2], truthOutput=files[2], checkpoint=self.getCheckpoint(4))
+				for fp in files:
+						fp.close()
+				checkpoint = self.getCheckpoint()
+				resume = checkpoint.load(self.config)
+				self.assertEqual((resume['stage'], resume['state']['chunks']), ('simulateRead', 3))
+				files = [ open(x, 'r+b') for x in filenames ]
+				pipeline = getPipeline()
+				pipeline.run(40, files[0:2], truthOutput=files[2], checkpoint=checkpoint, resume=resume)
+				for fp, output in zip(files, outputs):
+						fp.close()
+						with open(fp.name, 'rb') as fp:
+								self.assertEqual(fp.read(), output.getvalue())
+				arrays = pipeline.coverage.getArrays()
+				for name, array in expected.coverage.getArrays().items():
+						self.assertEqual(array.tolist(), arrays[name].tolist())
+
+		def test_compressed_arrays(self):
+				coverage = numpy.repeat(numpy.arange(0, 50, dtype=numpy.uint32), 1000)
+				stigtools.tcrCheckpoint(self.filename).save('simulateRead', {}, arrays={ 'coverage': coverage, 'empty': numpy.zeros(0, dtype=numpy.int64) })
+				self.assertLess(os.path.getsize(self.filename), coverage.nbytes // 10)
+				resume = stigtools.tcrCheckpoint(self.filename).load(self.config)
+				self.assertEqual(resume['arrays']['coverage'].tolist(), coverage.tolist())
+				self.assertEqual(resume['arrays']['empty'].tolist(), [])
+
+
+class TestTcrServer(unittest.TestCase):
+		def setUp(self):
+				self.tempdir = tempfile.mkdtemp()
+
+		def tearDown(self):
+				shutil.rmtree(self.tempdir)
+
+		def test_jobs(self):
+				output = os.path.join(self.tempdir, 'out')
+				job = [ '--reference-free', '--sequence-type=rna', '--repertoire-size=2', '--sequence-count=10', '--output', output, './data' ]
+				requests = [ { 'id': 1, 'args': job },
+										 { 'id': 2, 'args': job + [ '--load-population', output + '.population.bin', '--output', output + '2' ] },
+										 { 'id': 3, 'args': [ '--no-such-option' ] },
+										 { 'command': 'status' },
+										 { 'command': 'shutdown' },
+										 { 'command': 'ping' } ]
+				server = stigtools.tcrServer()
+				responses = io.StringIO()
+				server.serveStream(io.StringIO("\n".join(json.dumps(x) for x in requests) + "\n"), responses)
+				responses = [ json.loads(x) for x in responses.getvalue().splitlines() ]
+
+				self.assertEqual([ x['status'] for x in responses ], [ 0, 0, 2, 0, 0 ])
+				self.assertEqual(len(responses[3]['working_dirs']), 1)
+				self.assertEqual(len(responses[3]['populations']), 1)
+				self.assertTrue(os.path.isfile(output + '.fastq'))
+				self.assertTrue(os.path.isfile(output + '2.fastq'))
+
+
+class TestBatch(unittest.TestCase):
+		def setUp(self):
+				self.tempdir = tempfile.mkdtemp()
+
+		def tearDown(self):
+				shutil.rmtree(self.tempdir)
+
+		def test_manifest(self):
+				manifest = os.path.join(self.tempdir, 'study.yaml')
+				with open(manifest, 'w') as fp:
+						fp.write("defaults:\n"
+										 "  working_dir: %s\n"
+										 "  reference-free: true\n"
+										 "  sequence-type: rna\n"
+										 "repertoires:\n"
+										 "  study:\n"
+										 "    repertoire-size: 3\n"
+										 "samples:\n"
+										 "  - output: s1\n"
+										 "    repertoire: study\n"
+										 "    sequence-count: 10\n"
+										 "    processes: 2\n"
+										 "  - output: s2\n"
+										 "    repertoire: study\n"
+										 "    read-type: paired\n"
+										 "    sequence-count: 5\n" % os.path.abspath('./data'))
+				results = stigtools.batch.runBatch(manifest, processes=2)
+
+				# s1 generates its reads in a single process, as batch workers cannot start processes
+				self.assertEqual([ (x['name'], x['status'], x['error']) for x in results ], [ ('study', 0, None), ('s1', 0, None), ('s2', 0, None) ])
+				self.assertTrue(os.path.isfile(os.path.join(self.tempdir, 'study.population.bin')))
+				with open(os.path.join(self.tempdir, 's1.fastq')) as fp:
+						self.assertEqual(len(fp.readlines()), 40)
+				self.assertTrue(os.path.isfile(os.path.join(self.tempdir, 's2_R2.fastq')))
+
+				# Samples must name a repertoire listed in the manifest
+				with open(manifest, 'a') as fp:
+						fp.write("  - repertoire: other\n")
+				with self.assertRaises(ValueError):
+						stigtools.batch.readManifest(manifest)
+
+
+class TestSyntheticReference(unittest.TestCase):
+		def setUp(self):
+				self.tempdir = tempfile.mkdtemp()
+				self.lengths = stigtools.makeSyntheticReference('./data', self.tempdir, seed=1)
+				self.config = stigtools.tcrConfig(log = myLog.getChild('tcrConfig'))
+				self.config.setWorkingDir(self.tempdir)
+
+		def tearDown(self):
+				shutil.rmtree(self.tempdir)
+
+		def test_allele_sequences(self):
+				# Every V, D and J allele should be found at its coordinates
+				for segment in self.config.receptorSegment:
+						if not re.match('^[VDJ]-REGION$', segment['region']):
+								continue
+						self.assertTrue(segment['end_position'] <= self.lengths[re.match('^\\d+', segment['chromosome']).group(0)])
+						allele = segment['allele'][sorted(segment['allele'].keys())[0]].upper()
+						if len(allele) == segment['end_position'] - segment['start_position'] + 1:
+								chromosome = int(re.match('^\\d+', segment['chromosome']).group(0))
+								self.assertEqual(self.config.readChromosome(chromosome, segment['start_position'], segment['end_position'], segment['strand']), allele)
+
+
+class TestPopulationFile(unittest.TestCase):
+		def setUp(self):
+				(self.tempfilehandle, self.tempfilename) = tempfile.mkstemp()
+				self.config = stigtools.tcrConfig()
+
+				# Build a small repertoire by hand, so no reference data is needed
+				self.repertoire = stigtools.tcrRepertoire(self.config, 0)
+				for i in range(0, 5):
+						clone = stigtools.tcr(0.9, self.config)
+						clone.type1, clone.type2 = ('A', 'B') if i % 2 == 0 else ('G', 'D')
+						clone.V1, clone.J1, clone.C1 = (i, '01'), (i + 10, '02'), (i + 20, '01')
+						clone.V2, clone.D2, clone.J2, clone.C2 = (i + 30, '01'), (i + 40, '01'), (i + 50, '01'), (i + 60, '03')
+						clone.DNA1 = (14, 100 + i, 'forward', 'ACGT' * (i + 1), 200 + i, 'forward')
+						clone.RNA1 = (14, 100 + i, 'forward', 'ACG' * (i + 1), 200 + i, 'forward')
+						clone.DNA2 = (7, 300 + i, 'reverse', 'TTGA' * (i + 2), 250 + i, 'forward')
+						clone.RNA2 = (7, 300 + i, 'reverse', 'TTG' * (i + 2), 250 + i, 'forward')
+						self.repertoire.repertoire.append(clone)
+				self.repertoire.population = [3, 0, 7, 1, 9]
+				self.repertoire.population_size = 20
+				self.repertoire.distribution = 'equal'
+
+		def tearDown(self):
+				os.close(self.tempfilehandle)
+				os.remove(self.tempfilename)
+
+		def assertSameRepertoire(self, loaded):
+				self.assertEqual(list(loaded.population), self.repertoire.population)
+				self.assertEqual(loaded.population_size, self.repertoire.population_size)
+				self.assertEqual(loaded.distribution, self.repertoire.distribution)
+				self.assertEqual(len(loaded.repertoire), len(self.repertoire.repertoire))
+				for original, clone in zip(self.repertoire.repertoire, loaded.repertoire):
+						for name in ('type1', 'type2', 'V1', 'D1', 'J1', 'C1', 'V2', 'D2', 'J2', 'C2', 'DNA1', 'RNA1', 'DNA2', 'RNA2'):
+								self.assertEqual(getattr(clone, name), getattr(original, name))
+						self.assertTrue(clone.config is self.config)
+
+		def test_round_trip(self):
+				stigtools.savePopulation(self.repertoire, self.tempfilename, blockSize=2)
+				self.assertTrue(stigtools.isPopulationFile(self.tempfilename))
+				self.assertSameRepertoire(stigtools.loadPopulation(self.tempfilename, self.config))
+
+		def test_convert_pickle(self):
+				(handle, pickleFilename) = tempfile.mkstemp()
+				os.close(handle)
+				with open(pickleFilename, 'wb') as fp:
+						pickle.dump(self.repertoire.freeze(), fp)
+				self.repertoire.thaw(config=self.config)
+				self.assertFalse(stigtools.isPopulationFile(pickleFilename))
+				self.assertSameRepertoire(stigtools.loadPopulation(pickleFilename, self.config))
+
+				stigtools.convertPopulation(pickleFilename, self.tempfilename, self.config)
+				os.remove(pickleFilename)
+				self.assertSameRepertoire(stigtools.loadPopulation(self.tempfilename, self.config))
+
+		def test_convert_baseline_pickle(self):
+				# Repertoires pickled by STIG 0.6 have only these attributes
+				def getBaselineObject(source, cls, names):
+						value = cls.__new__(cls)
+						value.__dict__ = dict([ (x, getattr(source, x)) for x in names ] + [ ('config', None), ('log', None) ])
+						return value
+				baseline = getBaselineObject(self.repertoire, stigtools.tcrRepertoire, ('AB_frequency', 'population', 'population_size', 'distribution', 'distribution_options'))
+				baseline.repertoire = [ getBaselineObject(x, stigtools.tcr, ('AB_frequency', 'type1', 'type2', 'V1', 'D1', 'J1', 'C1', 'V2', 'D2', 'J2', 'C2', 'DNA1', 'RNA1', 'DNA2', 'RNA2'))
+																for x in self.repertoire.repertoire ]
+				(handle, pickleFilename) = tempfile.mkstemp()
+				os.close(handle)
+				with open(pickleFilename, 'wb') as fp:
+						pickle.dump(baseline, fp)
+
+				loaded = stigtools.loadPopulation(pickleFilename, self.config)
+				self.assertSameRepertoire(loaded)
+				self.assertEqual(sum(stigtools.subsampleRepertoire(loaded, 10).population), 10)
+				stigtools.convertPopulation(pickleFilename, self.tempfilename, self.config)
+				os.remove(pickleFilename)
+				self.assertSameRepertoire(stigtools.loadPopulation(self.tempfilename, self.config))
+
+		def test_failed_save(self):
+				# A file that cannot be completed is removed
+				filename = self.tempfilename + '.bin'
+				self.repertoire.population = None
+				with self.assertRaises(Exception):
+						stigtools.savePopulation(self.repertoire, filename)
+				self.assertFalse(os.path.exists(filename))
+
+		def test_truncated_file(self):
+				stigtools.savePopulation(self.repertoire, self.tempfilename)
+				with open(self.tempfilename, 'r+b') as fp:
+						fp.truncate(os.path.getsize(self.tempfilename) - 4)
+				with self.assertRaises(ValueError):
+						stigtools.loadPopulation(self.tempfilename, self.config)
+
+		def test_append(self):
+				clones = self.repertoire.repertoire
+				self.repertoire.repertoire = clones[:3]
+				stigtools.savePopulation(self.repertoire, self.tempfilename, blockSize=2)
+				with open(self.tempfilename, 'rb') as fp:
+						original = fp.read()
+				loaded = stigtools.loadPopulation(self.tempfilename, self.config)
+				for clone in clones[3:]:
+						loaded.repertoire.append(clone)
+				loaded.population = self.repertoire.population = [3, 0, 7, 1, 9]
+				stigtools.appendPopulation(loaded, self.tempfilename)
+				self.repertoire.repertoire = clones
+				self.assertSameRepertoire(stigtools.loadPopulation(self.tempfilename, self.config))
+
+				# A failed append leaves the file as it was
+				with open(self.tempfilename, 'wb') as fp:
+						fp.write(original)
+				loaded = stigtools.loadPopulation(self.tempfilename, self.config)
+				clone = stigtools.tcr(0.9, self.config)
+				clone.__dict__.update(clones[3].__dict__)
+				clone.RNA1 = (14, 100, 'sideways', 'ACG', 200, 'forward')
+				loaded.repertoire.append(clone)
+				loaded.population = [3, 0, 7, 1]
+				with self.assertRaises(KeyError):
+						stigtools.appendPopulation(loaded, self.tempfilename)
+				with open(self.tempfilename, 'rb') as fp:
+						self.assertEqual(fp.read(), original)
+
+		def test_extend(self):
+				config = stigtools.tcrConfig()
+				config.setWorkingDir('./data', reference=False)
+				repertoire = stigtools.tcrRepertoire(config, 10, uniqueCDR3=True)
+				repertoire.populate(30, 'stripe')
+				stigtools.savePopulation(repertoire, self.tempfilename)
+
+				loaded = stigtools.loadPopulation(self.tempfilename, config)
+				self.assertTrue(loaded.uniqueCDR3)
+				self.assertEqual(loaded.extend(5), 10)
+				loaded.populate(10, 'stripe', first=10)
+				self.assertEqual(loaded.population.tolist(), [3] * 10 + [2] * 5)
+				self.assertEqual(loaded.population_size, 40)
+				self.assertEqual(loaded.summary.clones, 15)
+				stigtools.appendPopulation(loaded, self.tempfilename)
+
+				extended = stigtools.loadPopulation(self.tempfilename, config)
+				self.assertEqual(len(extended.repertoire), 15)
+				self.assertEqual(extended.population.tolist(), loaded.population.tolist())
+				for i in range(0, 10):
+						self.assertEqual(extended.repertoire[i].getCDR3Sequences(), repertoire.repertoire[i].getCDR3Sequences())
+				cdr3s = [ x for i in range(0, 15) for x in extended.repertoire[i].getCDR3Sequences() ]
+				self.assertEqual(len(set(cdr3s)), 30)
+
+		def test_build(self):
+				config = stigtools.tcrConfig()
+				config.setWorkingDir('./data', reference=False)
+				config.random.seed(7)
+				repertoire = stigtools.tcrRepertoire(config, 10, uniqueCDR3=True)
+				repertoire.populate(30, 'stripe')
+
+				config.random.seed(7)
+				built = stigtools.buildRepertoire(config, 10, self.tempfilename, blockSize=4, cacheSize=3, uniqueCDR3=True)
+				self.assertEqual(len(built.repertoire), 10)
+				built.populate(30, 'stripe')
+				self.assertEqual(built.population.tolist(), list(repertoire.population))
+				for i in range(0, 10):
+						self.assertEqual(built.repertoire[i].getCDR3Sequences(), repertoire.repertoire[i].getCDR3Sequences())
+						self.assertEqual(built.repertoire[i].RNA1, repertoire.repertoire[i].RNA1)
+				self.assertEqual(built.summary.clones, 10)
+
+				stigtools.appendPopulation(built, self.tempfilename)
+				loaded = stigtools.loadPopulation(self.tempfilename, config)
+				self.assertTrue(loaded.uniqueCDR3)
+				self.assertEqual(loaded.population.tolist(), built.population.tolist())
+				self.assertEqual(loaded.population_size, 30)
+
+
+class TestSampling(unittest.TestCase):
+		def setUp(self):
+				self.tempdir = tempfile.mkdtemp()
+				self.config = stigtools.tcrConfig()
+				self.config.setWorkingDir('./data', reference=False)
+
+		def tearDown(self):
+				shutil.rmtree(self.tempdir)
+
+		def test_subsample(self):
+				generator = numpy.random.default_rng(5)
+				population = numpy.array([10, 0, 3, 500, 7])
+				sample = stigtools.subsamplePopulation(population, 100, generator)
+				self.assertEqual(int(sample.sum()), 100)
+				self.assertTrue(numpy.all(sample <= population))
+				self.assertEqual(stigtools.subsamplePopulation(population, 520, generator).tolist(), population.tolist())
+				with self.assertRaises(ValueError):
+						stigtools.subsamplePopulation(population, 521, generator)
+
+				# Populations too large for numpy's draws are divided recursively
+				population = numpy.array([4 * 10**9, 10**9, 0, 5 * 10**9, 3])
+				sample = stigtools.subsamplePopulation(population, 10**9, generator)
+				self.assertEqual(int(sample.sum()), 10**9)
+				self.assertTrue(numpy.all(sample <= population))
+				self.assertLess(abs(int(sample[3]) - 5 * 10**8), 10**6)
+
+		def test_subsample_repertoire(self):
+				repertoire = stigtools.tcrRepertoire(self.config, 10)
+				repertoire.populate(100, 'stripe')
+				sampled = stigtools.subsampleRepertoire(repertoire, 40)
+				self.assertEqual(repertoire.population.tolist(), [10] * 10)
+				self.assertEqual(int(sampled.population.sum()), 40)
+				self.assertTrue(sampled.repertoire is repertoire.repertoire)
+				self.assertEqual(sampled.summary.getDict()['cells'], 40)
+				self.assertEqual(sampled.summary.getDict()['clones'], 10)
+
+		def test_subsample_over_source(self):
+				repertoire = stigtools.tcrRepertoire(self.config, 5)
+				repertoire.populate(50, 'stripe')
+				basename = os.path.join(self.tempdir, 'study')
+				stigtools.savePopulation(repertoire, basename + '.population.bin')
+				with open(basename + '.population.bin', 'rb') as fp:
+						original = fp.read()
+				argv = [ '--load-population', basename + '.population.bin', '--subsample-cells', '10', '--reference-free', '--sequence-type', 'rna',
+								 '--sequence-count', '5', '--output', basename, '--log-level', 'critical', './data' ]
+				self.assertEqual(stigtools.cli.run(stigtools.cli.getParser().parse_args(argv)), -1)
+				with open(basename + '.population.bin', 'rb') as fp:
+						self.assertEqual(fp.read(), original)
+				self.assertFalse(os.path.exists(basename + '.fastq'))
+
+		def test_mix(self):
+				filenames = []
+				for name, size, cells in (('tumor', 6, 600), ('normal', 4, 40)):
+						repertoire = stigtools.tcrRepertoire(self.config, size)
+						repertoire.populate(cells, 'stripe')
+						filenames.append(os.path.join(self.tempdir, name + '.population.bin'))
+						stigtools.savePopulation(repertoire, filenames[-1])
+				output = os.path.join(self.tempdir, 'mixed.population.bin')
+				counts = stigtools.mixPopulations(filenames, [3, 1], output, numpy.random.default_rng(1))
+				self.assertEqual(counts.tolist(), [120, 40])
+
+				mixed = stigtools.loadPopulation(output, self.config)
+				self.assertEqual(len(mixed.repertoire), 10)
+				self.assertEqual(int(mixed.population[:6].sum()), 120)
+				self.assertEqual(mixed.population[6:].tolist(), [10] * 4)
+				normal = stigtools.loadPopulation(filenames[1], self.config)
+				self.assertEqual(mixed.repertoire[7].getCDR3Sequences(), normal.repertoire[1].getCDR3Sequences())
+
+				with self.assertRaises(ValueError):
+						stigtools.mixPopulations(filenames, [1, 1], output, numpy.random.default_rng(1), cells=100)
+
+
+class TestChainLibrary(unittest.TestCase):
+		def setUp(self):
+				(self.tempfilehandle, self.tempfilename) = tempfile.mkstemp()
+				self.config = stigtools.tcrConfig()
+				self.config.setWorkingDir('./data', reference=False)
+				self.config.random.seed(5)
+				stigtools.buildChainLibrary(self.config, self.tempfilename, 20)
+
+		def tearDown(self):
+				os.close(self.tempfilehandle)
+				os.remove(self.tempfilename)
+
+		def test_library(self):
+				library = stigtools.tcrChainLibrary(self.tempfilename, self.config)
+				self.assertEqual([ library.getCount(x) for x in 'ABGD' ], [ 20, 20, 20, 20 ])
+				for receptorType in 'ABGD':
+						chains = library.getChains(receptorType)
+						self.assertEqual(sum(library.getVJUsage(receptorType).values()), 20)
+						for chain, cdr3 in chains:
+								self.assertEqual(self.config.getCDR3Sequence(self.config.getChainSequence(chain, 'rna')[3]) or '', cdr3)
+								self.assertIn((chain, cdr3), library.findChains(receptorType, chain.V[0], chain.J[0], cdr3))
+
+				repertoire = stigtools.tcrRepertoire(self.config, 10, uniqueCDR3=True, library=library)
+				cdr3s = [ cdr3 for clone in repertoire.repertoire for cdr3 in clone.getCDR3Sequences() ]
+				self.assertEqual(len(set(cdr3s)), len(cdr3s))
+				for clone in repertoire.repertoire:
+						self.assertIn(clone.chain1, [ x[0] for x in library.getChains(clone.type1) ])
+						self.assertEqual((clone.V2, clone.J2), (clone.chain2.V, clone.chain2.J))
+
+		def test_too_small(self):
+				library = stigtools.tcrChainLibrary(self.tempfilename, self.config)
+				stigtools.tcrRepertoire.maxLibraryDuplicates = 100
+				try:
+						with self.assertRaises(ValueError):
+								stigtools.tcrRepertoire(self.config, 50, uniqueCDR3=True, AB_frequency=1, library=library)
+				finally:
+						stigtools.tcrRepertoire.maxLibraryDuplicates = 10000
+
+
+class TestTcrChain(unittest.TestCase):
+		def makeChain(self, **kwargs):
+				fields = dict(receptorType='B', V=(1, '01'), D=(2, '01'), J=(3, '01'), C=(4, '01'), lAllele='01',
+											vChewback=2, d5Chewback=0, d3Chewback=1, jChewback=3, n1Insert='AC', n2Insert='G')
+				fields.update(kwargs)
+				return stigtools.tcrChain(**fields)
+
+		def test_equality(self):
+				self.assertEqual(self.makeChain(), self.makeChain())
+				self.assertEqual(hash(self.makeChain()), hash(self.makeChain()))
+				self.assertNotEqual(self.makeChain(), self.makeChain(n2Insert='T'))
+				self.assertNotEqual(self.makeChain(), self.makeChain(D=None))
+				self.assertEqual(len(set([self.makeChain(), self.makeChain(), self.makeChain(jChewback=0)])), 2)
+
+		def test_legacy_clone_state(self):
+				# Clones pickled by earlier versions hold their sequences as attributes
+				config = stigtools.tcrConfig()
+				clone = stigtools.tcr(0.9, config)
+				state = dict(clone.__dict__)
+				for name in ('sequences', 'chain1', 'chain2'):
+						del state[name]
+				state['DNA1'] = (14, 100, 'forward', 'ACGT', 200, 'forward')
+				state['RNA1'] = (14, 100, 'forward', 'ACG', 200, 'forward')
+				legacy = stigtools.tcr.__new__(stigtools.tcr)
+				legacy.__setstate__(dict(state))
+				self.assertEqual(legacy.DNA1, state['DNA1'])
+				self.assertEqual(legacy.RNA1, state['RNA1'])
+				self.assertEqual(legacy.DNA2, ())
+
+
 class TestTcr(unittest.TestCase):
 		def setUp(self):
 				self.config = stigtools.tcrConfig()